@@ -1,23 +1,18 @@
 import os
 import json
-import io
-import zipfile
 import logging
 from flask import Flask, render_template, request, Response, send_file
-from main import generate_project_stream
+from archive import get_archive_cache, project_fingerprint
+from jobs import QueueFullError, get_job_manager
+from logging_config import setup_logging
+from main import workspace_dir
+from metrics import REGISTRY, timed
 
 app = Flask(__name__)
 app.debug = True  # Set to False in production
 
-# Configure logging (optional but recommended)
-logging.basicConfig(
-    level=logging.INFO,  # Change to DEBUG for more detailed logs
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    handlers=[
-        logging.FileHandler("mas.log"),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: records are queued and written to the rotating mas.log by a background thread
+setup_logging(level=logging.INFO)  # Change to DEBUG for more detailed logs
 logger = logging.getLogger(__name__)
 
 @app.route('/')
@@ -31,26 +26,107 @@ def index():
 def generate_stream():
     """
     SSE endpoint for real-time streaming of agent responses.
+    The run is queued as a durable job; the first event carries its job_id, which
+    /jobs/<job_id>/events accepts to resume the stream after a disconnect.
     Expects GET params: ?description=...&lang=...
+    Optional: &no_cache=1 to bypass the response cache for this run,
+              &full_rebuild=1 to regenerate every file instead of only changed ones,
+              &workspace=<job_id> to continue in the workspace of an earlier run (each run
+              otherwise gets a fresh workspace named after its job ID).
+    The run is charged to the user authenticated by the server in front of the app (REMOTE_USER),
+    or else to the client's address; client-supplied names are ignored, so they cannot be used to
+    get a fresh user budget (see budget.py).
+    Returns 503 when the job queue is full (MAS_MAX_QUEUED_JOBS).
     """
     description = request.args.get('description', '').strip()
     coding_language = request.args.get('lang', 'Python').strip()
+    use_cache = request.args.get('no_cache', '0').lower() not in ('1', 'true', 'yes')
+    incremental = request.args.get('full_rebuild', '0').lower() not in ('1', 'true', 'yes')
+    workspace = request.args.get('workspace', '').strip()
+    user = request.remote_user or f"ip:{request.remote_addr or 'unknown'}"
 
     if not description:
         return Response(json.dumps({"error": "No project description provided."}), mimetype='application/json'), 400
 
+    options = {"use_cache": use_cache, "incremental": incremental, "user": user}
+    if workspace:
+        try:
+            workspace_exists = os.path.isdir(workspace_dir(workspace))
+        except ValueError:
+            workspace_exists = False
+        if not workspace_exists:
+            return Response(json.dumps({"error": f"Workspace '{workspace}' not found."}),
+                            mimetype='application/json'), 404
+        options["run_id"] = workspace
+
+    try:
+        job_id = get_job_manager().submit(description, coding_language, options)
+    except QueueFullError as e:
+        logger.warning(f"Rejected generation request: {e}")
+        return Response(json.dumps({"error": str(e)}), mimetype='application/json',
+                        headers={'Retry-After': '30'}), 503
+    return job_event_response(job_id, last_event_id=0)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    SSE endpoint to (re)attach to a generation job.
+    Replays every event after the Last-Event-ID header (sent by EventSource on reconnect)
+    or the ?last_event_id=... parameter, then follows the job until it finishes.
+    """
+    if get_job_manager().store.get_job(job_id) is None:
+        return Response(json.dumps({"error": f"Job '{job_id}' not found."}), mimetype='application/json'), 404
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '0')
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        last_event_id = 0
+    return job_event_response(job_id, last_event_id)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Returns the status of a generation job as JSON.
+    """
+    job = get_job_manager().store.get_job(job_id)
+    if job is None:
+        return Response(json.dumps({"error": f"Job '{job_id}' not found."}), mimetype='application/json'), 404
+    status = {key: job[key] for key in ("id", "language", "status", "error", "created_at", "updated_at")}
+    return Response(json.dumps(status), mimetype='application/json')
+
+def job_event_response(job_id, last_event_id):
     def event_stream():
-        # Each chunk is JSON text from main.generate_project_stream
-        for chunk in generate_project_stream(description, coding_language):
-            # SSE format requires "data: ...\n\n"
-            yield f"data: {chunk}\n\n"
+        # Each event is JSON text from main.generate_project_stream, persisted by the job manager
+        for event in get_job_manager().subscribe(job_id, last_event_id):
+            if event is None:
+                # Comment line: keeps idle connections from being dropped by proxies
+                yield ": keep-alive\n\n"
+                continue
+            seq, data = event
+            # SSE format requires "data: ...\n\n"; the id lets the browser resume from here
+            yield f"id: {seq}\ndata: {data}\n\n" if seq is not None else f"data: {data}\n\n"
 
-    return Response(event_stream(), mimetype='text/event-stream')
+    # Disable proxy buffering so streamed tokens reach the browser immediately
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(event_stream(), mimetype='text/event-stream', headers=headers)
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus scrape endpoint: model call latency, tokens, retries and cache hits
+    per agent and model, plus timings of flow parsing, file writes and ZIP builds.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def is_safe_name(name):
+    # Allow only alphanumeric characters, underscores, and hyphens
+    return bool(name) and (name.isidentifier() or all(c.isalnum() or c in ('-', '_') for c in name))
 
 @app.route('/download_project/<project_name>')
 def download_project(project_name):
     """
-    Endpoint to download a specific generated project as a ZIP archive.
+    Endpoint to download a project generated outside a job (CLI runs) as a ZIP archive.
     Access via: http://127.0.0.1:5000/download_project/<project_name>
     
     Parameters:
@@ -60,15 +136,33 @@ def download_project(project_name):
         - Validates the project_name to prevent directory traversal attacks.
         - Ensures the project exists within the 'generated_projects' directory.
     """
-    # Define the base directory where all projects are stored
-    base_dir = 'generated_project'
-    
     # Sanitize the project_name to prevent directory traversal
-    # Allow only alphanumeric characters, underscores, and hyphens
-    if not project_name.isidentifier() and not all(c.isalnum() or c in ('-', '_') for c in project_name):
+    if not is_safe_name(project_name):
         logger.warning(f"Invalid project name attempted for download: {project_name}")
         return Response(json.dumps({"error": "Invalid project name."}), mimetype='application/json'), 400
+    return send_project_archive(workspace_dir(), project_name, project_name)
+
+@app.route('/download_project/<run_id>/<project_name>')
+def download_run_project(run_id, project_name):
+    """
+    Endpoint to download the project of a generation job from its workspace.
+    Access via: http://127.0.0.1:5000/download_project/<job_id>/<project_name>
+    """
+    if not is_safe_name(run_id) or not is_safe_name(project_name):
+        logger.warning(f"Invalid download attempted: {run_id}/{project_name}")
+        return Response(json.dumps({"error": "Invalid project name."}), mimetype='application/json'), 400
+    try:
+        base_dir = workspace_dir(run_id)
+    except ValueError:
+        return Response(json.dumps({"error": "Invalid run ID."}), mimetype='application/json'), 400
+    return send_project_archive(base_dir, project_name, f"{run_id}-{project_name}")
 
+def send_project_archive(base_dir, project_name, cache_name):
+    """
+    Sends base_dir/project_name as a ZIP archive. The archive is streamed while it is compressed
+    and kept in the archive cache (MAS_ARCHIVE_CACHE_DIR) under `cache_name`; downloads of an
+    unchanged project are served from the cache with ETag and Range support.
+    """
     # Construct the absolute path to the project directory
     project_dir = os.path.join(base_dir, project_name)
     
@@ -78,29 +172,36 @@ def download_project(project_name):
         return Response(json.dumps({"error": f"Project '{project_name}' not found."}), mimetype='application/json'), 404
 
     try:
-        # Create a BytesIO buffer to hold the ZIP archive in memory
-        memory_file = io.BytesIO()
-
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            # Walk through the project directory and add files to the ZIP archive
-            for root, dirs, files in os.walk(project_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # To maintain the folder structure in the ZIP
-                    arcname = os.path.relpath(file_path, start=project_dir)
-                    zf.write(file_path, arcname)
-
-        memory_file.seek(0)  # Reset buffer pointer to the beginning
-
-        # Send the ZIP file as a downloadable response
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'{project_name}.zip'  # For Flask >= 2.0
-            # For older Flask versions, use 'attachment_filename' instead of 'download_name'
-            # attachment_filename=f'{project_name}.zip',
-        )
+        # The fingerprint changes whenever a file of the project is rewritten
+        fingerprint = project_fingerprint(project_dir)
+        archive_cache = get_archive_cache()
+
+        cached_archive = archive_cache.lookup(cache_name, fingerprint)
+        if cached_archive:
+            # Unchanged project: serve the cached file (handles If-None-Match and Range requests)
+            return send_file(
+                os.path.abspath(cached_archive),
+                mimetype='application/zip',
+                as_attachment=True,
+                download_name=f'{project_name}.zip',
+                etag=fingerprint,
+                conditional=True,
+            )
+
+        if fingerprint in request.if_none_match:
+            return Response(status=304, headers={'ETag': f'"{fingerprint}"'})
+
+        def zip_stream():
+            # Chunks are sent as they are compressed, and saved to the archive cache for the next download
+            with timed("zip_build"):
+                yield from archive_cache.stream_and_store(cache_name, project_dir, fingerprint)
+
+        headers = {
+            'Content-Disposition': f'attachment; filename="{project_name}.zip"',
+            'ETag': f'"{fingerprint}"',
+            'X-Accel-Buffering': 'no',
+        }
+        return Response(zip_stream(), mimetype='application/zip', headers=headers)
     except Exception as e:
         logger.error(f"Error while zipping the project '{project_name}': {e}")
         return Response(json.dumps({"error": "Failed to create ZIP archive."}), mimetype='application/json'), 500
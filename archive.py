@@ -0,0 +1,198 @@
+import os
+import glob
+import time
+import hashlib
+import logging
+import zipfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_CACHE_DIR = os.path.join(".mas_cache", "archives")
+# Archives kept, and for how long since their last download (0 = no limit)
+DEFAULT_MAX_ARCHIVES = 200
+DEFAULT_ARCHIVE_TTL = 7 * 24 * 3600
+CHUNK_SIZE = 64 * 1024
+
+
+def project_files(project_dir):
+    """
+    Yields (file_path, arcname) for every file of the project, in a stable order.
+    """
+    for root, dirs, files in os.walk(project_dir):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            # To maintain the folder structure in the ZIP
+            yield file_path, os.path.relpath(file_path, start=project_dir).replace(os.sep, "/")
+
+
+def project_fingerprint(project_dir):
+    """
+    Hash of every file's path, size and modification time; changes whenever the project is regenerated.
+    """
+    digest = hashlib.sha256()
+    for file_path, arcname in project_files(project_dir):
+        stat = os.stat(file_path)
+        digest.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class _StreamBuffer:
+    """
+    Write-only file object that collects what ZipFile writes until it is drained.
+    ZipFile falls back to data descriptors because the stream cannot seek.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip_chunks(project_dir, chunk_size=CHUNK_SIZE):
+    """
+    Compresses the project into a ZIP archive, yielding bytes as soon as each chunk is compressed,
+    so nothing but the current chunk is held in memory.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for file_path, arcname in project_files(project_dir):
+            info = zipfile.ZipInfo.from_file(file_path, arcname)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(file_path, "rb") as src, zf.open(info, "w") as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    # Central directory, written when the ZipFile is closed
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+class ArchiveCache:
+    """
+    On-disk cache of project archives keyed by project fingerprint.
+    The first download of a project version streams the archive to the client while writing it
+    to the cache; later downloads of the same version are served from the cached file.
+    Archives not downloaded for `ttl` seconds, and the least recently downloaded beyond
+    `max_entries`, are removed whenever a new archive is stored.
+    """
+    def __init__(self, cache_dir=DEFAULT_ARCHIVE_CACHE_DIR, max_entries=DEFAULT_MAX_ARCHIVES,
+                 ttl=DEFAULT_ARCHIVE_TTL):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def archive_path(self, project_name, fingerprint):
+        return os.path.join(self.cache_dir, f"{project_name}-{fingerprint}.zip")
+
+    def lookup(self, project_name, fingerprint):
+        path = self.archive_path(project_name, fingerprint)
+        try:
+            # The modification time records the last download, for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def stream_and_store(self, project_name, project_dir, fingerprint):
+        """
+        Yields the archive's chunks. Unless another request is already building this version,
+        the chunks are also written to the cache, which is committed only if the archive completes
+        and the project did not change meanwhile.
+        """
+        key = (project_name, fingerprint)
+        with self._lock:
+            store = key not in self._building
+            if store:
+                self._building.add(key)
+
+        if not store:
+            yield from iter_zip_chunks(project_dir)
+            return
+
+        final_path = self.archive_path(project_name, fingerprint)
+        tmp_path = f"{final_path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as cache_file:
+                for chunk in iter_zip_chunks(project_dir):
+                    cache_file.write(chunk)
+                    yield chunk
+            if project_fingerprint(project_dir) == fingerprint:
+                os.replace(tmp_path, final_path)
+                self._remove_stale(project_name, final_path)
+                self._evict()
+                logger.info(f"Cached archive {final_path}.")
+        finally:
+            # Also reached when the client disconnects mid-download (GeneratorExit)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._building.discard(key)
+
+    def _remove_stale(self, project_name, keep_path):
+        pattern = f"{glob.escape(project_name)}-{'[0-9a-f]' * 32}.zip"
+        for path in glob.glob(os.path.join(self.cache_dir, pattern)):
+            if path != keep_path:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove stale archive {path}: {e}")
+
+    def _evict(self):
+        archives = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.zip")):
+            try:
+                archives.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        archives.sort(reverse=True)
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        for position, (used_at, path) in enumerate(archives):
+            if used_at >= cutoff and (not self.max_entries or position < self.max_entries):
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove old archive {path}: {e}")
+
+
+_archive_cache = None
+_archive_cache_lock = threading.Lock()
+
+
+def get_archive_cache():
+    """
+    Returns the shared archive cache, stored in MAS_ARCHIVE_CACHE_DIR (default .mas_cache/archives)
+    and bounded by MAS_ARCHIVE_CACHE_MAX_ENTRIES and MAS_ARCHIVE_CACHE_TTL (seconds).
+    """
+    global _archive_cache
+    with _archive_cache_lock:
+        if _archive_cache is None:
+            _archive_cache = ArchiveCache(
+                os.getenv("MAS_ARCHIVE_CACHE_DIR", DEFAULT_ARCHIVE_CACHE_DIR),
+                max_entries=int(os.getenv("MAS_ARCHIVE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ARCHIVES)),
+                ttl=float(os.getenv("MAS_ARCHIVE_CACHE_TTL", DEFAULT_ARCHIVE_TTL)),
+            )
+        return _archive_cache
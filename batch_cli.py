@@ -0,0 +1,181 @@
+"""
+Headless batch mode: generates every project of a JSONL job file, several at a time.
+
+Usage:
+    python batch_cli.py jobs.jsonl                          # 2 processes, budgets from the environment
+    python batch_cli.py jobs.jsonl --processes 8 --rpm 60 --tpm 400000 --name catalog
+
+Each line of the job file is a JSON object with a `description` and optionally a `language`
+(default Python), an `id`, a `user` (charged for the tokens, see budget.py), `full_rebuild` and
+`use_cache`. Jobs run in a pool of worker processes. The rate limits (--rpm/--tpm,
+MAS_RPM_LIMIT/MAS_TPM_LIMIT, MAS_RATE_LIMITS) are one global budget shared by all of them
+through a SQLite file.
+
+Job <id> is written to generated_project/<name>-<id>/. Logs, the shared budget and report.json
+(per-job wall time, calls, tokens and errors) go to .mas_batch/<name>/; with MAS_LOG_FILE set,
+each worker logs to its own file next to it instead. Running a batch again
+under the same name reuses the files of projects that are already complete.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+
+BATCH_ROOT = ".mas_batch"
+DEFAULT_PROCESSES = 2
+DEFAULT_LANGUAGE = "Python"
+
+
+def load_jobs(path):
+    """
+    Reads the job file. Returns (jobs, problems): the valid jobs with a unique `id`, and one
+    report entry per line that could not be used.
+    """
+    jobs, problems = [], []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                problems.append({"id": f"line-{number}", "status": "failed", "errors": [f"Invalid JSON: {e}"]})
+                continue
+            if not isinstance(job, dict) or not str(job.get("description") or "").strip():
+                problems.append({"id": f"line-{number}", "status": "failed", "errors": ["Missing description."]})
+                continue
+            job_id = re.sub(r"[^A-Za-z0-9_-]", "_", str(job.get("id") or f"job-{number:04d}"))[:40]
+            if job_id in seen:
+                job_id = f"{job_id}-{number}"
+            seen.add(job_id)
+            jobs.append(dict(job, id=job_id, language=job.get("language") or DEFAULT_LANGUAGE))
+    return jobs, problems
+
+
+def worker_log_file(batch_dir, pid):
+    """
+    The log file of worker process `pid`: next to a configured MAS_LOG_FILE ("logs/mas.log" ->
+    "logs/mas.worker-<pid>.log"), or else in the batch's logs folder.
+    """
+    configured = os.getenv("MAS_LOG_FILE")
+    if configured:
+        root, extension = os.path.splitext(configured)
+        return f"{root}.worker-{pid}{extension}"
+    return os.path.join(batch_dir, "logs", f"worker-{pid}.log")
+
+
+def init_worker(batch_dir):
+    # One log file per process, even when MAS_LOG_FILE is set: the rotating handler must not be
+    # shared between processes. The console is left to the progress lines of the parent.
+    os.environ["MAS_LOG_FILE"] = worker_log_file(batch_dir, os.getpid())
+    os.environ.setdefault("MAS_LOG_CONSOLE", "0")
+
+
+def run_job(job, batch_name, max_workers):
+    """
+    Runs one job in a worker process and returns its report entry.
+    """
+    run_id = f"{batch_name}-{job['id']}"
+    entry = {"id": job["id"], "language": job["language"], "output": main.workspace_dir(run_id),
+             "status": "done", "errors": []}
+    files, reused_files = set(), set()
+    started = time.perf_counter()
+    summary = {}
+    try:
+        for chunk in main.generate_project_stream(job["description"], job["language"], max_workers=max_workers,
+                                                  use_cache=job.get("use_cache", True),
+                                                  incremental=not job.get("full_rebuild", False), run_id=run_id,
+                                                  user=job.get("user")):
+            data = json.loads(chunk)
+            if "error" in data:
+                entry["errors"].append(data["error"])
+            elif "code_file" in data:
+                files.add(data["code_file"]["filename"])
+                if data["code_file"].get("reused"):
+                    reused_files.add(data["code_file"]["filename"])
+            elif "run_summary" in data:
+                summary = data["run_summary"]
+    except Exception as e:
+        entry["errors"].append(str(e))
+    entry["wall_time"] = round(time.perf_counter() - started, 2)
+    entry["files"], entry["reused_files"] = len(files), len(reused_files)
+    entry.update(summary.get("totals", {}))
+    if not summary:
+        # The run stopped before its summary (ArchitectureBot or FlowStructureBot failed)
+        entry["status"] = "failed"
+    return entry
+
+
+def summarize(entries, wall_time):
+    totals = {key: sum(entry.get(key, 0) for entry in entries)
+              for key in ("files", "calls", "prompt_tokens", "cached_tokens", "completion_tokens")}
+    return {"jobs": len(entries), "failed": sum(entry["status"] == "failed" for entry in entries),
+            "with_errors": sum(bool(entry["errors"]) for entry in entries), "wall_time": round(wall_time, 2),
+            **totals}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("jobs_file", help="JSONL file with one {description, language} job per line")
+    parser.add_argument("--name", default=time.strftime("batch-%Y%m%d-%H%M%S"),
+                        help="batch name, used for the output directories (default: batch-<timestamp>)")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("MAS_BATCH_PROCESSES", DEFAULT_PROCESSES)),
+                        help=f"projects generated at once (default: MAS_BATCH_PROCESSES or {DEFAULT_PROCESSES})")
+    parser.add_argument("--workers", type=int, default=None, help="concurrent files per project (default: MAS_MAX_WORKERS)")
+    parser.add_argument("--rpm", type=float, default=None, help="requests per minute shared by the batch (MAS_RPM_LIMIT)")
+    parser.add_argument("--tpm", type=float, default=None, help="tokens per minute shared by the batch (MAS_TPM_LIMIT)")
+    args = parser.parse_args()
+
+    if not re.match(r"^[A-Za-z0-9_-]{1,23}$", args.name):
+        parser.error("--name may only contain letters, digits, '_' and '-' (at most 23 characters).")
+    jobs, problems = load_jobs(args.jobs_file)
+    batch_dir = os.path.join(BATCH_ROOT, args.name)
+    os.makedirs(os.path.join(batch_dir, "logs"), exist_ok=True)
+
+    # Set before the pool starts, so every worker process inherits the shared budget
+    os.environ["MAS_RATE_LIMIT_DB"] = os.path.join(batch_dir, "rate_limits.sqlite")
+    if args.rpm is not None:
+        os.environ["MAS_RPM_LIMIT"] = str(args.rpm)
+    if args.tpm is not None:
+        os.environ["MAS_TPM_LIMIT"] = str(args.tpm)
+
+    print(f"Running {len(jobs)} jobs with {max(1, args.processes)} processes ({len(problems)} invalid lines).")
+    entries = list(problems)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.processes), initializer=init_worker,
+                             initargs=(batch_dir,)) as pool:
+        futures = {pool.submit(run_job, job, args.name, args.workers): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                # The worker process itself died
+                entry = {"id": job["id"], "language": job["language"], "status": "failed", "errors": [str(e)]}
+            entries.append(entry)
+            print(f"{entry['status']:<6} {entry['id']:<24} files={entry.get('files', 0):<4} "
+                  f"calls={entry.get('calls', 0):<5} tokens={entry.get('prompt_tokens', 0) + entry.get('completion_tokens', 0):<9} "
+                  f"errors={len(entry['errors']):<3} wall_time={entry.get('wall_time', 0)}s")
+
+    order = {job["id"]: index for index, job in enumerate(jobs)}
+    entries.sort(key=lambda entry: order.get(entry["id"], -1))
+    report = {"batch": args.name, "jobs_file": args.jobs_file, "summary": summarize(entries, time.perf_counter() - started),
+              "jobs": entries}
+    report_path = os.path.join(batch_dir, "report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    summary = report["summary"]
+    print(f"{summary['jobs']} jobs, {summary['failed']} failed, {summary['with_errors']} with errors, "
+          f"{summary['calls']} calls, {summary['prompt_tokens'] + summary['completion_tokens']} tokens "
+          f"in {summary['wall_time']}s. Report: {report_path}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,133 @@
+"""
+End-to-end benchmark of generate_project_stream against the stub LLM backend (no network or API key needed).
+
+Usage:
+    python benchmark.py                                   # 5, 25 and 100 file projects
+    python benchmark.py --sizes 10 --latency 0.5 --compare  # with vs. without the old fixed pacing
+    python benchmark.py --json > baseline.json            # machine-readable results
+
+Each run reports wall time, model calls, prompt tokens and peak Python memory (tracemalloc).
+--compare reruns the pipeline with the 1-second sleeps that used to follow every
+SSE chunk and DevBot call, so the dead time they added can be measured.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tracemalloc
+
+os.environ.setdefault("MAS_LLM_BACKEND", "stub")
+os.environ.setdefault("MAS_CACHE_ENABLED", "0")
+os.environ.setdefault("MAS_SIMILAR_INDEX", "0")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import main
+import llm_backends
+
+PROJECT_NAME = "benchmark_project"
+ROOT_DIR = "generated_project"
+DEFAULT_SIZES = (5, 25, 100)
+
+
+def enable_legacy_pacing(seconds):
+    """
+    Re-inserts the fixed sleeps the pipeline used to have after each SSE chunk and DevBot call.
+    """
+    original_generate_file = main.generate_file
+    original_generate_code = main.DevBot.generate_file_code
+
+    def paced_generate_file(*args):
+        *head, emit = args
+
+        def paced_emit(event):
+            emit(event)
+            if '"code_delta"' not in event:
+                time.sleep(seconds)
+        return original_generate_file(*head, paced_emit)
+
+    def paced_generate_code(self, *args, **kwargs):
+        code = original_generate_code(self, *args, **kwargs)
+        time.sleep(seconds)
+        return code
+
+    main.generate_file = paced_generate_file
+    main.DevBot.generate_file_code = paced_generate_code
+
+    def restore():
+        main.generate_file = original_generate_file
+        main.DevBot.generate_file_code = original_generate_code
+    return restore
+
+
+def run_once(file_count, latency, workers, legacy_pacing=0.0):
+    stub = llm_backends.StubBackend(file_count, latency, project_name=PROJECT_NAME)
+    previous_backend = llm_backends.set_backend(stub)
+    restore = enable_legacy_pacing(legacy_pacing) if legacy_pacing else None
+
+    events = 0
+    errors = 0
+    summary = {}
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        for chunk in main.generate_project_stream("Benchmark project", "python", max_workers=workers,
+                                                  incremental=False):
+            events += 1
+            if legacy_pacing and events <= 2:
+                # architecture_overview and flow_structure used to be followed by a pause as well
+                time.sleep(legacy_pacing)
+            data = json.loads(chunk)
+            if "error" in data:
+                errors += 1
+            if "run_summary" in data:
+                summary = data["run_summary"]
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        llm_backends.set_backend(previous_backend)
+        if restore:
+            restore()
+        shutil.rmtree(os.path.join(ROOT_DIR, PROJECT_NAME), ignore_errors=True)
+        manifest_file = main.manifest_path(ROOT_DIR, PROJECT_NAME)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+    return {"files": file_count, "workers": workers, "legacy_pacing": legacy_pacing,
+            "wall_time": round(elapsed, 2), "calls": stub.calls,
+            "prompt_tokens": summary.get("totals", {}).get("prompt_tokens", 0),
+            "cached_tokens": summary.get("totals", {}).get("cached_tokens", 0),
+            "peak_memory_mb": round(peak_memory / (1024 * 1024), 1), "events": events, "errors": errors}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma-separated project sizes in files (default: 5,25,100)")
+    parser.add_argument("--latency", type=float, default=0.5, help="synthetic model latency in seconds")
+    parser.add_argument("--workers", type=int, default=None, help="concurrent files (default: MAS_MAX_WORKERS)")
+    parser.add_argument("--compare", action="store_true", help="also run with the old fixed 1s pacing")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for file_count in (int(size) for size in args.sizes.split(",") if size.strip()):
+        if args.compare:
+            results.append(run_once(file_count, args.latency, args.workers, legacy_pacing=1.0))
+        results.append(run_once(file_count, args.latency, args.workers))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    for result in results:
+        label = "before (fixed pacing)" if result["legacy_pacing"] else "after (rate limiter)"
+        print(f"{label:<24} files={result['files']:<4} calls={result['calls']:<5} "
+              f"prompt_tokens={result['prompt_tokens']:<8} cached_tokens={result['cached_tokens']:<8} peak_memory={result['peak_memory_mb']}MB "
+              f"errors={result['errors']:<3} wall_time={result['wall_time']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
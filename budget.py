@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from context_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override with the matching MAS_RUN_* / MAS_USER_* environment variables; 0 = unlimited)
+DEFAULT_USAGE_DB = os.path.join(".mas_cache", "usage.sqlite")
+DEFAULT_USER_WINDOW = 24 * 3600
+# Runs that name no user are charged to this key, so the user ceilings cannot be bypassed
+ANONYMOUS_USER = "anonymous"
+
+# Smallest completion ceiling per file type; larger finished files of the type raise it
+EXTENSION_MAX_TOKENS = {
+    ".txt": 1024, ".env": 1024, ".cfg": 1024, ".ini": 1024, ".toml": 1024,
+    ".json": 1536, ".yaml": 1536, ".yml": 1536, ".md": 2048, ".css": 3072, ".html": 4096,
+}
+DEFAULT_FILE_MAX_TOKENS = 8192
+# Never reserve less than this: reasoning models spend part of the completion before the code
+MIN_FILE_MAX_TOKENS = 1024
+# Allowance over the largest finished file of the same type
+SIBLING_HEADROOM = 2.0
+
+
+def _env_number(name, default=0, kind=float):
+    try:
+        return kind(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, falling back to {default}.")
+        return default
+
+
+def load_prices():
+    """
+    Model prices from MAS_MODEL_PRICES, JSON keyed by model or provider prefix in USD per million
+    tokens, e.g. {"deepseek/": {"prompt": 0.23, "completion": 0.69}}.
+    """
+    raw = os.getenv("MAS_MODEL_PRICES", "").strip()
+    if not raw:
+        return {}
+    try:
+        prices = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Ignoring invalid MAS_MODEL_PRICES: {e}")
+        return {}
+    return prices if isinstance(prices, dict) else {}
+
+
+def call_cost(prices, model, prompt_tokens, completion_tokens):
+    """
+    Cost of a call in USD under the longest matching price prefix (0 for unpriced models).
+    """
+    matches = [prefix for prefix in prices if model and model.startswith(prefix)]
+    if not matches:
+        return 0.0
+    price = prices[max(matches, key=len)]
+    return (prompt_tokens * price.get("prompt", 0) + completion_tokens * price.get("completion", 0)) / 1_000_000
+
+
+class UserUsageStore:
+    """
+    SQLite record of the tokens and cost charged to each user, summed over a sliding window.
+    """
+    def __init__(self, path=DEFAULT_USAGE_DB, window=DEFAULT_USER_WINDOW):
+        self.path = path
+        self.window = window
+        self._lock = threading.Lock()
+
+        dir_part = os.path.dirname(path)
+        if dir_part:
+            os.makedirs(dir_part, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " user TEXT NOT NULL,"
+            " ts REAL NOT NULL,"
+            " tokens INTEGER NOT NULL,"
+            " cost REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_user ON usage (user, ts)")
+        self._conn.commit()
+
+    def add(self, user, tokens, cost):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT INTO usage (user, ts, tokens, cost) VALUES (?, ?, ?, ?)",
+                               (user, now, tokens, cost))
+            self._conn.execute("DELETE FROM usage WHERE ts < ?", (now - self.window,))
+            self._conn.commit()
+
+    def usage(self, user):
+        """
+        Returns (tokens, cost) charged to `user` within the window.
+        """
+        with self._lock:
+            tokens, cost = self._conn.execute(
+                "SELECT COALESCE(SUM(tokens), 0), COALESCE(SUM(cost), 0) FROM usage WHERE user = ? AND ts >= ?",
+                (user, time.time() - self.window),
+            ).fetchone()
+        return tokens, cost
+
+
+class RunBudget:
+    """
+    Token, call and cost ceilings of one run, and of the user who started it, charged from the
+    usage reported for every model call (cache hits are free). exceeded() tells the pipeline
+    when to stop starting new work.
+    """
+    def __init__(self, max_tokens=0, max_calls=0, max_cost=0.0, user=None, user_store=None,
+                 user_max_tokens=0, user_max_cost=0.0, prices=None):
+        self.max_tokens = max_tokens
+        self.max_calls = max_calls
+        self.max_cost = max_cost
+        self.user = user
+        self.user_store = user_store if user else None
+        self.user_max_tokens = user_max_tokens
+        self.user_max_cost = user_max_cost
+        self.prices = prices or {}
+        self.tokens = 0
+        self.calls = 0
+        self.cost = 0.0
+        self.stopped = None  # The first exceeded() result, once the run stopped starting work
+        self.skipped_files = []
+        self._lock = threading.Lock()
+
+    def charge(self, call_stats):
+        if call_stats.cache_hit:
+            return
+        tokens = call_stats.prompt_tokens + call_stats.completion_tokens
+        cost = call_cost(self.prices, call_stats.model, call_stats.prompt_tokens, call_stats.completion_tokens)
+        with self._lock:
+            self.tokens += tokens
+            self.calls += 1
+            self.cost += cost
+        if self.user_store is not None:
+            try:
+                self.user_store.add(self.user, tokens, cost)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not record usage of user {self.user}: {e}")
+
+    def _user_usage(self):
+        if self.user_store is None or not (self.user_max_tokens or self.user_max_cost):
+            return 0, 0.0
+        try:
+            return self.user_store.usage(self.user)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read usage of user {self.user}: {e}")
+            return 0, 0.0
+
+    def exceeded(self):
+        """
+        Returns the first ceiling that has been reached as {"scope", "limit", "max", "used"}, or None.
+        """
+        with self._lock:
+            checks = [("run", "tokens", self.max_tokens, self.tokens),
+                      ("run", "calls", self.max_calls, self.calls),
+                      ("run", "cost", self.max_cost, round(self.cost, 6))]
+        user_tokens, user_cost = self._user_usage()
+        checks += [("user", "tokens", self.user_max_tokens, user_tokens),
+                   ("user", "cost", self.user_max_cost, round(user_cost, 6))]
+        for scope, limit, maximum, used in checks:
+            if maximum and used >= maximum:
+                result = {"scope": scope, "limit": limit, "max": maximum, "used": used}
+                if scope == "user":
+                    result["user"] = self.user
+                return result
+        return None
+
+    def stop(self, exceeded):
+        """
+        Records that the run stopped on `exceeded`. Returns True for the first caller only.
+        """
+        with self._lock:
+            if self.stopped is not None:
+                return False
+            self.stopped = exceeded
+            return True
+
+    def skip(self, file_path):
+        with self._lock:
+            # A resumed run skips again the files it skipped before the interruption
+            if file_path not in self.skipped_files:
+                self.skipped_files.append(file_path)
+
+    def remaining_tokens(self):
+        """
+        Tokens left under the run and user token ceilings, or None if neither is set.
+        """
+        remaining = []
+        if self.max_tokens:
+            with self._lock:
+                remaining.append(self.max_tokens - self.tokens)
+        if self.user_max_tokens and self.user_store is not None:
+            remaining.append(self.user_max_tokens - self._user_usage()[0])
+        return max(0, min(remaining)) if remaining else None
+
+    def to_dict(self):
+        """
+        The run's totals, for the StateManager checkpoint (see restore).
+        """
+        with self._lock:
+            return {"tokens": self.tokens, "calls": self.calls, "cost": self.cost,
+                    "skipped_files": list(self.skipped_files)}
+
+    def restore(self, totals):
+        """
+        Continues from the totals of an interrupted run, so resuming it does not reset its ceilings.
+        """
+        with self._lock:
+            self.tokens = totals.get("tokens", 0)
+            self.calls = totals.get("calls", 0)
+            self.cost = totals.get("cost", 0.0)
+            self.skipped_files = list(totals.get("skipped_files", []))
+
+    def summary(self):
+        with self._lock:
+            return {"tokens": self.tokens, "calls": self.calls, "cost": round(self.cost, 6),
+                    "limits": {"tokens": self.max_tokens, "calls": self.max_calls, "cost": self.max_cost,
+                               "user_tokens": self.user_max_tokens, "user_cost": self.user_max_cost},
+                    "user": self.user, "stopped": self.stopped, "skipped_files": list(self.skipped_files)}
+
+
+_user_store = None
+_user_store_lock = threading.Lock()
+
+
+def get_user_store():
+    global _user_store
+    with _user_store_lock:
+        if _user_store is None:
+            _user_store = UserUsageStore(
+                path=os.getenv("MAS_USAGE_DB", DEFAULT_USAGE_DB),
+                window=_env_number("MAS_USER_WINDOW", DEFAULT_USER_WINDOW),
+            )
+        return _user_store
+
+
+def create_run_budget(user=None):
+    """
+    Builds the budget of a run from the environment:
+      MAS_RUN_MAX_TOKENS / MAS_RUN_MAX_CALLS / MAS_RUN_MAX_COST   - per run
+      MAS_USER_MAX_TOKENS / MAS_USER_MAX_COST                      - per user over MAS_USER_WINDOW seconds
+                                                                     (default one day), kept in MAS_USAGE_DB
+    Costs need MAS_MODEL_PRICES (see load_prices). Every ceiling defaults to 0, unlimited.
+    Runs without a `user` share the ANONYMOUS_USER budget.
+    """
+    user = user or ANONYMOUS_USER
+    user_max_tokens = _env_number("MAS_USER_MAX_TOKENS", 0, int)
+    user_max_cost = _env_number("MAS_USER_MAX_COST", 0.0)
+    return RunBudget(
+        max_tokens=_env_number("MAS_RUN_MAX_TOKENS", 0, int),
+        max_calls=_env_number("MAS_RUN_MAX_CALLS", 0, int),
+        max_cost=_env_number("MAS_RUN_MAX_COST", 0.0),
+        user=user,
+        # Usage is recorded for every user, so ceilings set later see it
+        user_store=get_user_store(),
+        user_max_tokens=user_max_tokens,
+        user_max_cost=user_max_cost,
+        prices=load_prices(),
+    )
+
+
+def adaptive_max_tokens_enabled():
+    return os.getenv("MAS_ADAPTIVE_MAX_TOKENS", "1").lower() not in ("0", "false", "no")
+
+
+def estimate_max_tokens(rel_path, sibling_sizes, ceiling=None):
+    """
+    Completion ceiling for a file: the default of its extension, raised to twice the largest
+    completion among the finished files of the same type (`sibling_sizes` maps their paths to
+    completion tokens). Small files such as config modules never lower it: reasoning models spend
+    part of the completion before the code. Kept between MIN_FILE_MAX_TOKENS and `ceiling`
+    (e.g. the route's max_tokens).
+    """
+    extension = os.path.splitext(rel_path)[1].lower()
+    siblings = [size for path, size in sibling_sizes.items()
+                if path != rel_path and os.path.splitext(path)[1].lower() == extension]
+    estimate = EXTENSION_MAX_TOKENS.get(extension, DEFAULT_FILE_MAX_TOKENS)
+    if siblings:
+        estimate = max(estimate, int(max(siblings) * SIBLING_HEADROOM) + 256)
+    estimate = max(MIN_FILE_MAX_TOKENS, estimate)
+    return min(estimate, ceiling) if ceiling else estimate
+
+
+def output_size(code, completion_tokens=0):
+    """
+    Size of a generated file for estimate_max_tokens: its completion tokens, or its token count
+    when the completion was not measured.
+    """
+    return max(completion_tokens or 0, count_tokens(code))
@@ -0,0 +1,197 @@
+import os
+import re
+import ast
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default token budget for the accumulated-code section of a prompt (override with MAS_CONTEXT_TOKEN_BUDGET)
+DEFAULT_TOKEN_BUDGET = 6000
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional
+    _encoding = None
+
+# Lines worth keeping in a skeleton of a non-Python file
+SIGNATURE_PATTERN = re.compile(
+    r"^\s*(import\b|from\b.+\bimport\b|package\b|using\b|#include\b|export\b|module\.exports\b"
+    r"|(public|private|protected|static|abstract|final|async|def|class|interface|enum|function|func|fn|struct)\b"
+    r"|const\s+\w+\s*=\s*(require\(|\(|async\b|function\b))"
+)
+JS_IMPORT_PATTERN = re.compile(r"""(?:from\s+|require\(\s*|import\s+)['"]([^'"]+)['"]""")
+
+
+def count_tokens(text):
+    """
+    Counts tokens with tiktoken when it is installed, otherwise estimates ~4 characters per token.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(message.get("content") or "") for message in messages)
+
+
+def get_token_budget():
+    try:
+        return int(os.getenv("MAS_CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+    except ValueError:
+        return DEFAULT_TOKEN_BUDGET
+
+
+def _format_args(args):
+    try:
+        return ast.unparse(args)
+    except Exception:
+        return "..."
+
+
+def python_skeleton(code):
+    """
+    Reduces Python source to its imports and class/function signatures.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return generic_skeleton(code)
+
+    lines = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            lines.append(ast.unparse(node))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+            lines.append(f"{prefix} {node.name}({_format_args(node.args)}): ...")
+        elif isinstance(node, ast.ClassDef):
+            bases = ", ".join(ast.unparse(base) for base in node.bases)
+            lines.append(f"class {node.name}({bases}):" if bases else f"class {node.name}:")
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    prefix = "async def" if isinstance(item, ast.AsyncFunctionDef) else "def"
+                    lines.append(f"    {prefix} {item.name}({_format_args(item.args)}): ...")
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names = [t.id for t in targets if isinstance(t, ast.Name)]
+            if names:
+                lines.append(f"{', '.join(names)} = ...")
+    return "\n".join(lines)
+
+
+def generic_skeleton(code):
+    """
+    Keeps import and declaration lines of any language.
+    """
+    return "\n".join(line.rstrip() for line in code.splitlines() if SIGNATURE_PATTERN.match(line))
+
+
+def extract_skeleton(file_path, code):
+    if file_path.endswith(".py"):
+        return python_skeleton(code)
+    return generic_skeleton(code)
+
+
+def _module_candidates(module_name):
+    """
+    Possible relative paths for a dotted Python module name.
+    """
+    base = module_name.replace(".", "/")
+    return [f"{base}.py", f"{base}/__init__.py"]
+
+
+def find_imported_files(file_path, code, known_paths):
+    """
+    Returns the subset of `known_paths` that `code` (the file at `file_path`) imports.
+    """
+    imported = set()
+    if not code:
+        return imported
+
+    modules = []
+    if file_path.endswith(".py"):
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            tree = None
+        if tree is not None:
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    modules.extend(alias.name for alias in node.names)
+                elif isinstance(node, ast.ImportFrom) and node.module:
+                    modules.append(node.module)
+                    modules.extend(f"{node.module}.{alias.name}" for alias in node.names)
+        for module in modules:
+            for candidate in _module_candidates(module):
+                # Imports may be absolute from the project root or from inside the top-level package
+                for path in known_paths:
+                    if path == candidate or path.endswith("/" + candidate):
+                        imported.add(path)
+    else:
+        directory = os.path.dirname(file_path)
+        for target in JS_IMPORT_PATTERN.findall(code):
+            resolved = os.path.normpath(os.path.join(directory, target)).replace("\\", "/")
+            for path in known_paths:
+                stem = os.path.splitext(path)[0]
+                if path == resolved or stem == resolved or stem == resolved + "/index":
+                    imported.add(path)
+
+    imported.discard(file_path)
+    return imported
+
+
+def build_code_context(accumulated_code_dict, full_paths=(), required_paths=(), budget=None):
+    """
+    Assembles the accumulated-code section of a prompt under a token budget.
+
+    Files in `required_paths` (e.g. the files FinalizerBot must rewrite) are always included
+    verbatim. Files in `full_paths` (e.g. the files the reviewed module imports) are included
+    verbatim too, and every other file is reduced to its skeleton. If the result is still over
+    budget, skeletons are replaced by bare file names, then `full_paths` files by skeletons.
+
+    Returns (text, stats) where stats has the context tokens and the tokens the naive
+    full-text concatenation would have used.
+    """
+    budget = get_token_budget() if budget is None else budget
+    required_paths = set(required_paths)
+    full_paths = set(full_paths) | required_paths
+
+    def render(file_path, kind):
+        code = accumulated_code_dict[file_path]
+        skeleton = extract_skeleton(file_path, code) if kind == "skeleton" else None
+        if kind == "full" or (skeleton is not None and len(skeleton) >= len(code)):
+            # Short files are cheaper in full than as a skeleton
+            text = f"File: {file_path}\nCode:\n{code}"
+        elif kind == "skeleton":
+            text = f"File: {file_path}\nSignatures:\n{skeleton}"
+        else:
+            text = f"File: {file_path}"
+        return kind, text, count_tokens(text)
+
+    # Listed by path, not in completion order, so identical inputs always give the same prompt
+    sections = {}
+    for file_path in sorted(accumulated_code_dict):
+        sections[file_path] = render(file_path, "full" if file_path in full_paths else "skeleton")
+    total = sum(tokens for _, _, tokens in sections.values())
+
+    # Degrade the least relevant content first, starting from the end of the listing
+    for from_kind, to_kind in (("skeleton", "name"), ("full", "skeleton")):
+        for file_path in reversed(list(sections)):
+            if total <= budget:
+                break
+            if sections[file_path][0] != from_kind or file_path in required_paths:
+                continue
+            total -= sections[file_path][2]
+            sections[file_path] = render(file_path, to_kind)
+            total += sections[file_path][2]
+
+    text = "\n\n".join(section for _, section, _ in sections.values())
+    full_tokens = sum(count_tokens(f"File: {path}\nCode:\n{code}") for path, code in accumulated_code_dict.items())
+    stats = {"context_tokens": count_tokens(text), "full_context_tokens": full_tokens}
+    if stats["context_tokens"] > budget:
+        logger.warning(f"Code context of {stats['context_tokens']} tokens exceeds the budget of {budget}.")
+    return text, stats
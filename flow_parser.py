@@ -0,0 +1,109 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Characters that draw the tree or mark list items in front of a name
+TREE_PREFIX_CHARS = " \t│├└┬┼─━┃┣┗|`*+-•>"
+TREE_DRAWING_CHARS = "│├└┬┼─━┃┣┗|"
+TAB_SIZE = 4
+# Files that conventionally have no extension
+EXTENSIONLESS_FILES = {
+    "Dockerfile", "Makefile", "Procfile", "LICENSE", "Gemfile", "Rakefile", "Jenkinsfile", "Vagrantfile",
+    "Pipfile", "CMakeLists.txt",
+}
+# Everything after the name: "# comment", "- description", "(description)" or a run of spaces
+TRAILING_NOTE = re.compile(r"\s+(#|//|--|-\s|—|–|\().*$|\s{2,}.*$")
+SAFE_SEGMENT = re.compile(r"^[\w.@+-]+$")
+
+
+class FlowStructureParser:
+    """
+    Incremental parser for the FlowStructureBot folder tree. feed() takes the response as it streams
+    in and returns the file paths of the lines completed so far; close() handles the last line.
+
+    Nesting is taken from the indentation (or, for tree drawings such as "├── " and "│   ", the column
+    at which the name starts), so any indentation width and tabs work. Names are checked before they become paths:
+    absolute paths, ".." and unusual characters are dropped, as are prose lines and code fences.
+    """
+    def __init__(self):
+        self.text = ""        # Everything received so far
+        self.file_paths = []  # Every path returned by feed() and close(), in order
+        self.structure_at = {}  # {file path: the tree text up to and including its line}
+        self._parsed = ""
+        self._buffer = ""
+        self._stack = []      # [(column, directory name)]
+        self._seen = set()
+
+    def restart(self):
+        """
+        Starts over on a new response (a retried completion). Paths already returned are not returned again.
+        """
+        self.text = ""
+        self._parsed = ""
+        self._buffer = ""
+        self._stack = []
+
+    def feed(self, text):
+        self.text += text
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def close(self):
+        line, self._buffer = self._buffer, ""
+        return self._parse_lines([line])
+
+    def _parse_lines(self, lines):
+        new_paths = []
+        for line in lines:
+            self._parsed += line + "\n"
+            path = self._parse_line(line)
+            if path and path not in self._seen:
+                self._seen.add(path)
+                self.file_paths.append(path)
+                self.structure_at[path] = self._parsed
+                new_paths.append(path)
+        return new_paths
+
+    def _parse_line(self, raw_line):
+        line = raw_line.rstrip().expandtabs(TAB_SIZE)
+        if not line.strip() or line.lstrip().startswith("```"):
+            return None
+        name = line.lstrip(TREE_PREFIX_CHARS)
+        column = len(line) - len(name)
+        if not any(char in TREE_DRAWING_CHARS for char in line[:column]):
+            # Plain lists nest by indentation, whether or not an entry has a "- " marker
+            column = len(line) - len(line.lstrip())
+        name = TRAILING_NOTE.sub("", name).strip("`*").strip()
+        if not name or " " in name or name.endswith(":"):
+            # Headings and commentary, e.g. "Project structure:"
+            return None
+
+        while self._stack and self._stack[-1][0] >= column:
+            self._stack.pop()
+
+        is_dir = name.endswith("/") or ("." not in name and name not in EXTENSIONLESS_FILES)
+        parts = [part for part in name.replace("\\", "/").split("/") if part]
+        if name.startswith("/") or not parts or not all(self._valid_segment(part) for part in parts):
+            logger.warning(f"Ignoring invalid entry in the flow structure: {raw_line.strip()!r}")
+            return None
+
+        if is_dir:
+            self._stack.append((column, "/".join(parts)))
+            return None
+        return "/".join([directory for _, directory in self._stack] + parts)
+
+    @staticmethod
+    def _valid_segment(part):
+        return part not in (".", "..") and not part.endswith(":") and bool(SAFE_SEGMENT.match(part))
+
+
+def parse_flow_text(flow_text):
+    """
+    Parses a complete folder tree into its list of file paths.
+    """
+    parser = FlowStructureParser()
+    parser.feed(flow_text)
+    parser.close()
+    return parser.file_paths
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+
+from main import StateManager, generate_project_stream, workspace_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_DB = os.path.join(".mas_jobs", "jobs.sqlite")
+DEFAULT_JOB_WORKERS = 2
+# Queued jobs accepted before new submissions are refused (0 = unlimited)
+DEFAULT_MAX_QUEUED_JOBS = 0
+# How often subscribers check for new events when they cannot block on a thread condition
+COOPERATIVE_POLL_INTERVAL = 0.2
+# Workspaces of finished jobs kept on disk, and for how long (0 = no limit)
+DEFAULT_MAX_WORKSPACES = 100
+DEFAULT_WORKSPACE_TTL = 7 * 24 * 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TERMINAL_STATUSES = (DONE, FAILED)
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised by JobManager.submit when the admission queue is full.
+    """
+
+
+class JobStore:
+    """
+    SQLite persistence for generation jobs, their SSE event log and StateManager checkpoints.
+    """
+    def __init__(self, path=DEFAULT_JOB_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        dir_part = os.path.dirname(path)
+        if dir_part:
+            os.makedirs(dir_part, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " description TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " checkpoint TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq));"
+        )
+        self._conn.commit()
+
+    def create_job(self, description, language, options=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, description, language, options, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, description, language, json.dumps(options or {}), QUEUED, now, now),
+            )
+            self._conn.commit()
+        return job_id
+
+    def get_job(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim_next(self):
+        """
+        Atomically moves the oldest queued job to running and returns it, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (RUNNING, time.time(), row["id"])
+            )
+            self._conn.commit()
+        return dict(row, status=RUNNING)
+
+    def requeue_interrupted(self):
+        """
+        Jobs left running by a crashed or restarted process are queued again to resume.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?", (QUEUED, time.time(), RUNNING)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def count_queued(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+        return count
+
+    def queue_position(self, job_id):
+        job = self.get_job(job_id)
+        if job is None or job["status"] != QUEUED:
+            return 0
+        with self._lock:
+            (ahead,) = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, job["created_at"])
+            ).fetchone()
+        return ahead + 1
+
+    def append_event(self, job_id, data):
+        with self._lock:
+            (last_seq,) = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)", (job_id, last_seq + 1, data)
+            )
+            self._conn.commit()
+        return last_seq + 1
+
+    def events_after(self, job_id, seq):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq)
+            ).fetchall()
+        return [(row["seq"], row["data"]) for row in rows]
+
+    def save_checkpoint(self, job_id, state_dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET checkpoint = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(state_dict), time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def workspace_runs(self):
+        """
+        Returns ({run ID: time of its last finished job}, run IDs of queued or running jobs).
+        Jobs continuing a workspace share its run ID.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, options, status, updated_at FROM jobs").fetchall()
+        finished, active = {}, set()
+        for row in rows:
+            run_id = json.loads(row["options"]).get("run_id") or row["id"]
+            if row["status"] in TERMINAL_STATUSES:
+                finished[run_id] = max(finished.get(run_id, 0), row["updated_at"])
+            else:
+                active.add(run_id)
+        return finished, active
+
+    def finish(self, job_id, status, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+            self._conn.commit()
+
+
+class JobManager:
+    """
+    Runs queued jobs on a pool of worker threads and lets any number of SSE
+    subscribers follow (and replay) a job's event log.
+    At most `workers` jobs run at once; up to `max_queued` more wait in the queue (0 = unlimited).
+    Every job runs in its own workspace (main.workspace_dir), named after the job ID unless the
+    submitter continues an existing workspace. After each job, the workspaces of finished jobs
+    older than `workspace_ttl` seconds, and the oldest beyond `max_workspaces`, are deleted (0 = keep).
+
+    Subscribers normally block on a thread condition. A server running requests as greenlets
+    (serve.py) sets `sleep` to its cooperative sleep instead, so waiting subscribers do not block it.
+    """
+    def __init__(self, store, workers=DEFAULT_JOB_WORKERS, max_queued=DEFAULT_MAX_QUEUED_JOBS,
+                 max_workspaces=DEFAULT_MAX_WORKSPACES, workspace_ttl=DEFAULT_WORKSPACE_TTL):
+        self.store = store
+        self.workers = max(1, workers)
+        self.max_queued = max(0, max_queued)
+        self.max_workspaces = max(0, max_workspaces)
+        self.workspace_ttl = max(0, workspace_ttl)
+        self._prune_lock = threading.Lock()
+        self.sleep = None
+        self._changed = threading.Condition()
+        self._version = 0  # Bumped on every notification, so cooperative subscribers can poll cheaply
+        self._threads = []
+
+    def start(self):
+        resumed = self.store.requeue_interrupted()
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted job(s).")
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, description, language, options=None):
+        """
+        Queues a job and returns its ID. Raises QueueFullError if `max_queued` jobs are already waiting.
+        """
+        if self.max_queued and self.store.count_queued() >= self.max_queued:
+            raise QueueFullError(f"{self.max_queued} jobs are already queued; try again later.")
+        job_id = self.store.create_job(description, language, options)
+        self.store.append_event(job_id, json.dumps({"job_id": job_id}))
+        self._notify()
+        logger.info(f"Queued job {job_id}.")
+        return job_id
+
+    def _notify(self):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def _wait_for_change(self, timeout):
+        if self.sleep is None:
+            with self._changed:
+                self._changed.wait(timeout=timeout)
+            return
+        seen = self._version
+        deadline = time.monotonic() + timeout
+        while self._version == seen and time.monotonic() < deadline:
+            self.sleep(COOPERATIVE_POLL_INTERVAL)
+
+    def _worker_loop(self):
+        while True:
+            job = self.store.claim_next()
+            if job is None:
+                with self._changed:
+                    self._changed.wait(timeout=1.0)
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job):
+        job_id = job["id"]
+        options = json.loads(job["options"])
+        options.setdefault("run_id", job_id)
+        resume_state = StateManager.from_dict(json.loads(job["checkpoint"])) if job["checkpoint"] else None
+        logger.info(f"Running job {job_id}{' (resumed)' if resume_state else ''}.")
+
+        def on_checkpoint(state):
+            self.store.save_checkpoint(job_id, state.to_dict())
+
+        try:
+            for chunk in generate_project_stream(
+                job["description"],
+                job["language"],
+                resume_state=resume_state,
+                on_checkpoint=on_checkpoint,
+                **options,
+            ):
+                self.store.append_event(job_id, chunk)
+                self._notify()
+            self.store.finish(job_id, DONE)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self.store.append_event(job_id, json.dumps({"error": str(e)}))
+            self.store.finish(job_id, FAILED, str(e))
+        self._notify()
+        self.prune_workspaces()
+
+    def prune_workspaces(self):
+        """
+        Deletes the workspaces of finished jobs beyond the age and count limits. Workspaces of
+        queued or running jobs are kept. Returns the run IDs whose workspace was removed.
+        """
+        if not (self.max_workspaces or self.workspace_ttl):
+            return []
+        with self._prune_lock:
+            finished, active = self.store.workspace_runs()
+            candidates = sorted((run_id for run_id in finished if run_id not in active),
+                                key=finished.get, reverse=True)
+            cutoff = time.time() - self.workspace_ttl if self.workspace_ttl else 0
+            removed = []
+            for position, run_id in enumerate(candidates):
+                if finished[run_id] >= cutoff and (not self.max_workspaces or position < self.max_workspaces):
+                    continue
+                try:
+                    path = workspace_dir(run_id)
+                except ValueError:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed.append(run_id)
+            if removed:
+                logger.info(f"Removed {len(removed)} old workspace(s).")
+            return removed
+
+    def subscribe(self, job_id, last_event_id=0, heartbeat=15.0):
+        """
+        Yields (seq, data) for every event after `last_event_id` until the job has finished, then a
+        `job_finished` event with its status and error. Yields None when nothing happened for
+        `heartbeat` seconds, so callers can keep the connection alive.
+        """
+        seq = last_event_id
+        idle_since = time.monotonic()
+        last_position = None
+        while True:
+            events = self.store.events_after(job_id, seq)
+            for seq, data in events:
+                yield seq, data
+            if events:
+                idle_since = time.monotonic()
+
+            job = self.store.get_job(job_id)
+            if job is None:
+                return
+            if job["status"] in TERMINAL_STATUSES:
+                # Drain anything appended between the read and the status check
+                for seq, data in self.store.events_after(job_id, seq):
+                    yield seq, data
+                yield None, json.dumps({"job_finished": {"status": job["status"], "error": job["error"]}})
+                return
+            if job["status"] == QUEUED:
+                position = self.store.queue_position(job_id)
+                if position != last_position:
+                    last_position = position
+                    yield None, json.dumps({"queued": {"position": position}})
+
+            self._wait_for_change(timeout=1.0)
+            if time.monotonic() - idle_since >= heartbeat:
+                idle_since = time.monotonic()
+                yield None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    Returns the process-wide job manager, starting its workers (and resuming interrupted jobs) on first use.
+    Configured with MAS_JOB_DB, MAS_JOB_WORKERS, MAS_MAX_QUEUED_JOBS, MAS_MAX_WORKSPACES and MAS_WORKSPACE_TTL.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            store = JobStore(os.getenv("MAS_JOB_DB", DEFAULT_JOB_DB))
+            _manager = JobManager(store, workers=int(os.getenv("MAS_JOB_WORKERS", DEFAULT_JOB_WORKERS)),
+                                  max_queued=int(os.getenv("MAS_MAX_QUEUED_JOBS", DEFAULT_MAX_QUEUED_JOBS)),
+                                  max_workspaces=int(os.getenv("MAS_MAX_WORKSPACES", DEFAULT_MAX_WORKSPACES)),
+                                  workspace_ttl=float(os.getenv("MAS_WORKSPACE_TTL", DEFAULT_WORKSPACE_TTL)))
+            _manager.start()
+        return _manager
@@ -0,0 +1,258 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from openai import OpenAIError
+from openai.types.chat import ChatCompletion
+
+import llm_client
+from response_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "openrouter"
+DEFAULT_FIXTURE_DIR = os.path.join("fixtures", "llm")
+DEFAULT_STUB_FILES = 10
+
+# Backends that talk to the real API and therefore need OPENROUTER_API_KEY
+NETWORK_BACKENDS = ("openrouter", "record")
+
+
+class FixtureNotFoundError(OpenAIError):
+    """
+    Raised in replay mode when no recorded response matches a request.
+    """
+
+
+def make_completion(text, prompt_tokens=0, model="stub", cached_tokens=0):
+    completion_tokens = len(text) // 4
+    return ChatCompletion.model_validate({
+        "id": "stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens,
+                  "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+    })
+
+
+class LLMBackend(ABC):
+    """
+    Where chat completions come from. acall_openai_chat calls create() or stream();
+    retries, rate limiting and the response cache stay in front of the backend.
+    """
+    # Whether responses may be stored in the shared response cache
+    cacheable = False
+
+    @abstractmethod
+    async def create(self, messages, model, temperature, timeout, response_format=None, max_tokens=None):
+        pass
+
+    async def stream(self, messages, model, temperature, timeout, on_delta, response_format=None,
+                     max_tokens=None):
+        """
+        Default streaming: the whole reply is delivered as a single delta.
+        """
+        response = await self.create(messages, model, temperature, timeout, response_format, max_tokens)
+        text = response.choices[0].message.content if response.choices else None
+        if text:
+            on_delta(text, 0)
+        return response
+
+
+class OpenRouterBackend(LLMBackend):
+    """
+    The real API over the pooled client in llm_client.
+    """
+    cacheable = True
+
+    async def create(self, messages, model, temperature, timeout, response_format=None, max_tokens=None):
+        return await llm_client.acreate_chat_completion(
+            messages=messages, model=model, temperature=temperature, timeout=timeout,
+            response_format=response_format, max_tokens=max_tokens)
+
+    async def stream(self, messages, model, temperature, timeout, on_delta, response_format=None,
+                     max_tokens=None):
+        return await llm_client.astream_chat_completion(
+            messages=messages, model=model, temperature=temperature, timeout=timeout, on_delta=on_delta,
+            response_format=response_format, max_tokens=max_tokens)
+
+
+def fixture_path(fixture_dir, model, temperature, messages, response_format=None, max_tokens=None):
+    key = make_cache_key(model, temperature, messages, response_format, max_tokens)
+    return os.path.join(fixture_dir, f"{key}.json")
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Forwards to another backend and saves every request/response pair as a fixture file.
+    """
+    def __init__(self, inner, fixture_dir=DEFAULT_FIXTURE_DIR):
+        self.inner = inner
+        self.fixture_dir = fixture_dir
+
+    def _record(self, messages, model, temperature, response_format, max_tokens, response):
+        os.makedirs(self.fixture_dir, exist_ok=True)
+        path = fixture_path(self.fixture_dir, model, temperature, messages, response_format, max_tokens)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "temperature": temperature, "messages": messages,
+                       "response_format": response_format, "max_tokens": max_tokens,
+                       "response": response.model_dump(mode="json")}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def create(self, messages, model, temperature, timeout, response_format=None, max_tokens=None):
+        response = await self.inner.create(messages, model, temperature, timeout, response_format, max_tokens)
+        self._record(messages, model, temperature, response_format, max_tokens, response)
+        return response
+
+    async def stream(self, messages, model, temperature, timeout, on_delta, response_format=None,
+                     max_tokens=None):
+        response = await self.inner.stream(messages, model, temperature, timeout, on_delta, response_format,
+                                             max_tokens)
+        self._record(messages, model, temperature, response_format, max_tokens, response)
+        return response
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Answers from recorded fixtures after `latency` seconds. Requests without a fixture
+    raise FixtureNotFoundError, or get a stub answer if `fallback` is given.
+    """
+    def __init__(self, fixture_dir=DEFAULT_FIXTURE_DIR, latency=0.0, fallback=None):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.fallback = fallback
+
+    async def create(self, messages, model, temperature, timeout, response_format=None, max_tokens=None):
+        path = fixture_path(self.fixture_dir, model, temperature, messages, response_format, max_tokens)
+        if not os.path.exists(path):
+            if self.fallback is not None:
+                return await self.fallback.create(messages, model, temperature, timeout, response_format,
+                                                  max_tokens)
+            raise FixtureNotFoundError(f"No recorded response for this {model} request in {self.fixture_dir}.")
+        await asyncio.sleep(self.latency)
+        with open(path, "r", encoding="utf-8") as f:
+            return ChatCompletion.model_validate(json.load(f)["response"])
+
+
+def build_stub_flow_structure(file_count, project_name="stub_project"):
+    lines = [f"{project_name}/", "  - main.py", "  - config.py", "  - modules/"]
+    for index in range(max(0, file_count - 2)):
+        lines.append(f"    - module_{index}.py")
+    return "\n".join(lines)
+
+
+class StubBackend(LLMBackend):
+    """
+    Answers every agent with a canned response after `latency` seconds, for a project of `file_count` files.
+    Like a provider's prompt cache, it reports a system prompt it has seen before as cached tokens.
+    """
+    def __init__(self, file_count=DEFAULT_STUB_FILES, latency=0.0, project_name="stub_project"):
+        self.flow_structure = build_stub_flow_structure(file_count, project_name)
+        self.latency = latency
+        self.calls = 0
+        self._seen_prompts = set()
+        self._lock = threading.Lock()
+
+    def reply_for(self, messages):
+        system_prompt = messages[0]["content"]
+        if system_prompt.startswith("You are the ArchitectureBot"):
+            return json.dumps({"architecture_overview": "Stub architecture."})
+        if system_prompt.startswith("You are FlowStructureBot"):
+            return self.flow_structure
+        if system_prompt.startswith("You are DevBot"):
+            return "```python\nimport os\n\n\ndef run():\n    return os.getcwd()\n```"
+        if system_prompt.startswith("You are VerificationBot"):
+            return json.dumps({"verification": "All good"})
+        return json.dumps({"final_codes": []})
+
+    async def create(self, messages, model, temperature, timeout, response_format=None, max_tokens=None):
+        return await self._complete(messages, model)
+
+    async def stream(self, messages, model, temperature, timeout, on_delta, response_format=None,
+                     max_tokens=None):
+        """
+        Delivers the reply line by line, spreading the latency over the lines like a streamed completion.
+        """
+        return await self._complete(messages, model, on_delta)
+
+    async def _complete(self, messages, model, on_delta=None):
+        system_prompt = messages[0]["content"]
+        with self._lock:
+            self.calls += 1
+            cached = system_prompt in self._seen_prompts
+            self._seen_prompts.add(system_prompt)
+        text = self.reply_for(messages)
+        if on_delta is None:
+            await asyncio.sleep(self.latency)
+        else:
+            lines = text.splitlines(keepends=True)
+            offset = 0
+            for line in lines:
+                await asyncio.sleep(self.latency / len(lines))
+                on_delta(line, offset)
+                offset += len(line)
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+        cached_tokens = len(system_prompt) // 4 if cached else 0
+        return make_completion(text, prompt_tokens, model, cached_tokens)
+
+
+def get_backend_name():
+    return os.getenv("MAS_LLM_BACKEND", DEFAULT_BACKEND).strip().lower()
+
+
+def requires_api_key():
+    return get_backend_name() in NETWORK_BACKENDS
+
+
+def create_backend(name=None):
+    """
+    Builds the backend selected by MAS_LLM_BACKEND: openrouter (default), record, replay or stub.
+    MAS_LLM_FIXTURES sets the fixture directory, MAS_LLM_LATENCY the synthetic latency of
+    replay/stub in seconds, MAS_STUB_FILES the size of the stub project, and MAS_REPLAY_FALLBACK=stub
+    answers unrecorded requests with the stub instead of failing.
+    """
+    name = name or get_backend_name()
+    fixture_dir = os.getenv("MAS_LLM_FIXTURES", DEFAULT_FIXTURE_DIR)
+    latency = float(os.getenv("MAS_LLM_LATENCY", 0.0))
+    if name == "openrouter":
+        return OpenRouterBackend()
+    if name == "record":
+        return RecordingBackend(OpenRouterBackend(), fixture_dir)
+    if name == "stub":
+        return StubBackend(int(os.getenv("MAS_STUB_FILES", DEFAULT_STUB_FILES)), latency)
+    if name == "replay":
+        fallback = None
+        if os.getenv("MAS_REPLAY_FALLBACK", "").lower() == "stub":
+            fallback = StubBackend(int(os.getenv("MAS_STUB_FILES", DEFAULT_STUB_FILES)), latency)
+        return ReplayBackend(fixture_dir, latency, fallback)
+    raise ValueError(f"Unknown MAS_LLM_BACKEND: {name!r} (expected openrouter, record, replay or stub).")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+            logger.info(f"Using LLM backend: {type(_backend).__name__}.")
+        return _backend
+
+
+def set_backend(backend):
+    """
+    Replaces the process-wide backend (e.g. with a StubBackend in benchmarks); returns the previous one.
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+        return previous
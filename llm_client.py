@@ -0,0 +1,244 @@
+import os
+import time
+import asyncio
+import contextvars
+import logging
+import threading
+import weakref
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+from openai.types.chat import ChatCompletion
+
+try:
+    # The HTTP transport the SDK is built on: httpx2 from openai 3, httpx before
+    from httpx2 import Limits
+except ImportError:
+    from httpx import Limits
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Connection pool settings (override with the matching MAS_* environment variables)
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+# Model prefixes whose providers only cache prompts marked with cache_control (override with MAS_CACHE_CONTROL_MODELS).
+# OpenAI, DeepSeek and most others cache repeated prompt prefixes automatically.
+DEFAULT_CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+_settings = {"api_key": None, "base_url": DEFAULT_BASE_URL}
+
+# One pooled client per event loop: httpx connections cannot be shared across loops
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+# Background event loop used by the synchronous shim
+_loop = None
+_loop_lock = threading.Lock()
+
+
+class CallStats:
+    """
+    Per-call bookkeeping filled in by the LLM layer and read back by agents and the pipeline.
+    """
+    def __init__(self, model=None, agent=None):
+        self.model = model
+        self.agent = agent
+        self.cache_hit = False
+        self.rate_limit_wait = 0.0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0  # Prompt tokens the provider served from its prompt cache
+        self.finish_reason = None  # "length" when the completion was cut off by max_tokens
+        self.duration = 0.0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def configure(api_key, base_url=DEFAULT_BASE_URL):
+    """
+    Sets the credentials used by every client created afterwards.
+    """
+    _settings["api_key"] = api_key
+    _settings["base_url"] = base_url
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Invalid value for {name}: {value!r}, using {default}.")
+        return default
+
+
+def _build_client():
+    limits = Limits(
+        max_connections=_env_number("MAS_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS),
+        max_keepalive_connections=_env_number("MAS_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS),
+        keepalive_expiry=_env_number("MAS_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY, float),
+    )
+    http_client = DefaultAsyncHttpxClient(limits=limits, timeout=Timeout(60.0, connect=10.0))
+    logger.info(f"Created pooled LLM client (max_connections={limits.max_connections}).")
+    return AsyncOpenAI(
+        api_key=_settings["api_key"],
+        base_url=_settings["base_url"],
+        http_client=http_client,
+        max_retries=0,  # retries and fallbacks are handled by retry.call_with_retries
+    )
+
+
+def get_async_client():
+    """
+    Returns the shared AsyncOpenAI client of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None:
+            client = _build_client()
+            _clients[loop] = client
+        return client
+
+
+def cache_control_messages(messages, model):
+    """
+    Marks the system prompt (the part of a request shared by every file of a project) as cacheable
+    for providers that need an explicit cache_control breakpoint. Other models get `messages` unchanged.
+    """
+    raw = os.getenv("MAS_CACHE_CONTROL_MODELS")
+    prefixes = [p.strip() for p in raw.split(",") if p.strip()] if raw is not None else DEFAULT_CACHE_CONTROL_PREFIXES
+    if not messages or messages[0].get("role") != "system" or not any(model.startswith(p) for p in prefixes):
+        return messages
+    system = dict(messages[0], content=[
+        {"type": "text", "text": messages[0]["content"], "cache_control": {"type": "ephemeral"}}
+    ])
+    return [system] + list(messages[1:])
+
+
+def cached_prompt_tokens(usage):
+    """
+    The number of prompt tokens served from the provider's prompt cache, from a usage object or dict.
+    """
+    if usage is None:
+        return 0
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) \
+        else getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return cached or 0
+
+
+def _request_options(response_format, max_tokens=None):
+    # Only send response_format when JSON mode is requested; not every provider accepts the field
+    options = {"response_format": response_format} if response_format is not None else {}
+    if max_tokens is not None:
+        options["max_tokens"] = max_tokens
+    return options
+
+
+async def acreate_chat_completion(messages, model, temperature, timeout, response_format=None, max_tokens=None):
+    """
+    Sends a chat completion request over the pooled async client.
+    Errors are raised to the caller.
+    """
+    client = get_async_client()
+    return await client.chat.completions.create(
+        model=model,
+        messages=cache_control_messages(messages, model),
+        temperature=temperature,
+        timeout=timeout,
+        **_request_options(response_format, max_tokens),
+    )
+
+
+async def astream_chat_completion(messages, model, temperature, timeout, on_delta, response_format=None,
+                                  max_tokens=None):
+    """
+    Streams a chat completion, calling on_delta(text, offset) for every content delta.
+    `offset` is the number of characters received before this delta; it restarts at 0
+    if the request is retried. Returns the assembled ChatCompletion (with usage when
+    the provider reports it), so callers can treat it like a non-streamed response.
+    """
+    client = get_async_client()
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=cache_control_messages(messages, model),
+        temperature=temperature,
+        timeout=timeout,
+        stream=True,
+        stream_options={"include_usage": True},
+        **_request_options(response_format, max_tokens),
+    )
+
+    parts = []
+    offset = 0
+    response_id = None
+    finish_reason = None
+    usage = None
+    async for chunk in stream:
+        response_id = chunk.id or response_id
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage.model_dump()
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        text = choice.delta.content if choice.delta else None
+        if text:
+            on_delta(text, offset)
+            offset += len(text)
+            parts.append(text)
+
+    return ChatCompletion.model_validate({
+        "id": response_id or "stream",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason or "stop",
+            "message": {"role": "assistant", "content": "".join(parts)},
+        }],
+        "usage": usage,
+    })
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine on the shared background event loop and blocks until it finishes.
+    Lets synchronous callers share the same connection pool as async ones.
+    """
+    loop = _get_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from the LLM event loop; await the coroutine instead.")
+    # The task keeps the caller's context variables (run ID and agent of log records)
+    return asyncio.run_coroutine_threadsafe(_with_context(coro, contextvars.copy_context()), loop).result()
+
+
+async def _with_context(coro, context):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
@@ -0,0 +1,182 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+DEFAULT_LOG_FILE = "mas.log"
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+# Model output longer than this is cut in log messages (the full text can go to an artifact file)
+DEFAULT_PAYLOAD_CHARS = 500
+DEFAULT_ARTIFACT_DIR = os.path.join("logs", "runs")
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+
+# Context attached to every record logged while a run or an agent call is in progress
+RUN_ID = contextvars.ContextVar("mas_run_id", default=None)
+AGENT = contextvars.ContextVar("mas_agent", default=None)
+
+_listener = None
+_setup_lock = threading.Lock()
+_artifact_counter = 0
+_artifact_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamps records with the run ID and agent name of the logging thread. Runs in the thread that
+    logs (on the QueueHandler), since the listener thread does not share its context.
+    """
+    def filter(self, record):
+        if getattr(record, "run_id", None) is None:
+            record.run_id = RUN_ID.get()
+        if getattr(record, "agent", None) is None:
+            record.agent = AGENT.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message, run_id, agent and, if present, file,
+    artifact and exception.
+    """
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "run_id": getattr(record, "run_id", None),
+            "agent": getattr(record, "agent", None),
+        }
+        for key in ("file", "artifact"):
+            if getattr(record, key, None) is not None:
+                data[key] = getattr(record, key)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class ArtifactHandler(logging.Handler):
+    """
+    Writes the full `payload` of records that carry one to <artifact_dir>/<run_id>/<artifact>.
+    Runs on the listener thread, so large bodies are never written on the generation path.
+    """
+    def __init__(self, artifact_dir):
+        super().__init__()
+        self.artifact_dir = artifact_dir
+
+    def emit(self, record):
+        payload = getattr(record, "payload", None)
+        artifact = getattr(record, "artifact", None)
+        if payload is None or artifact is None:
+            return
+        try:
+            run_dir = os.path.join(self.artifact_dir, getattr(record, "run_id", None) or "no_run")
+            os.makedirs(run_dir, exist_ok=True)
+            with open(os.path.join(run_dir, artifact), "w", encoding="utf-8") as f:
+                f.write(payload)
+        except Exception:
+            self.handleError(record)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def artifacts_enabled():
+    return os.getenv("MAS_LOG_ARTIFACTS", "0").lower() in ("1", "true", "yes")
+
+
+def _file_handler():
+    path = os.getenv("MAS_LOG_FILE", DEFAULT_LOG_FILE)
+    backups = _env_int("MAS_LOG_BACKUPS", DEFAULT_LOG_BACKUPS)
+    when = os.getenv("MAS_LOG_ROTATE_WHEN")
+    if when:
+        # Time-based rotation, e.g. "midnight" or "H"
+        return TimedRotatingFileHandler(path, when=when, backupCount=backups, encoding="utf-8", delay=True)
+    return RotatingFileHandler(path, maxBytes=_env_int("MAS_LOG_MAX_BYTES", DEFAULT_LOG_MAX_BYTES),
+                               backupCount=backups, encoding="utf-8", delay=True)
+
+
+def setup_logging(level=logging.INFO):
+    """
+    Routes all logging through a queue: callers only enqueue records, and a listener thread
+    formats and writes them to the rotating log file (JSON lines unless MAS_LOG_FORMAT=text),
+    the console (unless MAS_LOG_CONSOLE=0) and, with MAS_LOG_ARTIFACTS=1, per-run artifact files. Like logging.basicConfig,
+    it does nothing if logging is already configured, so it is safe to call repeatedly.
+    """
+    global _listener
+    with _setup_lock:
+        root = logging.getLogger()
+        if _listener is not None or root.handlers:
+            return
+        file_handler = _file_handler()
+        if os.getenv("MAS_LOG_FORMAT", "json").lower() == "text":
+            file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        else:
+            file_handler.setFormatter(JsonFormatter())
+        handlers = [file_handler]
+        if os.getenv("MAS_LOG_CONSOLE", "1").lower() not in ("0", "false", "no"):
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+            handlers.append(console_handler)
+        if artifacts_enabled():
+            handlers.append(ArtifactHandler(os.getenv("MAS_LOG_ARTIFACT_DIR", DEFAULT_ARTIFACT_DIR)))
+
+        log_queue = queue.Queue(-1)
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Flushes queued records and stops the listener thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def truncate_payload(text, limit=None):
+    """
+    Shortens a model body for a log message, keeping its start and noting how much was cut.
+    """
+    text = "" if text is None else str(text)
+    limit = _env_int("MAS_LOG_PAYLOAD_CHARS", DEFAULT_PAYLOAD_CHARS) if limit is None else limit
+    if limit < 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def log_payload(logger, level, message, payload, **extra):
+    """
+    Logs `message` followed by a truncated `payload`. With MAS_LOG_ARTIFACTS=1 the full payload is
+    written to an artifact file of the current run, and the record names that file.
+    """
+    global _artifact_counter
+    if not logger.isEnabledFor(level):
+        return
+    if artifacts_enabled():
+        with _artifact_lock:
+            _artifact_counter += 1
+            counter = _artifact_counter
+        extra["payload"] = "" if payload is None else str(payload)
+        extra["artifact"] = f"{counter:06d}-{extra.get('agent') or AGENT.get() or 'payload'}.txt"
+    logger.log(level, f"{message}\n{truncate_payload(payload)}", extra=extra)
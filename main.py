@@ -1,71 +1,273 @@
 import os
 import json
 import logging
-import time
 from abc import ABC, abstractmethod
 from dotenv import load_dotenv
 import pathlib
+import posixpath
 from string import Template
 import re
+import time
+import asyncio
+import threading
+import contextvars
+
+from openai import OpenAIError  # Ensure you're using OpenRouter's compatible OpenAI SDK
+from openai.types.chat import ChatCompletion
+
+import llm_client
+from budget import adaptive_max_tokens_enabled, create_run_budget, estimate_max_tokens, output_size
+from context_builder import build_code_context, count_message_tokens, count_tokens, find_imported_files
+from flow_parser import FlowStructureParser, parse_flow_text
+from llm_backends import get_backend, requires_api_key
+from logging_config import AGENT, RUN_ID, log_payload, setup_logging
+from manifest import ProjectManifest, manifest_path
+from model_routing import DEFAULT_MODEL, get_route
+from metrics import AGENT_COMMUNICATE_SECONDS, RunMetrics, observe_stage, record_llm_call, timed
+from rate_limiter import estimate_tokens, get_rate_limiter
+from response_cache import get_response_cache, make_cache_key
+from response_parser import ResponseParseError, extract_code_block, json_response_format, parse_json_object
+from retry import CircuitOpenError, call_with_retries, get_fallback_models
+from scheduler import DependencyScheduler, file_level
+from similarity_index import (get_reference_threshold, get_reference_tokens, get_reuse_threshold, is_boilerplate,
+                              get_similarity_index, path_key, shared_index_enabled)
+from static_checks import is_python, run_local_checks
+
+# Review keywords that send a file to FinalizerBot
+ISSUE_KEYWORDS = ['error', 'issue', 'fix', 'improve', 'incorrect', 'problem', 'bug', 'refactor']
+NEGATED_ISSUE_PATTERN = re.compile(
+    r"\b(?:no|without|zero|free of)\s+(?:\w+\s+){0,2}?(?:errors?|issues?|bugs?|problems?)\b"
+    r"|\bnothing to (?:fix|improve|refactor)\b"
+)
+# Review recorded for files that passed the local checks without an LLM review
+LOCAL_PASS_REVIEW = json.dumps({"verification": "All good (local checks passed, model review skipped)"})
+# DevBot's FLOW_STRUCTURE while the structure is still streaming; each file's message then carries the part known so far
+STREAMED_FLOW_STRUCTURE = "(still being generated; each request lists the files known when that file was started)"
 
-from openai import OpenAI, OpenAIError  # Ensure you're using OpenRouter's compatible OpenAI SDK
+# DevBot candidates generated per file (override with MAS_DEV_CANDIDATES)
+DEFAULT_DEV_CANDIDATES = 1
+
+# How flagged files are grouped into FinalizerBot calls (override with MAS_FINALIZE_MODE / MAS_FINALIZE_BATCH_TOKENS)
+FINALIZE_MODES = ("file", "directory", "budget")
+DEFAULT_FINALIZE_MODE = "file"
+DEFAULT_FINALIZE_BATCH_TOKENS = 6000
+
+# Where generated projects are written; runs with a run ID get their own workspace below it
+OUTPUT_ROOT = "generated_project"
+RUN_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Prompt files whose contents affect the generated code (recorded in the project manifest)
+GENERATION_PROMPT_FILES = ["dev.txt", "verification_bot.txt", "finalizer_bot_1.txt"]
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,  # Set to DEBUG for more detailed logs during troubleshooting
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    handlers=[
-        logging.FileHandler("mas.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Retrieve OpenRouter API key from environment variables
-openai_api_key = os.getenv('OPENROUTER_API_KEY')
-if not openai_api_key:
-    logger.error("OPENROUTER_API_KEY environment variable is not set.")
-    raise ValueError("OPENROUTER_API_KEY environment variable is not set.")
-else:
-    logger.info("OpenRouter API key loaded successfully.")
-
-# Initialize the OpenAI client for OpenRouter
-client = OpenAI(
-    api_key=openai_api_key,
-    base_url="https://openrouter.ai/api/v1"
-)
+# Runtime setup (logging, .env, API key, client settings) happens on first use, not at import
+_runtime_ready = False
+_runtime_lock = threading.Lock()
+
+
+def configure_logging():
+    """
+    Queued logging to the rotating mas.log and the console (see logging_config.py);
+    a no-op if the host app (e.g. app.py) configured logging first.
+    """
+    setup_logging(level=logging.INFO)  # Set to DEBUG for more detailed logs during troubleshooting
+
+
+def ensure_runtime():
+    """
+    Configures logging, loads the .env file, validates the API key and configures the pooled
+    client the first time a model call or a run needs them. Cheap after the first call.
+    """
+    global _runtime_ready
+    if _runtime_ready:
+        return
+    with _runtime_lock:
+        if _runtime_ready:
+            return
+        configure_logging()
+
+        # Load environment variables from .env file
+        load_dotenv()
+
+        # Retrieve OpenRouter API key from environment variables
+        openai_api_key = os.getenv('OPENROUTER_API_KEY')
+        if openai_api_key:
+            logger.info("OpenRouter API key loaded successfully.")
+        elif requires_api_key():
+            # The replay and stub backends (MAS_LLM_BACKEND) run without network access or a key
+            logger.error("OPENROUTER_API_KEY environment variable is not set.")
+            raise ValueError("OPENROUTER_API_KEY environment variable is not set.")
+
+        # Configure the pooled async client for OpenRouter
+        llm_client.configure(api_key=openai_api_key, base_url="https://openrouter.ai/api/v1")
+        _runtime_ready = True
 
 # def call_openai_chat(messages, model="deepseek/deepseek-r1-distill-llama-70b", temperature=0.5, timeout=60):
 #def call_openai_chat(messages, model="anthropic/claude-3.5-sonnet:beta", temperature=0.5, timeout=60):
-def call_openai_chat(messages, model="deepseek/deepseek-r1-distill-llama-70b", temperature=0.5, timeout=60):
+async def acall_openai_chat(messages, model=DEFAULT_MODEL, temperature=0.5, timeout=60,
+                            use_cache=True, stats=None, on_delta=None, json_mode=False, max_tokens=None):
     """
-    Calls the OpenRouter/OpenAI chat completion endpoint with the updated SDK.
+    Calls the OpenRouter/OpenAI chat completion endpoint over the shared async connection pool
+    (or the recording/replay/stub backend selected with MAS_LLM_BACKEND).
+    Identical requests are answered from the response cache unless `use_cache` is False.
+    If a CallStats object is passed in `stats`, it is filled in with details about the call.
+    If `on_delta` is given, the completion is streamed and on_delta(text, offset) is called per token chunk.
+    With `json_mode`, models known to support it are asked for a JSON object via response_format.
+    `max_tokens` caps the completion length (None leaves it to the provider).
     """
-    logger.debug(f"Sending messages to OpenAI:\n{json.dumps(messages, indent=2)}")
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-        )
-        logger.debug(f"Raw response from OpenAI: {response}")
+    ensure_runtime()
+    if stats is None:
+        stats = llm_client.CallStats()
+    stats.model = model
+    stats.prompt_tokens = count_message_tokens(messages)
+    started = time.perf_counter()
+
+    def finish(response):
+        # Every outcome (cache hit, failure, completion) ends up in the /metrics counters
+        stats.duration = time.perf_counter() - started
+        usage = getattr(response, "usage", None)
+        if usage:
+            stats.prompt_tokens = usage.prompt_tokens
+            stats.completion_tokens = usage.completion_tokens
+            stats.cached_tokens = llm_client.cached_prompt_tokens(usage)
+        if getattr(response, "choices", None):
+            stats.finish_reason = response.choices[0].finish_reason
+        record_llm_call(stats, succeeded=response is not None)
+        return response
+
+    backend = get_backend()
+    # Recorded and synthetic responses must never end up in the shared response cache
+    cache = get_response_cache() if use_cache and backend.cacheable else None
+    cache_key = make_cache_key(model, temperature, messages, json_response_format(model) if json_mode else None,
+                               max_tokens) if cache else None
+    if cache:
+        # SQLite reads and writes (and evictions) run in a worker thread, off the shared event loop
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            stats.cache_hit = True
+            logger.debug(f"Response cache hit for {model} ({cache_key[:12]}).")
+            return finish(ChatCompletion.model_validate(cached))
+
+    # Only waits when the model's requests/tokens-per-minute budget would be exceeded
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(messages)
+
+    async def attempt(candidate_model):
+        stats.rate_limit_wait += await limiter.acquire(candidate_model, estimated_tokens)
+        # Fallback models may differ in JSON mode support
+        response_format = json_response_format(candidate_model) if json_mode else None
+        if on_delta is not None:
+            response = await backend.stream(
+                messages=messages,
+                model=candidate_model,
+                temperature=temperature,
+                timeout=timeout,
+                on_delta=on_delta,
+                response_format=response_format,
+                max_tokens=max_tokens,
+            )
+        else:
+            response = await backend.create(
+                messages=messages,
+                model=candidate_model,
+                temperature=temperature,
+                timeout=timeout,
+                response_format=response_format,
+                max_tokens=max_tokens,
+            )
+        if getattr(response, "usage", None):
+            await limiter.arecord_usage(candidate_model, estimated_tokens, response.usage.total_tokens)
         return response
-    except OpenAIError as e:
+
+    if logger.isEnabledFor(logging.DEBUG):
+        log_payload(logger, logging.DEBUG, "Sending messages to OpenAI:", json.dumps(messages, indent=2))
+    try:
+        # Retries transient errors with backoff, then falls back to MAS_FALLBACK_MODELS in order
+        response = await call_with_retries(attempt, [model] + get_fallback_models(model), stats=stats)
+        if logger.isEnabledFor(logging.DEBUG):
+            log_payload(logger, logging.DEBUG, "Raw response from OpenAI:", response)
+    except (OpenAIError, CircuitOpenError) as e:
         logger.warning(f"OpenAI Error: {e}")
-        return None
+        return finish(None)
+    if stats.model != model:
+        logger.info(f"Request for {model} was served by fallback model {stats.model}.")
+
+    # Only cache usable completions from the requested model
+    if cache and stats.model == model and response is not None and response.choices and response.choices[0].message.content:
+        await asyncio.to_thread(cache.set, cache_key, response.model_dump(mode="json"))
+    return finish(response)
+
+
+def call_openai_chat(messages, model=DEFAULT_MODEL, temperature=0.5, timeout=60,
+                     use_cache=True, stats=None, on_delta=None, json_mode=False, max_tokens=None):
+    """
+    Synchronous shim around acall_openai_chat for callers that are not running an event loop.
+    """
+    return llm_client.run_sync(acall_openai_chat(messages, model=model, temperature=temperature, timeout=timeout,
+                                                 use_cache=use_cache, stats=stats, on_delta=on_delta,
+                                                 json_mode=json_mode, max_tokens=max_tokens))
 
 
 ##########################################################################
 # Abstract Agent + Specialized Bot Classes
 ##########################################################################
 
+# Compiled prompt templates: {full_path: [Template, mtime, time of the last mtime check]}
+_prompt_templates = {}
+_prompt_templates_lock = threading.Lock()
+# Seconds between mtime checks of a cached prompt file (MAS_PROMPT_RELOAD_INTERVAL; negative disables reloading)
+DEFAULT_PROMPT_RELOAD_INTERVAL = 2.0
+
+
+def _prompt_reload_interval():
+    try:
+        return float(os.getenv("MAS_PROMPT_RELOAD_INTERVAL", DEFAULT_PROMPT_RELOAD_INTERVAL))
+    except ValueError:
+        return DEFAULT_PROMPT_RELOAD_INTERVAL
+
+
+def load_prompt_template(prompt_file):
+    """
+    Returns the compiled Template of a prompt file. Templates are read once and shared by
+    every agent; an edited prompt file is picked up within MAS_PROMPT_RELOAD_INTERVAL seconds.
+    """
+    full_path = os.path.join('complex_projects', prompt_file)
+    now = time.monotonic()
+    interval = _prompt_reload_interval()
+    with _prompt_templates_lock:
+        cached = _prompt_templates.get(full_path)
+        if cached is not None and (interval < 0 or now - cached[2] < interval):
+            return cached[0]
+
+        try:
+            mtime = os.stat(full_path).st_mtime_ns
+        except FileNotFoundError:
+            logger.error(f"Prompt file not found: {full_path}")
+            raise FileNotFoundError(f"Prompt file not found: {full_path}")
+
+        if cached is not None and cached[1] == mtime:
+            cached[2] = now
+            return cached[0]
+
+        with open(full_path, 'r') as f:
+            template = Template(f.read())
+        if cached is not None:
+            logger.info(f"Reloaded prompt template {full_path}.")
+        _prompt_templates[full_path] = [template, mtime, now]
+        return template
+
+
 class Agent(ABC):
-    def __init__(self, name, prompt_file):
+    def __init__(self, name, prompt_file, use_cache=True):
         self.name = name
         self.prompt_file = prompt_file
+        self.use_cache = use_cache
+        self.last_call = None  # llm_client.CallStats of the latest model call
+        self.repair_call = None  # llm_client.CallStats of the latest JSON repair call, if one was needed
+        self.context_stats = None  # Token counts of the latest code context, if the agent builds one
+        self.route = get_route(name)  # Model, temperature, max_tokens and timeout for this role (model_routing.py)
+        self.max_tokens = self.route.max_tokens  # Completion limit of the next call (DevBot adapts it per file)
         self.prompt_template = self.load_prompt(prompt_file)
         self.reset_conversation()  # Initialize conversation history
 
@@ -74,90 +276,146 @@ class Agent(ABC):
         self.conversation_history = [{"role": "system", "content": ""}]
 
     def load_prompt(self, prompt_file):
-        full_path = os.path.join('complex_projects', prompt_file)
-        if not os.path.exists(full_path):
-            logger.error(f"Prompt file not found: {full_path}")
-            raise FileNotFoundError(f"Prompt file not found: {full_path}")
-
-        with open(full_path, 'r') as f:
-            text = f.read()
-            return Template(text)
+        return load_prompt_template(prompt_file)
 
     def update_prompt(self, replacements):
         prompt = self.prompt_template.safe_substitute(replacements)
         self.conversation_history[0]['content'] = prompt
 
-    def communicate(self, user_message=None):
+    def communicate(self, user_message=None, on_delta=None, json_mode=False):
         """
         Sends conversation_history to the model, returns the text or "" on error.
+        With `on_delta`, the reply is streamed and on_delta(text, offset) is called as tokens arrive.
+        With `json_mode`, JSON output is requested from models that support it.
         """
         if user_message:
             self.conversation_history.append({"role": "user", "content": user_message})
 
-        response = call_openai_chat(self.conversation_history)
+        self.last_call = llm_client.CallStats(agent=self.name)
+        started = time.perf_counter()
+        agent_token = AGENT.set(self.name)  # Tags log records of this call with the agent
+        try:
+            response = call_openai_chat(self.conversation_history, use_cache=self.use_cache, stats=self.last_call,
+                                        on_delta=on_delta, json_mode=json_mode, **self._route_options())
+            reply = self._handle_response(response)
+        finally:
+            AGENT.reset(agent_token)
+        AGENT_COMMUNICATE_SECONDS.observe(time.perf_counter() - started, agent=self.name)
+        return reply
+
+    async def acommunicate(self, user_message=None, on_delta=None, json_mode=False):
+        """
+        Async variant of communicate() that awaits the pooled client instead of blocking a thread.
+        """
+        if user_message:
+            self.conversation_history.append({"role": "user", "content": user_message})
+
+        self.last_call = llm_client.CallStats(agent=self.name)
+        started = time.perf_counter()
+        agent_token = AGENT.set(self.name)
+        try:
+            response = await acall_openai_chat(self.conversation_history, use_cache=self.use_cache,
+                                               stats=self.last_call, on_delta=on_delta, json_mode=json_mode,
+                                               **self._route_options())
+            reply = self._handle_response(response)
+        finally:
+            AGENT.reset(agent_token)
+        AGENT_COMMUNICATE_SECONDS.observe(time.perf_counter() - started, agent=self.name)
+        return reply
+
+    def _route_options(self):
+        return {"model": self.route.model, "temperature": self.route.temperature,
+                "timeout": self.route.timeout, "max_tokens": self.max_tokens}
+
+    def _handle_response(self, response):
+        """
+        Validates a chat completion, appends the assistant message to the history and returns its text.
+        """
         if not response:
             logger.error(f"[{self.name}] No response object received.")
             return ""
         if not hasattr(response, "choices") or not response.choices:
-            logger.error(f"[{self.name}] No valid choices in response.")
-            logger.error(f"Full response: {response}")
+            log_payload(logger, logging.ERROR, f"[{self.name}] No valid choices in response. Full response:", response)
             return ""
         if not hasattr(response.choices[0], "message") or not response.choices[0].message:
-            logger.error(f"[{self.name}] Response.choices[0].message is missing.")
-            logger.error(f"Full response: {response}")
+            log_payload(logger, logging.ERROR, f"[{self.name}] Response.choices[0].message is missing. Full response:",
+                        response)
             return ""
 
         assistant_msg = response.choices[0].message.content
         if assistant_msg is None:
-            logger.error(f"[{self.name}] assistant_msg is None.")
-            logger.error(f"Full response: {response}")
+            log_payload(logger, logging.ERROR, f"[{self.name}] assistant_msg is None. Full response:", response)
             return ""
 
-        logger.info(f"[{self.name}] Assistant message:\n{assistant_msg}\n")
+        # The only place model output is logged; long replies are truncated (see MAS_LOG_PAYLOAD_CHARS)
+        log_payload(logger, logging.INFO, f"[{self.name}] Assistant message:", assistant_msg)
         self.conversation_history.append({"role": "assistant", "content": assistant_msg})
         return assistant_msg
 
+    def parse_json_reply(self, text, required_key, expected_format):
+        """
+        Parses a JSON object containing `required_key` out of a reply. If the reply is malformed,
+        a short repair call (without the original prompt) asks the model to fix the JSON only,
+        so a formatting slip does not cost a full regeneration. Returns None if both attempts fail.
+        """
+        self.repair_call = None
+        try:
+            return parse_json_object(text, required_key)
+        except ResponseParseError as e:
+            logger.warning(f"[{self.name}] {e} Requesting a JSON repair.")
+
+        repair_prompt = load_prompt_template('json_repair.txt').safe_substitute({"EXPECTED_FORMAT": expected_format})
+        messages = [{"role": "system", "content": repair_prompt}, {"role": "user", "content": text}]
+        self.repair_call = llm_client.CallStats(agent=f"{self.name}Repair")
+        response = call_openai_chat(messages, model=self.route.model, temperature=0, timeout=self.route.timeout,
+                                    use_cache=self.use_cache, stats=self.repair_call, json_mode=True)
+        repaired = response.choices[0].message.content if response and response.choices else None
+        try:
+            return parse_json_object(repaired, required_key)
+        except ResponseParseError as e:
+            logger.error(f"[{self.name}] JSON repair failed: {e}")
+            return None
+
+
+# Expected reply formats, quoted to the model by JSON repair calls
+ARCHITECTURE_FORMAT = '{"architecture_overview": "<detailed architecture description>"}'
+FINALIZER_FORMAT = '{"final_codes": [{"rel_path": "<path/to/file>", "updated_code": "<full file content>"}]}'
+
 
 class ArchitectureBot(Agent):
     """
     Returns a single JSON key: "architecture_overview".
     """
-    def __init__(self, prompt_file='architecture_bot.txt'):
-        super().__init__('ArchitectureBot', prompt_file)
+    def __init__(self, prompt_file='architecture_bot.txt', use_cache=True):
+        super().__init__('ArchitectureBot', prompt_file, use_cache)
 
     def generate_architecture_overview(self, project_description,language):
         self.update_prompt({"PROJECT_DESCRIPTION": project_description,"PROJECT_LANGUAGE":language})
-        resp_text = self.communicate()
+        resp_text = self.communicate(json_mode=True)
         if not resp_text:
             logger.error("[ArchitectureBot] Empty or invalid text response.")
             return {"architecture_overview": "Error: empty or invalid."}
 
-        logger.info(f"Raw response from ArchitectureBot:\n{resp_text}")
-        try:
-            data = json.loads(resp_text)
-            if "architecture_overview" not in data:
-                logger.error("[ArchitectureBot] Missing key 'architecture_overview'.")
-                return {"architecture_overview": "Error: missing architecture_overview key."}
-            return data
-        except json.JSONDecodeError as e:
-            logger.error(f"JSONDecodeError parsing ArchitectureBot response: {e}")
+        data = self.parse_json_reply(resp_text, "architecture_overview", ARCHITECTURE_FORMAT)
+        if data is None:
+            logger.error("[ArchitectureBot] No valid JSON with key 'architecture_overview'.")
             return {"architecture_overview": "Error: Invalid JSON."}
+        return data
 
 
 class FlowStructureBot(Agent):
     """
     Returns plain-text folder structure (no JSON).
     """
-    def __init__(self, prompt_file='flow_structure_bot.txt'):
-        super().__init__('FlowStructureBot', prompt_file)
+    def __init__(self, prompt_file='flow_structure_bot.txt', use_cache=True):
+        super().__init__('FlowStructureBot', prompt_file, use_cache)
 
-    def generate_flow_structure(self, project_description,language):
+    def generate_flow_structure(self, project_description,language, on_delta=None):
         self.update_prompt({"PROJECT_DESCRIPTION": project_description,"PROJECT_LANGUAGE":language})
-        resp_text = self.communicate()
+        resp_text = self.communicate(on_delta=on_delta)
         if not resp_text:
             logger.error("[FlowStructureBot] empty or invalid text.")
             return ""
-        logger.info(f"[FlowStructureBot] Raw response:\n{resp_text}")
         return resp_text.strip()
 
 
@@ -165,117 +423,161 @@ class DevBot(Agent):
     """
     Generates code for a single file. A new DevBot instance is recommended per file for isolation.
     """
-    def __init__(self, name, prompt_file):
-        super().__init__(name, prompt_file)
+    def __init__(self, name, prompt_file, use_cache=True):
+        super().__init__(name, prompt_file, use_cache)
 
     def generate_file_code(self, architecture_overview, flow_structure, file_path,
-                           accumulated_code_dict, project_description, language="python"):
+                           accumulated_code_dict, project_description, language="python", on_delta=None,
+                           reference=None, flow_in_message=False):
+        file_message = self._prepare_file_prompt(architecture_overview, flow_structure, file_path,
+                                                 accumulated_code_dict, project_description, language, reference,
+                                                 flow_in_message)
+        self.communicate(file_message, on_delta=on_delta)
+        return self._extract_code_block(language)
+
+    async def agenerate_file_code(self, architecture_overview, flow_structure, file_path,
+                                  accumulated_code_dict, project_description, language="python", on_delta=None,
+                                  reference=None, flow_in_message=False):
+        """
+        Async variant of generate_file_code(), so several candidates can be generated (and cancelled) together.
+        """
+        file_message = self._prepare_file_prompt(architecture_overview, flow_structure, file_path,
+                                                 accumulated_code_dict, project_description, language, reference,
+                                                 flow_in_message)
+        await self.acommunicate(file_message, on_delta=on_delta)
+        return self._extract_code_block(language)
+
+    def _prepare_file_prompt(self, architecture_overview, flow_structure, file_path,
+                             accumulated_code_dict, project_description, language, reference=None,
+                             flow_in_message=False):
+        """
+        Fills the system prompt with project-level context only, so it is byte-identical for every
+        file of a run and providers can serve it from their prompt cache. Returns the per-file
+        user message (MODULE_DESCRIPTION and ACCUMULATED_CODE, plus a similar file from an earlier
+        project as `reference`, if any) that follows it.
+
+        With `flow_in_message` (files generated while the folder structure streams), `flow_structure`
+        is the part known when the file was started; it goes into the user message instead, and the
+        system prompt holds a fixed note in its place.
+        """
         # Reset conversation for each file
         self.reset_conversation()
 
         # Summarize existing code
         summarized_code = self._summarize_accumulated_code(accumulated_code_dict)
 
-        file_description = f"""You are generating code for this file: {file_path}.
-The target language is {language.capitalize()}.
-
-Existing code in the project so far:
-{summarized_code}
-
-Only create new code for this file (do NOT overwrite existing files):
-"""
-
         self.update_prompt({
             "ARCHITECTURE_OVERVIEW": architecture_overview,
-            "FLOW_STRUCTURE": flow_structure,
-            "MODULE_DESCRIPTION": file_description,
-            "ACCUMULATED_CODE": summarized_code,
+            "FLOW_STRUCTURE": STREAMED_FLOW_STRUCTURE if flow_in_message else flow_structure,
             "PROJECT_DESCRIPTION": project_description,
             "LANGUAGE": language.lower()
         })
 
         # Single pass (1 iteration)
         logger.info(f"{self.name} generating code for: {file_path}")
-        self.communicate()
-        time.sleep(1)
-        return self._extract_code_block(language)
+        return f"""MODULE_DESCRIPTION: You are generating code for this file: {file_path}.
+The target language is {language.capitalize()}.
+""" + (f"""
+FLOW_STRUCTURE:
+{flow_structure}
+""" if flow_in_message else "") + f"""
+ACCUMULATED_CODE (existing code in the project so far):
+{summarized_code or "None yet."}
+
+Only create new code for this file (do NOT overwrite existing files).""" + (f"""
+
+REFERENCE (a similar file from an earlier project; reuse what fits, adapt names and imports to this project):
+{reference}""" if reference else "")
 
     def _summarize_accumulated_code(self, accumulated_code_dict):
         summary = ""
-        for file_path, code in accumulated_code_dict.items():
+        # Sorted, so the prompt (and its cacheable prefix) does not depend on which file finished first
+        for file_path in sorted(accumulated_code_dict):
             summary += f"File: {file_path}\n"
             summary += f"Description: [Previously generated code]\n\n"
         return summary.strip()
 
     def _extract_code_block(self, language):
         """
-        Extract code from the conversation history (last AI message).
+        Extract code from the last AI message (never from the prompt, which contains fences of its own).
         """
-        code_block_identifier = f"```{language.lower()}"
         for msg in reversed(self.conversation_history):
-            content = msg["content"]
-            # Check for language-specific code fence
-            if code_block_identifier in content:
-                try:
-                    code_block = content.split(code_block_identifier, 1)[1].split("```", 1)[0].strip()
-                    logger.info(f"[DevBot] Extracted {language} code block.")
-                    return code_block
-                except IndexError:
-                    pass
-
-            # Fallback: any triple backtick code fence
-            if "```" in content:
-                try:
-                    code_block = content.split("```", 1)[1].split("```", 1)[0].strip()
-                    logger.warning("[DevBot] Created a code block.")
-                    return code_block
-                except IndexError:
-                    pass
+            if msg["role"] != "assistant":
+                continue
+            code_block = extract_code_block(msg["content"], language)
+            if code_block:
+                logger.info(f"[DevBot] Extracted {language} code block.")
+                return code_block
+            break
 
         logger.warning("[DevBot] No code block found.")
         return ""
 
 
 class VerificationBot(Agent):
-    def __init__(self, prompt_file='verification_bot.txt'):
-        super().__init__('VerificationBot', prompt_file)
+    def __init__(self, prompt_file='verification_bot.txt', use_cache=True):
+        super().__init__('VerificationBot', prompt_file, use_cache)
 
-    def review_code(self, accumulated_code_dict, project_description, module_code, module_name):
-        # Generate a summary for verification
-        summarized_code = self._summarize_accumulated_code(accumulated_code_dict)
+    def review_code(self, accumulated_code_dict, project_description, module_code, module_name, local_issues=None):
+        """
+        Reviews a module. `local_issues` (from static_checks) are passed on to the model.
+        """
+        self._prepare_review_prompt(accumulated_code_dict, project_description, module_code, module_name,
+                                    local_issues)
+        return self._handle_review(self.communicate())
+
+    async def areview_code(self, accumulated_code_dict, project_description, module_code, module_name,
+                           local_issues=None):
+        """
+        Async variant of review_code().
+        """
+        self._prepare_review_prompt(accumulated_code_dict, project_description, module_code, module_name,
+                                    local_issues)
+        return self._handle_review(await self.acommunicate())
+
+    def _prepare_review_prompt(self, accumulated_code_dict, project_description, module_code, module_name,
+                               local_issues=None):
+        # Generate a summary for verification (the module itself is passed separately as MODULE_CODE)
+        other_code = {path: code for path, code in accumulated_code_dict.items() if path != module_name}
+        summarized_code = self._summarize_accumulated_code(other_code, module_name, module_code)
 
         self.update_prompt({
             "ACCUMULATED_CODE": summarized_code,
             "PROJECT_DESCRIPTION": project_description,
             "MODULE_CODE": module_code,
-            "MODULE_NAME": module_name
+            "MODULE_NAME": module_name,
+            "LOCAL_CHECKS": "\n".join(f"- {issue}" for issue in local_issues) if local_issues else "None"
         })
-        review_text = self.communicate()
+
+    def _handle_review(self, review_text):
         if not review_text:
             logger.error(f"[VerificationBot] empty or invalid review response.")
             return ""
-        logger.info(f"[VerificationBot] Review:\n{review_text}")
         return review_text
 
-    def _summarize_accumulated_code(self, accumulated_code_dict):
+    def _summarize_accumulated_code(self, accumulated_code_dict, module_name, module_code):
         """
-        Create a summary of accumulated code for verification.
+        Create a summary of accumulated code for verification: full text for the files the
+        module imports, signatures for the rest, within the context token budget.
         """
-        summary = ""
-        for file_path, code in accumulated_code_dict.items():
-            summary += f"File: {file_path}\n"
-            summary += f"Code:\n{code}\n\n"
-        return summary.strip()
+        imported = find_imported_files(module_name, module_code, accumulated_code_dict)
+        summary, self.context_stats = build_code_context(accumulated_code_dict, full_paths=imported)
+        return summary
 
 
 class FinalizerBot(Agent):
     """
     Finalizes the code after verification and returns an array of finalized codes.
     """
-    def __init__(self, name, prompt_file):
-        super().__init__(name, prompt_file)
+    def __init__(self, name, prompt_file, use_cache=True):
+        super().__init__(name, prompt_file, use_cache)
 
-    def finalize_code(self, project_description, accumulated_code_dict, reviews, language, flow_structure):
+    def finalize_code(self, project_description, accumulated_code_dict, reviews, language, flow_structure,
+                      on_delta=None, rel_paths=None):
+        """
+        Returns {"final_codes": [...]}. With `rel_paths`, the model is asked for exactly those files
+        (a batch of several flagged files finalized in one call).
+        """
         self.reset_conversation()
 
         summarized_code = self._summarize_accumulated_code(accumulated_code_dict)
@@ -284,37 +586,35 @@ class FinalizerBot(Agent):
         self.update_prompt({
             "PROJECT_DESCRIPTION": project_description,
             "ACCUMULATED_CODE": summarized_code,
-            "REVIEWS": combined_reviews,
+            "REVIEW": combined_reviews,
             "LANGUAGE": language.lower(),
             "FILE_FOLDER_STRUCTRE": flow_structure
         })
-        final_resp = self.communicate()
+        user_message = None
+        if rel_paths:
+            user_message = ("Return one `final_codes` entry for each of these files, and no other files:\n"
+                            + "\n".join(f"- {path}" for path in rel_paths))
+        final_resp = self.communicate(user_message, on_delta=on_delta, json_mode=True)
         if not final_resp:
             logger.error("[FinalizerBot] Final code empty.")
             return {"final_codes": []}  # Return empty array on failure
         logger.info("[FinalizerBot] Returned final code.")
 
-        # Parse the JSON response
-        try:
-            data = json.loads(final_resp)
-            if "final_codes" not in data:
-                logger.error("[FinalizerBot] Missing 'final_codes' key in response.")
-                return {"final_codes": []}
-            return data
-        except json.JSONDecodeError as e:
-            logger.error(f"FinalizerBot JSONDecodeError: {e}")
-            logger.error(f"Response content: {final_resp}")
+        # Parse the JSON response (repairing it if needed)
+        data = self.parse_json_reply(final_resp, "final_codes", FINALIZER_FORMAT)
+        if data is None:
+            log_payload(logger, logging.ERROR, "[FinalizerBot] No valid JSON with key 'final_codes'. Response content:",
+                        final_resp)
             return {"final_codes": []}
+        return data
 
     def _summarize_accumulated_code(self, accumulated_code_dict):
         """
-        Create a summary of accumulated code for finalization.
+        Create a summary of accumulated code for finalization. Every file handed to
+        FinalizerBot is rewritten, so all of them are kept verbatim.
         """
-        summary = ""
-        for file_path, code in accumulated_code_dict.items():
-            summary += f"File: {file_path}\n"
-            summary += f"Code:\n{code}\n\n"
-        return summary.strip()
+        summary, self.context_stats = build_code_context(accumulated_code_dict, required_paths=accumulated_code_dict)
+        return summary
 
 
 ##########################################################################
@@ -328,6 +628,21 @@ class StateManager:
         self.flow_structure = ""
         self.accumulated_code = {}  # Dictionary {file_path: code}
         self.reviews = []
+        self.use_cache = True
+        self.manifest = None  # manifest.ProjectManifest of the project being generated
+        self.file_inputs = {}  # {file_path: input hashes recorded in the manifest}
+        self.unrecorded_files = {}  # {file_path: written content} of files saved before their inputs were known
+        self.completed_files = []  # Files whose pipeline has finished (for resuming a job)
+        self.file_paths = []  # Every file of the flow structure
+        self.pipelined = False  # Files are started while the flow structure streams (see pipeline_flow_enabled)
+        self.flagged_files = {}  # {file_path: review} of files waiting for batch finalization
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.metrics = RunMetrics()  # Per-run timings and token counts for the run summary
+        self.budget = None  # budget.RunBudget enforcing the run's token, call and cost ceilings
+        self.budget_totals = {}  # Totals of the budget before an interruption (see RunBudget.restore)
+        self.output_sizes = {}  # {file_path: completion tokens of its code}, for adaptive max_tokens
+        self._lock = threading.Lock()  # Files are generated concurrently
 
     def set_project_description(self, desc):
         self.project_description = desc
@@ -339,10 +654,119 @@ class StateManager:
         self.flow_structure = text
 
     def update_code(self, file_path, code_snippet):
-        self.accumulated_code[file_path] = code_snippet
+        with self._lock:
+            self.accumulated_code[file_path] = code_snippet
+
+    def code_snapshot(self):
+        """
+        Returns a copy of the accumulated code, sorted by path, that is safe to iterate while other
+        files are generated.
+        """
+        with self._lock:
+            return dict(sorted(self.accumulated_code.items()))
 
     def add_review(self, review_text):
-        self.reviews.append(review_text)
+        with self._lock:
+            self.reviews.append(review_text)
+
+    def record_call(self, call_stats):
+        with self._lock:
+            if call_stats.cache_hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        self.metrics.record_call(call_stats)
+        if self.budget is not None:
+            self.budget.charge(call_stats)
+
+    def record_output_size(self, file_path, size):
+        with self._lock:
+            self.output_sizes[file_path] = size
+
+    def output_sizes_snapshot(self):
+        with self._lock:
+            return dict(self.output_sizes)
+
+    def cache_summary(self):
+        with self._lock:
+            total = self.cache_hits + self.cache_misses
+            return {
+                "enabled": self.use_cache,
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_rate": round(self.cache_hits / total, 3) if total else 0.0,
+            }
+
+    def add_flagged(self, file_path, review_text):
+        with self._lock:
+            self.flagged_files[file_path] = review_text
+
+    def remove_flagged(self, file_paths):
+        with self._lock:
+            for file_path in file_paths:
+                self.flagged_files.pop(file_path, None)
+
+    def set_manifest(self, manifest, file_inputs):
+        """
+        Sets the project manifest and file inputs. Returns the files saved before they were known
+        ({file_path: written content}), which still have to be recorded.
+        """
+        with self._lock:
+            self.manifest = manifest
+            self.file_inputs = file_inputs
+            unrecorded, self.unrecorded_files = self.unrecorded_files, {}
+            return unrecorded
+
+    def manifest_inputs(self, file_path, written):
+        """
+        Returns the manifest inputs of a file that was just saved, or None while they are not known
+        (the folder structure is still streaming); the file is then recorded by set_manifest.
+        """
+        with self._lock:
+            if self.manifest is None or file_path not in self.file_inputs:
+                self.unrecorded_files[file_path] = written
+                return None
+            return self.file_inputs[file_path]
+
+    def mark_completed(self, file_path):
+        with self._lock:
+            if file_path not in self.completed_files:
+                self.completed_files.append(file_path)
+
+    def to_dict(self):
+        """
+        Serializable checkpoint of the run (see from_dict).
+        """
+        with self._lock:
+            return {
+                "project_description": self.project_description,
+                "architecture": self.architecture,
+                "flow_structure": self.flow_structure,
+                "accumulated_code": dict(self.accumulated_code),
+                "reviews": list(self.reviews),
+                "completed_files": list(self.completed_files),
+                "flagged_files": dict(self.flagged_files),
+                "use_cache": self.use_cache,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "budget": self.budget.to_dict() if self.budget else dict(self.budget_totals),
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.project_description = data.get("project_description", "")
+        state.architecture = data.get("architecture", {})
+        state.flow_structure = data.get("flow_structure", "")
+        state.accumulated_code = dict(data.get("accumulated_code", {}))
+        state.reviews = list(data.get("reviews", []))
+        state.completed_files = list(data.get("completed_files", []))
+        state.flagged_files = dict(data.get("flagged_files", {}))
+        state.use_cache = data.get("use_cache", True)
+        state.cache_hits = data.get("cache_hits", 0)
+        state.cache_misses = data.get("cache_misses", 0)
+        state.budget_totals = dict(data.get("budget", {}))
+        return state
 
 
 ##########################################################################
@@ -372,61 +796,36 @@ def parse_flow_structure(flow_text):
         "tests/test_api_handler.py"
       ]
 
-    Assumptions:
-      - A line ending with '/' is a directory.
-      - A line with '.' is likely a file (naive check).
-      - Each sub-level is assumed to be ~2 spaces deeper than its parent.
-      - Lines might start with '-', ' ' or tabs, so we trim them.
+    Indentation width, tabs, tree drawings ("├──", "│") and trailing comments are tolerated, and
+    unsafe paths are dropped (see flow_parser.FlowStructureParser, which also parses streamed text).
     """
+    return parse_flow_text(flow_text)
 
-    lines = flow_text.splitlines()
-    stack = []        # Directory stack
-    file_paths = []   # Final list of file paths
-    prev_indent = 0   # Tracks the indentation of the current directory level
-
-    for raw_line in lines:
-        line = raw_line.rstrip()
-        if not line:
-            # Skip blank lines
-            continue
-
-        # Count leading spaces to figure out indentation
-        indent = len(raw_line) - len(raw_line.lstrip(' '))
-        # Because we assume 2 spaces = 1 indent level, adjust accordingly
-
-        # If indentation is less than before, pop directories from stack
-        while stack and indent < prev_indent:
-            stack.pop()
-            prev_indent -= 2
-
-        stripped_line = line.strip(" -\t")
-        if stripped_line.endswith("/"):
-            # It's a directory
-            dir_name = stripped_line[:-1]  # Remove trailing slash
-            stack.append(dir_name)
-            prev_indent = indent + 2
-        else:
-            # It's presumably a file
-            subpath = "/".join(stack)
-            if subpath:
-                file_paths.append(os.path.join(subpath, stripped_line))
-            else:
-                file_paths.append(stripped_line)
 
-    return file_paths
+def workspace_dir(run_id=None):
+    """
+    The output root of a run: generated_project/<run_id>, or generated_project itself for runs without
+    a run ID (CLI and benchmark runs). Raises ValueError for a run ID that is not a plain name.
+    """
+    if run_id is None:
+        return OUTPUT_ROOT
+    if not RUN_ID_PATTERN.match(run_id):
+        raise ValueError(f"Invalid run ID: {run_id!r}")
+    return os.path.join(OUTPUT_ROOT, run_id)
 
 
 def create_directories_and_save_file(root_dir, relative_path, content, language):
     """
     Create subdirs under `root_dir` as needed, then save 'content' to `relative_path`.
     Uses the file extension from the `relative_path` without appending a language-specific extension.
+    Returns the content written to disk, or None if the file was skipped.
     """
     # Prevent creation of unwanted files
     unwanted_files = ["readme", "test", ".env", ".gitignore"]
     base_name = os.path.basename(relative_path).lower()
     if any(unwanted in base_name for unwanted in unwanted_files):
         logger.info(f"Skipping creation of unwanted file: {relative_path}")
-        return
+        return None
 
     # Construct the full file path
     full_path = os.path.join(root_dir, relative_path)
@@ -441,6 +840,7 @@ def create_directories_and_save_file(root_dir, relative_path, content, language)
     with open(full_path, 'w', encoding='utf-8') as f:
         f.write(cleaned_content)
     logger.info(f"Saved file: {full_path}.")
+    return cleaned_content
 
 
 def clean_code_content(content, language):
@@ -473,172 +873,878 @@ def clean_flow_text(flow_text):
     return flow_text.strip()
 
 ##########################################################################
-# Main generator function (SSE)
+# Per-file pipeline
 ##########################################################################
 
-def generate_project_stream(project_description, language):
+def record_agent_call(state, agent, emit, rel_file=None):
     """
-    Generates project code by:
-      1) ArchitectureBot generates architecture overview.
-      2) FlowStructureBot generates folder structure.
-      3) For each file:
-         - DevBot generates code.
-         - VerificationBot reviews code.
-         - If issues, FinalizerBot finalizes code.
-         - Writes finalized code to file.
-      4) Provides a download link.
+    Records the agent's latest model call on the run state and emits its
+    prompt size (and a cache hit, if the response came from the cache).
     """
-    state = StateManager()
-    state.set_project_description(project_description)
+    if agent.last_call is None:
+        return
+    state.record_call(agent.last_call)
+    if agent.repair_call is not None:
+        state.record_call(agent.repair_call)
+
+    prompt_report = {"agent": agent.name, "file": rel_file, "prompt_tokens": agent.last_call.prompt_tokens,
+                     "cached_tokens": agent.last_call.cached_tokens}
+    if agent.context_stats:
+        prompt_report.update(agent.context_stats)
+    emit(json.dumps({"prompt_tokens": prompt_report}))
+
+    if agent.last_call.cache_hit:
+        emit(json.dumps({"cache_hit": {"agent": agent.name, "file": rel_file}}))
 
+
+def save_generated_file(state, root_dir, rel_path, code, language):
+    """
+    Writes a generated file and records the inputs that produced it in the project manifest.
+    """
+    with timed("file_write", state.metrics):
+        written = create_directories_and_save_file(root_dir, rel_path, code, language)
+    inputs = state.manifest_inputs(rel_path, written)
+    if inputs is not None:
+        state.manifest.record_file(rel_path, inputs, written, saved=written is not None)
+        state.manifest.save()
+
+
+def delta_emitter(rel_file, agent_name, emit):
+    """
+    Returns an on_delta callback that forwards streamed tokens as `code_delta` SSE chunks,
+    or None when token streaming is disabled (MAS_STREAM_TOKENS=0).
+    An offset of 0 marks the start of a (possibly retried) completion.
+    """
+    if os.getenv("MAS_STREAM_TOKENS", "1").lower() in ("0", "false", "no"):
+        return None
+
+    def on_delta(text, offset):
+        emit(json.dumps({"code_delta": {"filename": rel_file, "agent": agent_name, "offset": offset, "delta": text}}))
+    return on_delta
+
+
+def review_has_issues(review):
+    """
+    Simple heuristic: the review's verification text contains keywords like 'error', 'issue', 'fix', etc.
+    Negated mentions ("no issues found", "nothing to fix") do not count.
+    """
     try:
-        # 1) ArchitectureBot
-        arch_bot = ArchitectureBot('architecture_bot.txt')
-        arch_data = arch_bot.generate_architecture_overview(project_description, language)
-        if "architecture_overview" not in arch_data:
-            yield json.dumps({"error": "ArchitectureBot did not return 'architecture_overview' properly."})
-            return
+        text = str(parse_json_object(review, "verification")["verification"])
+    except ResponseParseError:
+        text = review
+    text = NEGATED_ISSUE_PATTERN.sub("", text.lower())
+    return any(keyword in text for keyword in ISSUE_KEYWORDS)
 
-        state.set_architecture(arch_data)
-        yield json.dumps({"architecture_overview": arch_data["architecture_overview"]})
-        time.sleep(1)
 
-        # Architecture overview
-        architecture_overview = arch_data["architecture_overview"]
+def can_skip_review(rel_file):
+    """
+    Whether a file whose local checks passed may skip the VerificationBot call (MAS_SKIP_CLEAN_REVIEW=0 disables).
+    Only languages with local checks qualify.
+    """
+    return is_python(rel_file) and os.getenv("MAS_SKIP_CLEAN_REVIEW", "1").lower() not in ("0", "false", "no")
 
-        # 2) FlowStructureBot
-        flow_bot = FlowStructureBot('flow_structure_bot.txt')
-        flow_text = flow_bot.generate_flow_structure(architecture_overview, language)
-        if not flow_text:
-            yield json.dumps({"error": "FlowStructureBot returned empty structure."})
-            return
 
-        # Clean the flow_text to remove any triple backticks
-        flow_text = clean_flow_text(flow_text)
+def get_dev_candidates():
+    try:
+        return max(1, int(os.getenv("MAS_DEV_CANDIDATES", DEFAULT_DEV_CANDIDATES)))
+    except ValueError:
+        return DEFAULT_DEV_CANDIDATES
+
 
-        state.set_flow_structure(flow_text)
-        yield json.dumps({"flow_structure": flow_text})
-        time.sleep(1)
+def get_finalize_mode():
+    mode = os.getenv("MAS_FINALIZE_MODE", DEFAULT_FINALIZE_MODE).strip().lower()
+    if mode not in FINALIZE_MODES:
+        logger.warning(f"Unknown MAS_FINALIZE_MODE {mode!r}; finalizing file by file.")
+        return DEFAULT_FINALIZE_MODE
+    return mode
 
-        # Parse files
-        file_paths = parse_flow_structure(flow_text)
-        if not file_paths:
-            yield json.dumps({"error": "No files found in the flow structure."})
-            return
 
-        # Define the root directory consistent with Flask's download route
-        root_dir = "generated_project"
+def get_finalize_batch_tokens():
+    try:
+        return max(1, int(os.getenv("MAS_FINALIZE_BATCH_TOKENS", DEFAULT_FINALIZE_BATCH_TOKENS)))
+    except ValueError:
+        return DEFAULT_FINALIZE_BATCH_TOKENS
+
+
+def group_finalize_batches(code_by_path, mode, budget, file_order=()):
+    """
+    Splits flagged files into FinalizerBot batches. "file" gives every file its own batch;
+    "directory" keeps each batch inside one directory; "budget" packs files regardless of directory.
+    A batch holds at most `budget` tokens of code, except a single larger file, which gets a batch
+    of its own. Files are ordered as in `file_order`, so the same files always form the same batches.
+    """
+    order = {path: index for index, path in enumerate(file_order)}
+    paths = sorted(code_by_path, key=lambda p: (order.get(p, len(order)), p))
+    if mode == "file":
+        return [[path] for path in paths]
+    if mode == "directory":
+        paths.sort(key=lambda p: posixpath.dirname(p))  # Stable: keeps the file order within a directory
+
+    batches = []
+    current, current_dir, current_tokens = [], None, 0
+    for path in paths:
+        tokens = count_tokens(code_by_path[path])
+        directory = posixpath.dirname(path)
+        if current and (current_tokens + tokens > budget or (mode == "directory" and directory != current_dir)):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(path)
+        current_dir = directory
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def apply_final_codes(state, root_dir, language, final_codes, emit, allowed_paths=None):
+    """
+    Saves the files returned by FinalizerBot and returns the paths that were applied.
+    Entries outside `allowed_paths` (when given) are ignored.
+    """
+    applied = []
+    for code_entry in final_codes:
+        final_rel_path = code_entry.get("rel_path") if isinstance(code_entry, dict) else None
+        updated_code = code_entry.get("updated_code") if isinstance(code_entry, dict) else None
+        if not final_rel_path or not updated_code:
+            logger.warning(f"Invalid code entry from FinalizerBot: {code_entry}")
+            continue
+        if allowed_paths is not None and final_rel_path not in allowed_paths:
+            logger.warning(f"FinalizerBot returned {final_rel_path}, which is not part of the batch; ignoring it.")
+            continue
+
+        # Update the accumulated code with the finalized code
+        state.update_code(final_rel_path, updated_code)
+
+        # Write the finalized code to the respective file
+        save_generated_file(state, root_dir, final_rel_path, updated_code, language)
+        emit(json.dumps({"finalized_code": {"filename": final_rel_path, "code": updated_code}}))
+        logger.info(f"Finalized and saved {final_rel_path} to disk.")
+        applied.append(final_rel_path)
+    return applied
+
+
+async def generate_candidates(rel_file, state, architecture_overview, flow_text, language, count, reference=None,
+                              max_tokens=None):
+    """
+    Generates `count` DevBot candidates for a file concurrently. Each one is checked locally
+    (syntax, project imports) and, if clean, reviewed by VerificationBot. The first candidate
+    that passes both is selected and the remaining requests are cancelled. If none passes, the
+    reviewed candidate (or else the one with the fewest local issues) is selected.
+
+    Returns (candidate, agents, evaluated) where candidate is a dict with "index", "code",
+    "issues" and "review" (None if it was not reviewed), and agents are the agents whose
+    calls completed.
+    """
+    snapshot = state.code_snapshot()
+    route_max_tokens = get_route("DevBot").max_tokens
+    agents = []
+
+    async def write_code(index, limit):
+        # Identical requests would return the same cached completion for every candidate
+        dev_bot = DevBot("DevBot", "dev.txt", use_cache=state.use_cache and index == 0)
+        dev_bot.max_tokens = limit or dev_bot.max_tokens
+        code = await dev_bot.agenerate_file_code(
+            architecture_overview=architecture_overview,
+            flow_structure=flow_text,
+            file_path=rel_file,
+            accumulated_code_dict=snapshot,
+            project_description=state.project_description,
+            language=language,
+            reference=reference,
+            flow_in_message=state.pipelined,
+        )
+        agents.append(dev_bot)
+        return code, dev_bot.last_call.finish_reason
+
+    async def evaluate(index):
+        candidate = {"index": index, "code": "", "issues": [], "review": None}
+        try:
+            candidate["code"], finish_reason = await write_code(index, max_tokens)
+            if (finish_reason == "length" and max_tokens != route_max_tokens
+                    and (state.budget is None or not state.budget.exceeded())):
+                # The estimate was too small for this file: one more try with the role's own limit
+                logger.warning(f"DevBot candidate {index} for {rel_file} was cut off at {max_tokens} tokens; "
+                               f"retrying.")
+                candidate["code"], _ = await write_code(index, route_max_tokens)
+            if not candidate["code"]:
+                candidate["issues"] = ["DevBot returned no code."]
+                return candidate
+            # The linter runs in a subprocess; wait for it off the shared event loop
+            candidate["issues"] = await asyncio.to_thread(run_local_checks, rel_file, candidate["code"],
+                                                          known_project_paths(state))
+            if candidate["issues"]:
+                return candidate
+            if can_skip_review(rel_file):
+                candidate["review"] = LOCAL_PASS_REVIEW
+                return candidate
+
+            ver_bot = VerificationBot('verification_bot.txt', use_cache=state.use_cache)
+            candidate["review"] = await ver_bot.areview_code(
+                accumulated_code_dict={**snapshot, rel_file: candidate["code"]},
+                project_description=state.project_description,
+                module_code=candidate["code"],
+                module_name=rel_file
+            )
+            agents.append(ver_bot)
+        except Exception as e:
+            logger.error(f"Candidate {index} for {rel_file} failed: {e}")
+            candidate["issues"].append(str(e))
+        return candidate
+
+    tasks = [asyncio.ensure_future(evaluate(index)) for index in range(count)]
+    finished = []
+    try:
+        for next_finished in asyncio.as_completed(tasks):
+            candidate = await next_finished
+            finished.append(candidate)
+            if candidate["review"] and not review_has_issues(candidate["review"]):
+                return candidate, list(agents), len(finished)
+    finally:
+        # Cancels the in-flight model calls of the candidates that lost
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    usable = [c for c in finished if c["code"]] or finished
+    best = min(usable, key=lambda c: (not c["review"], len(c["issues"]), c["index"]))
+    return best, list(agents), len(finished)
+
+
+def known_project_paths(state):
+    """
+    The files that project imports are resolved against in the local checks, or None (no import
+    check) while the flow structure is still streaming: a file may import a module listed later.
+    """
+    if not state.flow_structure:
+        return None
+    return state.file_paths or list(state.code_snapshot())
+
+
+def check_budget(state, emit):
+    """
+    Returns True once a ceiling of the run's budget (see budget.py) has been reached. The first
+    caller to notice emits the `budget_exceeded` event; callers then stop starting model calls.
+    """
+    if state.budget is None:
+        return False
+    exceeded = state.budget.stopped or state.budget.exceeded()
+    if exceeded is None:
+        return False
+    if state.budget.stop(exceeded):
+        logger.warning(f"Budget exhausted ({exceeded}); finishing without further model calls.")
+        emit(json.dumps({"budget_exceeded": exceeded}))
+    return True
+
+
+def file_max_tokens(rel_file, state, ceiling):
+    """
+    DevBot's completion limit for a file: estimated from the file type and the sizes of finished
+    files of the same type (unless MAS_ADAPTIVE_MAX_TOKENS=0), and never more than the budget has left.
+    """
+    max_tokens = ceiling
+    if adaptive_max_tokens_enabled():
+        max_tokens = estimate_max_tokens(rel_file, state.output_sizes_snapshot(), ceiling)
+    remaining = state.budget.remaining_tokens() if state.budget is not None else None
+    if remaining is not None:
+        max_tokens = max(1, min(max_tokens or remaining, remaining))
+    return max_tokens
+
+
+def find_similar_file(rel_file, state, architecture_overview, language, emit):
+    """
+    Looks the file up in the index of files generated by earlier runs (see similarity_index.py).
+    Returns (code, reference): the code of a prior boilerplate file (see FILE_ROLES) similar enough
+    to reuse that passes the local checks, or else a shortened prior file for DevBot to follow.
+    Either may be None. Reused code is still reviewed by VerificationBot against this project.
+    Runs without the response cache (use_cache=False) do not use the index either.
+    """
+    index = get_similarity_index()
+    if index is None or not state.use_cache:
+        return None, None
+    try:
+        match = index.find(rel_file, architecture_overview, language, owner=run_owner(state),
+                           shared=shared_index_enabled())
+    except Exception as e:
+        logger.warning(f"Similar file lookup failed for {rel_file}: {e}")
+        return None, None
+    if match is None or match.score < get_reference_threshold():
+        return None, None
+
+    project_name = pathlib.PurePath(rel_file).parts[0]
+    # Code naming the earlier project's package would not import in this one
+    reusable = (match.score >= get_reuse_threshold() and is_boilerplate(rel_file)
+                and match.path == path_key(rel_file)
+                and (match.project_name == project_name or match.project_name not in match.code)
+                and not run_local_checks(rel_file, match.code, known_project_paths(state)))
+    emit(json.dumps({"similar_file": {"file": rel_file, "score": round(match.score, 3), "reused": reusable}}))
+    if reusable:
+        logger.info(f"Reusing a similar file from {match.project_name} for {rel_file} (score {match.score:.2f}).")
+        return match.code, None
+    return None, match.reference(get_reference_tokens())
+
+
+def run_owner(state):
+    """
+    The user whose files the run may reuse from the similar file index (the user charged for it).
+    """
+    return state.budget.user if state.budget is not None else None
 
-        # Initialize lists to store generated codes and reviews
-        generated_codes = []
-        verified_reviews = []
 
-        # Initialize a single DevBot instance
-        dev_bot = DevBot("DevBot", "dev.txt")  # Ensure 'dev.txt' exists in 'complex_projects' directory
+def index_generated_file(rel_file, state, architecture_overview, language, code):
+    """
+    Adds a file that passed its review to the similar file index, owned by the run's user.
+    """
+    index = get_similarity_index()
+    if index is None:
+        return
+    try:
+        index.add(rel_file, architecture_overview, language, code, owner=run_owner(state))
+    except Exception as e:
+        logger.warning(f"Could not index {rel_file}: {e}")
 
-        # For each file in the flow structure
-        for rel_file in file_paths:
-            yield json.dumps({"current_file": rel_file})
-            time.sleep(1)
 
-            # A) DevBot => produce code
-            file_code = dev_bot.generate_file_code(
+def generate_file(rel_file, state, architecture_overview, flow_text, language, root_dir, emit):
+    """
+    Runs DevBot -> VerificationBot -> (FinalizerBot) for a single file.
+    Every SSE chunk is handed to `emit` as soon as it is available. Each call uses
+    its own agent instances, so several files can be generated concurrently.
+    With MAS_DEV_CANDIDATES > 1, DevBot candidates are generated and verified in parallel
+    and the first one that passes is kept (see generate_candidates).
+    """
+    emit(json.dumps({"current_file": rel_file}))
+
+    # A) DevBot => produce code, unless a near-identical file was generated before
+    review = None
+    local_issues = None
+    completion_tokens = 0
+    file_code, reference = find_similar_file(rel_file, state, architecture_overview, language, emit)
+    reused = bool(file_code)
+    candidate_count = get_dev_candidates()
+    route_max_tokens = get_route("DevBot").max_tokens
+    max_tokens = file_max_tokens(rel_file, state, route_max_tokens)
+    if file_code:
+        # Already passed the local checks
+        local_issues = []
+    elif candidate_count > 1:
+        candidate, agents, evaluated = llm_client.run_sync(
+            generate_candidates(rel_file, state, architecture_overview, flow_text, language, candidate_count,
+                                reference, max_tokens)
+        )
+        for agent in agents:
+            record_agent_call(state, agent, emit, rel_file)
+        file_code, review = candidate["code"], candidate["review"]
+        local_issues = candidate["issues"] if file_code else None
+        passed = bool(review) and not review_has_issues(review)
+        emit(json.dumps({"candidates": {"file": rel_file, "requested": candidate_count, "evaluated": evaluated,
+                                        "selected": candidate["index"], "passed": passed,
+                                        "local_issues": candidate["issues"]}}))
+    else:
+        dev_bot = DevBot("DevBot", "dev.txt", use_cache=state.use_cache)  # Ensure 'dev.txt' exists in 'complex_projects' directory
+        dev_bot.max_tokens = max_tokens
+
+        def write_code():
+            code = dev_bot.generate_file_code(
                 architecture_overview=architecture_overview,
                 flow_structure=flow_text,
                 file_path=rel_file,
-                accumulated_code_dict=state.accumulated_code,
+                accumulated_code_dict=state.code_snapshot(),
                 project_description=state.project_description,
-                language=language
+                language=language,
+                on_delta=delta_emitter(rel_file, dev_bot.name, emit),
+                reference=reference,
+                flow_in_message=state.pipelined
             )
-            if not file_code:
-                yield json.dumps({"error": f"DevBot failed to create code for {rel_file}."})
-                logger.error(f"DevBot failed to create code for {rel_file}.")
-                continue
-
-            # B) Accumulate code + yield
-            state.update_code(rel_file, file_code)
-            generated_codes.append({"rel_path": rel_file, "code": file_code})
-            yield json.dumps({"code_file": {"filename": rel_file, "code": file_code}})
-            time.sleep(1)
+            record_agent_call(state, dev_bot, emit, rel_file)
+            return code
+
+        file_code = write_code()
+        if (dev_bot.last_call.finish_reason == "length" and max_tokens != route_max_tokens
+                and not check_budget(state, emit)):
+            # The estimate was too small for this file: one more try with the role's own limit
+            logger.warning(f"DevBot output for {rel_file} was cut off at {max_tokens} tokens; retrying.")
+            emit(json.dumps({"status": f"Output for {rel_file} hit the estimated {max_tokens} tokens; retrying."}))
+            dev_bot.max_tokens = route_max_tokens
+            file_code = write_code()
+        completion_tokens = dev_bot.last_call.completion_tokens
+    if not file_code:
+        emit(json.dumps({"error": f"DevBot failed to create code for {rel_file}."}))
+        logger.error(f"DevBot failed to create code for {rel_file}.")
+        return
 
-            # C) Verification
-            ver_bot = VerificationBot('verification_bot.txt')
+    # B) Accumulate code + yield
+    state.update_code(rel_file, file_code)
+    state.record_output_size(rel_file, output_size(file_code, completion_tokens))
+    emit(json.dumps({"code_file": {"filename": rel_file, "code": file_code}}))
+
+    # C) Local checks, then verification (already done for a reviewed candidate)
+    if review is None:
+        if local_issues is None:
+            local_issues = run_local_checks(rel_file, file_code, known_project_paths(state))
+        emit(json.dumps({"local_checks": {"file": rel_file, "issues": local_issues}}))
+
+        # A file from an earlier project is always reviewed against this project's description
+        if not local_issues and not reused and can_skip_review(rel_file):
+            # Clean files are not worth a model call
+            review = LOCAL_PASS_REVIEW
+            logger.info(f"Local checks passed for {rel_file}; skipping VerificationBot.")
+        else:
+            ver_bot = VerificationBot('verification_bot.txt', use_cache=state.use_cache)
             review = ver_bot.review_code(
-                accumulated_code_dict=state.accumulated_code,
+                accumulated_code_dict=state.code_snapshot(),
                 project_description=state.project_description,
                 module_code=file_code,
-                module_name=rel_file
+                module_name=rel_file,
+                local_issues=local_issues
             )
-            if review:
-                verified_reviews.append(review)
-                state.add_review(review)
-                logger.info(f"Review for {rel_file}: {review}")
-                # Yielding the review
-                yield json.dumps({"verification": {rel_file: review}})
-            else:
-                logger.error(f"VerificationBot failed to review code for {rel_file}.")
-                yield json.dumps({"error": f"VerificationBot failed to review code for {rel_file}."})
-            time.sleep(1)
-
-            # D) Check if the review indicates any issues
-            # Simple heuristic: if review contains keywords like 'error', 'issue', 'fix', etc.
-            issue_keywords = ['error', 'issue', 'fix', 'improve', 'incorrect', 'problem', 'bug', 'refactor']
-            if any(keyword in review.lower() for keyword in issue_keywords):
-                yield json.dumps({"status": f"Issues detected in {rel_file}. Initiating finalization."})
-                logger.info(f"Issues detected in {rel_file}. Initiating finalization.")
-
-                # Prepare accumulated_code_dict for FinalizerBot with only the current file
-                finalizer_accumulated_code = {rel_file: state.accumulated_code[rel_file]}
-
-                # Initialize FinalizerBot
-                finalizer_bot = FinalizerBot("FinalizerBot", "finalizer_bot_1.txt")
-
-                # Call FinalizerBot for the current file
-                finalizer_response = finalizer_bot.finalize_code(
-                    project_description=architecture_overview,
-                    accumulated_code_dict=finalizer_accumulated_code,
-                    reviews=[review],
-                    language=language,
-                    flow_structure=flow_text
-                )
-
-                # Check if FinalizerBot returned any codes
-                if not finalizer_response.get("final_codes"):
-                    yield json.dumps({"error": f"FinalizerBot failed to finalize code for {rel_file}."})
-                    logger.error(f"FinalizerBot failed to finalize code for {rel_file}.")
-                    continue
-
-                # Process FinalizerBot's response
-                for code_entry in finalizer_response["final_codes"]:
-                    final_rel_path = code_entry.get("rel_path")
-                    updated_code = code_entry.get("updated_code")
-                    if not final_rel_path or not updated_code:
-                        logger.warning(f"Invalid code entry from FinalizerBot: {code_entry}")
-                        continue
-
-                    # Update the accumulated code with the finalized code
-                    state.update_code(final_rel_path, updated_code)
-
-                    # Write the finalized code to the respective file
-                    create_directories_and_save_file(root_dir, final_rel_path, updated_code, language)
-                    yield json.dumps({"finalized_code": {"filename": final_rel_path, "code": updated_code}})
-                    logger.info(f"Finalized and saved {final_rel_path} to disk.")
-                    time.sleep(1)
-            else:
-                # If no issues, write the original code to the file
-                create_directories_and_save_file(root_dir, rel_file, file_code, language)
-                yield json.dumps({"status": f"No issues detected in {rel_file}. Code saved successfully."})
-                logger.info(f"No issues detected in {rel_file}. Code saved successfully.")
-                time.sleep(1)
+            record_agent_call(state, ver_bot, emit, rel_file)
+    if review:
+        state.add_review(review)
+        # The model's reply was already logged by _handle_response
+        log_payload(logger, logging.DEBUG, f"Review for {rel_file}:", review, file=rel_file, agent="VerificationBot")
+        # Yielding the review
+        emit(json.dumps({"verification": {rel_file: review}}))
+    else:
+        logger.error(f"VerificationBot failed to review code for {rel_file}.")
+        emit(json.dumps({"error": f"VerificationBot failed to review code for {rel_file}."}))
+
+    # D) Check if the review indicates any issues
+    has_issues = review_has_issues(review)
+    if has_issues and get_finalize_mode() != "file":
+        # Finalized together with other flagged files once every file has been generated
+        state.add_flagged(rel_file, review)
+        emit(json.dumps({"status": f"Issues detected in {rel_file}. Queued for batch finalization."}))
+        logger.info(f"Issues detected in {rel_file}. Queued for batch finalization.")
+    elif has_issues and check_budget(state, emit):
+        # No budget left for FinalizerBot
+        save_generated_file(state, root_dir, rel_file, file_code, language)
+        emit(json.dumps({"status": f"Issues detected in {rel_file}, but the budget is used up. Saved as drafted."}))
+        logger.info(f"Issues detected in {rel_file}; budget exhausted, saved as drafted.")
+    elif has_issues:
+        emit(json.dumps({"status": f"Issues detected in {rel_file}. Initiating finalization."}))
+        logger.info(f"Issues detected in {rel_file}. Initiating finalization.")
+
+        # Prepare accumulated_code_dict for FinalizerBot with only the current file
+        finalizer_accumulated_code = {rel_file: file_code}
+
+        # Initialize FinalizerBot
+        finalizer_bot = FinalizerBot("FinalizerBot", "finalizer_bot_1.txt", use_cache=state.use_cache)
+
+        # Call FinalizerBot for the current file
+        finalizer_response = finalizer_bot.finalize_code(
+            project_description=architecture_overview,
+            accumulated_code_dict=finalizer_accumulated_code,
+            reviews=[review],
+            language=language,
+            flow_structure=state.flow_structure or flow_text,
+            on_delta=delta_emitter(rel_file, finalizer_bot.name, emit)
+        )
+        record_agent_call(state, finalizer_bot, emit, rel_file)
+
+        # Check if FinalizerBot returned any codes
+        if not finalizer_response.get("final_codes"):
+            emit(json.dumps({"error": f"FinalizerBot failed to finalize code for {rel_file}."}))
+            logger.error(f"FinalizerBot failed to finalize code for {rel_file}.")
+            return
+
+        # Process FinalizerBot's response
+        apply_final_codes(state, root_dir, language, finalizer_response["final_codes"], emit)
+    else:
+        # If no issues, write the original code to the file
+        save_generated_file(state, root_dir, rel_file, file_code, language)
+        index_generated_file(rel_file, state, architecture_overview, language, file_code)
+        emit(json.dumps({"status": f"No issues detected in {rel_file}. Code saved successfully."}))
+        logger.info(f"No issues detected in {rel_file}. Code saved successfully.")
+
+
+def finalize_batch(batch, state, architecture_overview, flow_text, language, root_dir, emit):
+    """
+    Runs one FinalizerBot call for a batch of flagged files and applies the returned codes.
+    Files the model did not return are saved as drafted.
+    """
+    label = batch[0] if len(batch) == 1 else f"{len(batch)} files in {posixpath.dirname(batch[0]) or '.'}"
+    emit(json.dumps({"status": f"Finalizing {', '.join(batch)} in one FinalizerBot call."}))
+    logger.info(f"Finalizing batch of {len(batch)} files: {batch}")
+    code_snapshot = state.code_snapshot()
+    applied = []
+    try:
+        if check_budget(state, emit):
+            # No budget left: the files are saved as drafted below
+            return applied
+        finalizer_bot = FinalizerBot("FinalizerBot", "finalizer_bot_1.txt", use_cache=state.use_cache)
+        finalizer_response = finalizer_bot.finalize_code(
+            project_description=architecture_overview,
+            accumulated_code_dict={path: code_snapshot[path] for path in batch},
+            reviews=[f"{path}: {state.flagged_files.get(path, '')}" for path in batch],
+            language=language,
+            flow_structure=flow_text,
+            on_delta=delta_emitter(label, finalizer_bot.name, emit),
+            rel_paths=batch
+        )
+        record_agent_call(state, finalizer_bot, emit, label)
+        applied = apply_final_codes(state, root_dir, language, finalizer_response.get("final_codes", []), emit,
+                                    allowed_paths=set(batch))
+    finally:
+        # The batch's streamed preview is keyed by its label, which no finalized_code event carries
+        emit(json.dumps({"code_stream_end": {"filename": label, "agent": "FinalizerBot"}}))
+        missing = [path for path in batch if path not in applied]
+        for path in missing:
+            save_generated_file(state, root_dir, path, code_snapshot[path], language)
+        if missing:
+            emit(json.dumps({"error": f"FinalizerBot did not finalize {', '.join(missing)}; saved the reviewed drafts."}))
+            logger.error(f"FinalizerBot did not finalize {missing}; saved the reviewed drafts.")
+        state.remove_flagged(batch)
+
+
+def finalize_flagged(state, architecture_overview, flow_text, language, root_dir, max_workers=None):
+    """
+    Finalizes every flagged file in batches (see group_finalize_batches), several batches at once.
+    Yields SSE chunks, and ("finalized", batch) after each batch so the caller can checkpoint.
+    """
+    code_snapshot = state.code_snapshot()
+    flagged = {path: code_snapshot[path] for path in list(state.flagged_files) if path in code_snapshot}
+    state.remove_flagged([path for path in list(state.flagged_files) if path not in flagged])
+    if not flagged:
+        return
+    batches = group_finalize_batches(flagged, get_finalize_mode(), get_finalize_batch_tokens(), state.file_paths)
+    yield json.dumps({"status": f"Finalizing {len(flagged)} flagged files in {len(batches)} FinalizerBot calls."})
+
+    batch_by_key = {f"batch-{index}": batch for index, batch in enumerate(batches)}
+    scheduler = DependencyScheduler({key: set() for key in batch_by_key}, max_workers=max_workers)
+
+    def worker(key, emit):
+        try:
+            finalize_batch(batch_by_key[key], state, architecture_overview, flow_text, language, root_dir, emit)
+        except Exception as e:
+            logger.error(f"Unexpected error while finalizing {batch_by_key[key]}: {e}")
+            emit(json.dumps({"error": f"Unexpected error while finalizing {', '.join(batch_by_key[key])}: {e}"}))
+        emit(("finalized", batch_by_key[key]))
+
+    yield from scheduler.run(worker)
+
+
+##########################################################################
+# Main generator function (SSE)
+##########################################################################
+
+def pipeline_flow_enabled():
+    """
+    Whether files are generated while FlowStructureBot is still streaming the folder structure
+    (MAS_PIPELINE_FLOW, default 1).
+    """
+    return os.getenv("MAS_PIPELINE_FLOW", "1").lower() not in ("0", "false", "no")
+
+
+def generate_architecture(state, project_description, language, emit, use_cache=True):
+    """
+    Runs ArchitectureBot, handing SSE chunks to `emit`. Returns the architecture overview, or None on failure.
+    """
+    arch_bot = ArchitectureBot('architecture_bot.txt', use_cache=use_cache)
+    arch_data = arch_bot.generate_architecture_overview(project_description, language)
+    record_agent_call(state, arch_bot, emit)
+    if "architecture_overview" not in arch_data:
+        emit(json.dumps({"error": "ArchitectureBot did not return 'architecture_overview' properly."}))
+        return None
+
+    state.set_architecture(arch_data)
+    emit(json.dumps({"architecture_overview": arch_data["architecture_overview"]}))
+    return arch_data["architecture_overview"]
+
+
+def stream_flow_structure(state, architecture_overview, language, emit, on_path, use_cache=True):
+    """
+    Runs FlowStructureBot with streaming and calls on_path(path, structure_so_far) for every file as soon
+    as its line of the tree has arrived. Returns the cleaned flow text, or None on failure.
+    """
+    flow_bot = FlowStructureBot('flow_structure_bot.txt', use_cache=use_cache)
+    parser = FlowStructureParser()
+    # Parsing is spread over the stream; only the parser's own time counts as parse_flow_structure
+    parse_seconds = 0.0
+
+    def parse(method, *args):
+        nonlocal parse_seconds
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            parse_seconds += time.perf_counter() - started
+
+    def handle(paths):
+        for path in paths:
+            on_path(path, clean_flow_text(parser.structure_at[path]))
+
+    def on_delta(text, offset):
+        if offset == 0:
+            # A retried completion starts over
+            parse(parser.restart)
+        handle(parse(parser.feed, text))
+
+    flow_text = flow_bot.generate_flow_structure(architecture_overview, language, on_delta=on_delta)
+    record_agent_call(state, flow_bot, emit)
+    if not flow_text:
+        emit(json.dumps({"error": "FlowStructureBot returned empty structure."}))
+        return None
+    if not parser.text:
+        # Responses from the cache are not streamed
+        handle(parse(parser.feed, flow_text))
+    handle(parse(parser.close))
+    observe_stage("parse_flow_structure", parse_seconds, state.metrics)
+
+    # Clean the flow_text to remove any triple backticks
+    flow_text = clean_flow_text(flow_text)
+    state.set_flow_structure(flow_text)
+    emit(json.dumps({"flow_structure": flow_text}))
+    return flow_text
+
+
+def load_file_inputs(state, language, architecture_overview, flow_text, root_dir, paths_seen=None):
+    """
+    Loads the manifest of the project's previous run and computes the inputs of every file of the
+    flow structure. Returns (manifest, {file_path: inputs}).
+    `paths_seen` ({file_path: the files known when it was started}) covers files started before the
+    structure was complete; their inputs are what they saw, so the next run regenerates them if
+    files were added next to them later.
+    """
+    file_paths = state.file_paths
+    paths_seen = paths_seen or {}
+    project_name = pathlib.PurePath(file_paths[0]).parts[0]
+    manifest = ProjectManifest.load(manifest_path(root_dir, project_name), language)
+    manifest.set_project(language, architecture_overview, flow_text)
+    prompt_templates = [load_prompt_template(f).template for f in GENERATION_PROMPT_FILES]
+    file_inputs = {}
+    # Lower levels first: a file's inputs include those of the files it depends on (see file_level)
+    for rel_file in sorted(file_paths, key=file_level):
+        known_paths = paths_seen.get(rel_file, file_paths)
+        dependencies = {p: file_inputs[p] for p in known_paths if file_level(p) < file_level(rel_file)}
+        file_inputs[rel_file] = manifest.file_inputs(rel_file, known_paths, language, architecture_overview,
+                                                     prompt_templates, dependencies)
+    return manifest, {rel_file: file_inputs[rel_file] for rel_file in file_paths}
+
+
+def plan_incremental_build(state, language, architecture_overview, flow_text, root_dir, incremental, emit):
+    """
+    Compares the flow structure against the manifest of the previous run, reuses the files whose
+    inputs are unchanged (emitting them as `reused` code files) and returns the files to generate.
+    """
+    file_paths = state.file_paths
+    manifest, file_inputs = load_file_inputs(state, language, architecture_overview, flow_text, root_dir)
+    state.set_manifest(manifest, file_inputs)
+
+    if incremental:
+        stale_files = [p for p in file_paths if not manifest.is_up_to_date(p, file_inputs[p], root_dir)]
+        # Entry points wire everything together, so they follow any other change
+        if any(file_level(p) < 2 for p in stale_files):
+            stale_files = [p for p in file_paths if p in stale_files or file_level(p) == 2]
+    else:
+        stale_files = list(file_paths)
+    manifest.remove_missing(file_paths)
+
+    for rel_file in file_paths:
+        # Files finished before an interruption are already part of the checkpointed state
+        if rel_file in stale_files or rel_file in state.completed_files:
+            continue
+        existing_path = os.path.join(root_dir, rel_file)
+        if os.path.exists(existing_path):
+            with open(existing_path, 'r', encoding='utf-8') as f:
+                existing_code = f.read()
+            state.update_code(rel_file, existing_code)
+            emit(json.dumps({"code_file": {"filename": rel_file, "code": existing_code, "reused": True}}))
+        state.mark_completed(rel_file)
+    if len(stale_files) < len(file_paths):
+        emit(json.dumps({"status": f"Reusing {len(file_paths) - len(stale_files)} unchanged files, "
+                                   f"regenerating {len(stale_files)}."}))
+    manifest.save()
+    return [p for p in stale_files if p not in state.completed_files]
+
+
+def generate_project_stream(project_description, language, max_workers=None, use_cache=True, incremental=True,
+                            resume_state=None, on_checkpoint=None, run_id=None, user=None):
+    """
+    Generates project code by:
+      1) ArchitectureBot generates architecture overview.
+      2) FlowStructureBot generates folder structure.
+      3) For each file (independent files concurrently, dependencies first):
+         - DevBot generates code.
+         - VerificationBot reviews code.
+         - If issues, FinalizerBot finalizes code.
+         - Writes finalized code to file.
+      4) Provides a download link.
+
+    Steps 2 and 3 overlap: the folder structure is parsed while it streams in, and each file is
+    scheduled as soon as its line has arrived. DevBot then gets the structure in each file's message
+    (the part received when the file started) rather than in its shared system prompt. Entry points wait for the complete structure, and so does every file of a project that has a
+    manifest from an earlier run (incremental builds need the whole structure to find unchanged files).
+    MAS_PIPELINE_FLOW=0 turns the overlap off.
+
+    `max_workers` bounds how many files are generated at once (default: MAS_MAX_WORKERS or 4).
+    `use_cache` set to False bypasses the response cache for this run.
+    `incremental` reuses files whose inputs are unchanged since the last run (see manifest.py);
+    set it to False to regenerate every file.
+    `resume_state` (a StateManager checkpoint) continues an interrupted run: finished stages
+    and files are skipped. `on_checkpoint(state)` is called after each stage and each file.
+    `run_id` isolates the run in its own workspace (see workspace_dir), so concurrent runs of
+    projects with the same name do not overwrite each other; reusing a run ID continues in that workspace.
+    `user` is charged for the run's tokens; with per-run or per-user ceilings (see budget.py), a run that
+    reaches one emits `budget_exceeded`, skips the files not started yet and still finishes the project.
+    """
+    # Every record logged by this run (and the file workers it starts) carries the run ID
+    RUN_ID.set(run_id)
+    state = resume_state or StateManager()
+    state.set_project_description(project_description)
+    state.use_cache = use_cache
+    state.budget = create_run_budget(user)
+    # A resumed run keeps what it already spent
+    state.budget.restore(state.budget_totals)
+
+    def checkpoint():
+        if on_checkpoint is not None:
+            on_checkpoint(state)
+
+    try:
+        ensure_runtime()
+        exceeded = state.budget.exceeded() if resume_state is None else None
+        if exceeded is not None:
+            # Only the user's ceilings can be reached before the run starts. A resumed run that is
+            # over its ceilings skips its remaining files instead, so the project is still packaged.
+            yield json.dumps({"budget_exceeded": exceeded})
+            return
+        # Define the root directory consistent with Flask's download route
+        root_dir = workspace_dir(run_id)
+        scheduler = DependencyScheduler({}, max_workers=max_workers, open_ended=True)
+        # {file_path: partial flow text} and {file_path: files known by then} of files started
+        # before the folder structure was complete
+        early_structure = {}
+        early_paths = {}
+
+        def schedule(rel_files):
+            # Files depend on every file of the lower levels that is known by now (see file_level)
+            levels = {p: file_level(p) for p in state.file_paths}
+            for rel_file in sorted(rel_files, key=levels.get):
+                scheduler.add(rel_file, {p for p in state.file_paths if levels[p] < levels[rel_file]})
+
+        def plan_project():
+            """
+            Runs the architecture and folder structure stages next to the file workers, handing
+            files to the scheduler as they become known.
+            """
+            pipelined = None
+            deferred = []
+
+            def on_path(rel_file, structure_so_far):
+                nonlocal pipelined
+                state.file_paths.append(rel_file)
+                if pipelined is None:
+                    project_name = pathlib.PurePath(rel_file).parts[0]
+                    pipelined = pipeline_flow_enabled() and not (
+                        incremental and os.path.exists(manifest_path(root_dir, project_name)))
+                    state.pipelined = pipelined
+                if not pipelined or rel_file in state.completed_files:
+                    return
+                if file_level(rel_file) == 2:
+                    deferred.append(rel_file)
+                    return
+                early_structure[rel_file] = structure_so_far
+                early_paths[rel_file] = list(state.file_paths)
+                schedule([rel_file])
+
+            try:
+                architecture_overview = state.architecture.get("architecture_overview")
+                if not architecture_overview:
+                    architecture_overview = generate_architecture(state, project_description, language,
+                                                                  scheduler.emit, use_cache)
+                    if architecture_overview is None:
+                        return
+                flow_text = stream_flow_structure(state, architecture_overview, language, scheduler.emit,
+                                                  on_path, use_cache)
+                if flow_text is None:
+                    return
+                if not state.file_paths:
+                    scheduler.emit(json.dumps({"error": "No files found in the flow structure."}))
+                    return
+                scheduler.emit(("checkpoint", None))
+
+                if pipelined:
+                    # Record the files that were saved before their manifest inputs were known
+                    manifest, file_inputs = load_file_inputs(state, language, architecture_overview, flow_text,
+                                                             root_dir, early_paths)
+                    for rel_file, written in state.set_manifest(manifest, file_inputs).items():
+                        manifest.record_file(rel_file, file_inputs[rel_file], written, saved=written is not None)
+                    manifest.remove_missing(state.file_paths)
+                    manifest.save()
+                    schedule(deferred)
+                else:
+                    schedule(plan_incremental_build(state, language, architecture_overview, flow_text, root_dir,
+                                                    incremental, scheduler.emit))
+            except Exception as e:
+                logger.error(f"Unexpected error while planning the project: {e}")
+                scheduler.emit(json.dumps({"error": str(e)}))
+            finally:
+                scheduler.close()
+
+        if state.architecture.get("architecture_overview") and state.flow_structure:
+            logger.info(f"Resuming run with {len(state.completed_files)} files already completed.")
+            with timed("parse_flow_structure", state.metrics):
+                state.file_paths = parse_flow_structure(state.flow_structure)
+            if not state.file_paths:
+                yield json.dumps({"error": "No files found in the flow structure."})
+                return
+            schedule(plan_incremental_build(state, language, state.architecture["architecture_overview"],
+                                            state.flow_structure, root_dir, incremental, scheduler.emit))
+            scheduler.close()
+        else:
+            state.file_paths = []
+            # The planner inherits the run ID attached to log records
+            threading.Thread(target=contextvars.copy_context().run, args=(plan_project,),
+                             name="project-planner", daemon=True).start()
+        logger.info(f"Generating files with {scheduler.max_workers} workers.")
+
+        def worker(rel_file, emit):
+            if check_budget(state, emit):
+                state.budget.skip(rel_file)
+                emit(json.dumps({"status": f"Skipped {rel_file}: the budget is used up."}))
+                return
+            flow_text = early_structure.get(rel_file) or state.flow_structure
+            try:
+                generate_file(rel_file, state, state.architecture["architecture_overview"], flow_text, language,
+                              root_dir, emit)
+            except Exception as e:
+                logger.error(f"Unexpected error while generating {rel_file}: {e}")
+                emit(json.dumps({"error": f"Unexpected error while generating {rel_file}: {e}"}))
+            # Checkpoint from the consuming side, once every chunk of this file has been yielded
+            emit(("completed", rel_file))
+
+        for event in scheduler.run(worker):
+            if isinstance(event, tuple):
+                if event[0] == "completed":
+                    state.mark_completed(event[1])
+                checkpoint()
+                continue
+            yield event
+        if not state.file_paths or not state.flow_structure:
+            return
+
+        architecture_overview = state.architecture["architecture_overview"]
+        flow_text = state.flow_structure
+        file_paths = state.file_paths
+        project_name = pathlib.PurePath(file_paths[0]).parts[0]
+
+        # Flagged files left for batch finalization (MAS_FINALIZE_MODE=directory or budget)
+        for event in finalize_flagged(state, architecture_overview, flow_text, language, root_dir, max_workers):
+            if isinstance(event, tuple):
+                checkpoint()
+                continue
+            yield event
 
         # 6) Provide a download link
         # Extract the top-level project folder name
         if file_paths:
-            project_name = pathlib.PurePath(file_paths[0]).parts[0]
             logger.info(f"Extracted project name: {project_name}")
 
             # Project download link
-            download_link = f"curl -o {project_name}.zip http://127.0.0.1:5000/download_project/{project_name}"
+            download_path = f"{run_id}/{project_name}" if run_id else project_name
+            download_link = f"curl -o {project_name}.zip http://127.0.0.1:5000/download_project/{download_path}"
+            yield json.dumps({"cache_stats": state.cache_summary()})
+            yield json.dumps({"budget": state.budget.summary()})
+            yield json.dumps({"run_summary": state.metrics.summary()})
             yield json.dumps({"final_output": download_link})
         else:
             yield json.dumps({"error": "No files were processed."})
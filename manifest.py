@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 3
+MANIFEST_SUFFIX = ".manifest.json"
+# Input hashes that must match for a file to be reused
+INPUT_KEYS = ("architecture_hash", "flow_hash", "prompt_hash", "dependency_hash")
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def normalized_text(text):
+    """
+    The words of `text`, lowercased, so changes in formatting alone keep the same hash.
+    """
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+
+def manifest_path(root_dir, project_name):
+    """
+    The manifest is stored next to (not inside) the project folder so it never ends up in the download.
+    """
+    return os.path.join(root_dir, f"{project_name}{MANIFEST_SUFFIX}")
+
+
+def architecture_section(architecture_overview, rel_path):
+    """
+    The paragraphs and list items of the architecture overview that mention the file, by its name
+    or one of its folders below the project root. The whole overview if none does.
+    """
+    parts = [part.lower() for part in rel_path.replace("\\", "/").split("/")]
+    names = {os.path.splitext(parts[-1])[0], *parts[1:-1]}
+    blocks = re.split(r"\n\s*\n|\n(?=\s*(?:#|[-*+]|\d+\.)\s)", architecture_overview or "")
+    matched = [block for block in blocks if names & set(re.findall(r"\w+", block.lower()))]
+    return "\n".join(matched) if matched else architecture_overview
+
+
+def inputs_hash(inputs):
+    return content_hash(*(inputs[key] for key in INPUT_KEYS))
+
+
+def sibling_listing(rel_path, file_paths):
+    """
+    The entries of the flow structure that share the file's directory.
+    A file is considered affected when its siblings change (it may need to import them).
+    """
+    directory = os.path.dirname(rel_path)
+    return "\n".join(sorted(path for path in file_paths if os.path.dirname(path) == directory))
+
+
+class ProjectManifest:
+    """
+    Records, per generated file, the hashes of the inputs that produced it, so a rerun
+    can regenerate only the files that are new or whose inputs changed.
+
+    A file is up to date when its own inputs are unchanged: the part of the architecture overview
+    that describes it (ignoring formatting), its prompt inputs (path, language, agent prompt
+    templates), its sibling listing in the flow structure and the inputs of the files it depends on,
+    and the file on disk still matches what was written. The project description is not compared:
+    it only reaches the files through the architecture overview generated from it.
+    """
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data or {"version": MANIFEST_VERSION, "files": {}}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, language):
+        """
+        Loads the manifest at `path`; returns an empty one if it is missing, unreadable or for another language.
+        """
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION and data.get("language") == language.lower():
+                    return cls(path, data)
+                logger.info(f"Ignoring manifest {path}: different version or language.")
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not read manifest {path}: {e}")
+        return cls(path)
+
+    @property
+    def files(self):
+        return self.data["files"]
+
+    def set_project(self, language, architecture_overview, flow_structure):
+        with self._lock:
+            self.data.update({
+                "language": language.lower(),
+                "architecture_hash": content_hash(normalized_text(architecture_overview)),
+                "flow_hash": content_hash(flow_structure),
+            })
+
+    def file_inputs(self, rel_path, file_paths, language, architecture_overview, prompt_templates,
+                    dependency_inputs=None):
+        """
+        Hashes of everything that went into generating `rel_path`.
+        `dependency_inputs` ({file_path: inputs}) are the inputs of the files it depends on.
+        """
+        dependency_inputs = dependency_inputs or {}
+        return {
+            "architecture_hash": content_hash(normalized_text(architecture_section(architecture_overview, rel_path))),
+            "flow_hash": content_hash(sibling_listing(rel_path, file_paths)),
+            "prompt_hash": content_hash(rel_path, language.lower(), *prompt_templates),
+            "dependency_hash": content_hash(*(f"{path}:{inputs_hash(dependency_inputs[path])}"
+                                              for path in sorted(dependency_inputs))),
+        }
+
+    def is_up_to_date(self, rel_path, inputs, root_dir):
+        entry = self.files.get(rel_path)
+        if not entry:
+            return False
+        if any(entry.get(key) != inputs[key] for key in INPUT_KEYS):
+            return False
+        if not entry.get("saved"):
+            # Files that are never written (tests, readme...) have nothing on disk to compare
+            return True
+        full_path = os.path.join(root_dir, rel_path)
+        if not os.path.exists(full_path):
+            return False
+        with open(full_path, "r", encoding="utf-8") as f:
+            return content_hash(f.read()) == entry["content_hash"]
+
+    def record_file(self, rel_path, inputs, content, saved):
+        with self._lock:
+            self.files[rel_path] = dict(
+                inputs,
+                content_hash=content_hash(content) if saved else None,
+                saved=saved,
+                generated_at=time.time(),
+            )
+
+    def remove_missing(self, file_paths):
+        """
+        Drops entries for files that are no longer part of the flow structure.
+        """
+        with self._lock:
+            for rel_path in list(self.files):
+                if rel_path not in file_paths:
+                    del self.files[rel_path]
+
+    def save(self):
+        with self._lock:
+            dir_part = os.path.dirname(self.path)
+            if dir_part:
+                os.makedirs(dir_part, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,215 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a file write to a slow reasoning-model completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # {label values: [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    labels = _format_labels(self.label_names, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {entry[-1]}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(round(entry[-2], 6))}")
+                lines.append(f"{self.name}_count{labels} {entry[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics, rendered in the Prometheus text exposition format.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, label_names, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "mas_llm_request_seconds", "Wall time of model calls, including retries and rate-limit waits.",
+    ("agent", "model", "cache_hit"))
+LLM_TOKENS = REGISTRY.counter(
+    "mas_llm_tokens_total", "Tokens reported by the model's usage (cache hits excluded).", ("agent", "model", "kind"))
+LLM_RETRIES = REGISTRY.counter("mas_llm_retries_total", "Retried model calls.", ("agent", "model"))
+LLM_CACHE_HITS = REGISTRY.counter("mas_llm_cache_hits_total", "Model calls answered from the response cache.",
+                                  ("agent", "model"))
+LLM_FAILURES = REGISTRY.counter("mas_llm_failures_total", "Model calls that returned no response.",
+                                ("agent", "model"))
+LLM_RATE_LIMIT_WAIT = REGISTRY.counter("mas_llm_rate_limit_wait_seconds_total",
+                                       "Time spent waiting for the rate limiter.", ("agent", "model"))
+AGENT_COMMUNICATE_SECONDS = REGISTRY.histogram(
+    "mas_agent_communicate_seconds", "Wall time of Agent.communicate, including response handling.", ("agent",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "mas_stage_seconds", "Wall time of non-LLM pipeline stages (flow parsing, file writes, ZIP builds).", ("stage",))
+
+
+def record_llm_call(call_stats, succeeded=True):
+    """
+    Adds a finished model call (an llm_client.CallStats) to the process-wide metrics.
+    """
+    labels = {"agent": call_stats.agent or "none", "model": call_stats.model or "none"}
+    LLM_REQUEST_SECONDS.observe(call_stats.duration, cache_hit=str(call_stats.cache_hit).lower(), **labels)
+    if call_stats.cache_hit:
+        LLM_CACHE_HITS.inc(**labels)
+    elif succeeded:
+        LLM_TOKENS.inc(call_stats.prompt_tokens, kind="prompt", **labels)
+        LLM_TOKENS.inc(call_stats.completion_tokens, kind="completion", **labels)
+        if call_stats.cached_tokens:
+            LLM_TOKENS.inc(call_stats.cached_tokens, kind="cached_prompt", **labels)
+    if not succeeded:
+        LLM_FAILURES.inc(**labels)
+    if call_stats.retries:
+        LLM_RETRIES.inc(call_stats.retries, **labels)
+    if call_stats.rate_limit_wait:
+        LLM_RATE_LIMIT_WAIT.inc(call_stats.rate_limit_wait, **labels)
+
+
+class RunMetrics:
+    """
+    Per-run aggregation of model calls and stage timings, sent as the run summary SSE event.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.agents = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, call_stats):
+        with self._lock:
+            entry = self.agents.setdefault(call_stats.agent or "none", {
+                "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                "retries": 0, "cache_hits": 0, "rate_limit_wait": 0.0, "models": [],
+            })
+            entry["calls"] += 1
+            entry["seconds"] += call_stats.duration
+            entry["retries"] += call_stats.retries
+            entry["rate_limit_wait"] += call_stats.rate_limit_wait
+            if call_stats.cache_hit:
+                entry["cache_hits"] += 1
+            else:
+                entry["prompt_tokens"] += call_stats.prompt_tokens
+                entry["cached_tokens"] += call_stats.cached_tokens
+                entry["completion_tokens"] += call_stats.completion_tokens
+            if call_stats.model and call_stats.model not in entry["models"]:
+                entry["models"].append(call_stats.model)
+
+    def record_stage(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def summary(self):
+        with self._lock:
+            agents = {name: dict(entry, seconds=round(entry["seconds"], 3),
+                                 rate_limit_wait=round(entry["rate_limit_wait"], 3))
+                      for name, entry in self.agents.items()}
+            stages = {name: {"count": entry["count"], "seconds": round(entry["seconds"], 4),
+                             "max_seconds": round(entry["max_seconds"], 4)}
+                      for name, entry in self.stages.items()}
+        totals = {key: sum(entry[key] for entry in agents.values())
+                  for key in ("calls", "prompt_tokens", "cached_tokens", "completion_tokens", "retries", "cache_hits")}
+        totals["llm_seconds"] = round(sum(entry["seconds"] for entry in agents.values()), 3)
+        return {"wall_time": round(time.monotonic() - self.started, 3), "totals": totals,
+                "agents": agents, "stages": stages}
+
+
+def observe_stage(stage, seconds, run=None):
+    """
+    Records `seconds` spent in `stage`, for work that is not one contiguous block (see timed).
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if run is not None:
+        run.record_stage(stage, seconds)
+
+
+@contextmanager
+def timed(stage, run=None):
+    """
+    Times the enclosed block as `stage`, in the process-wide metrics and, if given, a RunMetrics.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, run)
@@ -0,0 +1,139 @@
+import os
+import json
+import logging
+import threading
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional; JSON routing files work without it
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "deepseek/deepseek-r1-distill-llama-70b"
+# Cheap, fast model for the small tasks: the verification verdict and the folder listing
+DEFAULT_FAST_MODEL = "meta-llama/llama-3.1-8b-instruct"
+DEFAULT_ROUTING_FILE = "model_routing.yaml"
+
+ROUTE_FIELDS = ("model", "temperature", "max_tokens", "timeout")
+
+# Built-in routes per agent role; "default" applies to every role and field not listed
+DEFAULT_ROUTES = {
+    "default": {"model": DEFAULT_MODEL, "temperature": 0.5, "max_tokens": None, "timeout": 60},
+    "ArchitectureBot": {},
+    "FlowStructureBot": {"model": DEFAULT_FAST_MODEL, "temperature": 0.2, "max_tokens": 2048, "timeout": 30},
+    "DevBot": {},
+    "VerificationBot": {"model": DEFAULT_FAST_MODEL, "temperature": 0.0, "max_tokens": 512, "timeout": 30},
+    "FinalizerBot": {},
+}
+
+
+class ModelRoute:
+    """
+    The model and request settings used for one agent role.
+    """
+    def __init__(self, model=DEFAULT_MODEL, temperature=0.5, max_tokens=None, timeout=60):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return f"ModelRoute({self.as_dict()})"
+
+
+def _coerce(field, value):
+    if value is None or value == "":
+        return None
+    if field == "model":
+        return str(value)
+    if field == "temperature":
+        return float(value)
+    return int(value)
+
+
+def load_routing_file(path):
+    """
+    Reads {role: {field: value}} from a YAML file (or a JSON file, which needs no PyYAML).
+    Returns {} if the file does not exist.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        data = json.loads(text)
+    elif yaml is None:
+        logger.warning(f"PyYAML is not installed; ignoring model routing file {path}.")
+        return {}
+    else:
+        data = yaml.safe_load(text) or {}
+    if not isinstance(data, dict):
+        raise ValueError(f"Model routing file {path} must map agent roles to settings.")
+    return data
+
+
+def _env_name(role):
+    return "" if role == "default" else f"_{role.upper()}"
+
+
+def build_routes(file_routes=None, environ=None):
+    """
+    Builds {role: ModelRoute}. Each field is taken from the first source that sets it, in this order:
+    the role's environment variable (e.g. MAS_MODEL_VERIFICATIONBOT), the role's section of the routing
+    file, the default environment variable (MAS_MODEL, MAS_TEMPERATURE, MAS_MAX_TOKENS, MAS_TIMEOUT),
+    the file's "default" section, the built-in role route and the built-in default.
+    """
+    environ = os.environ if environ is None else environ
+    file_routes = file_routes or {}
+
+    def env_settings(role):
+        names = {field: f"MAS_{field.upper()}{_env_name(role)}" for field in ROUTE_FIELDS}
+        return {field: environ[name] for field, name in names.items() if name in environ}
+
+    routes = {}
+    for role in list(DEFAULT_ROUTES) + [role for role in file_routes if role not in DEFAULT_ROUTES]:
+        # Lowest priority first
+        layers = [DEFAULT_ROUTES["default"], DEFAULT_ROUTES.get(role, {}),
+                  file_routes.get("default") or {}, env_settings("default")]
+        if role != "default":
+            layers += [file_routes.get(role) or {}, env_settings(role)]
+        values = {}
+        for layer in layers:
+            for field, value in layer.items():
+                if field not in ROUTE_FIELDS:
+                    raise ValueError(f"Unknown model routing field {field!r} for {role}.")
+                values[field] = _coerce(field, value)
+        routes[role] = ModelRoute(**values)
+    return routes
+
+
+_routes = None
+_routes_lock = threading.Lock()
+
+
+def get_route(role):
+    """
+    Returns the ModelRoute for an agent role (ArchitectureBot, FlowStructureBot, DevBot, VerificationBot,
+    FinalizerBot); unknown roles get the default route. The routing file is MAS_MODEL_CONFIG
+    (default model_routing.yaml), read once.
+    """
+    global _routes
+    with _routes_lock:
+        if _routes is None:
+            path = os.getenv("MAS_MODEL_CONFIG", DEFAULT_ROUTING_FILE)
+            _routes = build_routes(load_routing_file(path))
+            logger.info("Model routing: " + ", ".join(f"{role}={route.model}" for role, route in _routes.items()))
+        return _routes.get(role) or _routes["default"]
+
+
+def reset_routes():
+    """
+    Forgets the loaded routes, so the next get_route() reads the configuration again.
+    """
+    global _routes
+    with _routes_lock:
+        _routes = None
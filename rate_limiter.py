@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(messages):
+    """
+    Rough prompt size estimate (~4 characters per token) used before the real usage is known.
+    """
+    return sum(len(message.get("content") or "") for message in messages) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+    Callers reserve units up front; the bucket may go negative, and the returned
+    delay is how long the caller must wait before its reservation is covered.
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self._lock:
+            self._refill(time.monotonic())
+            # A single request larger than the bucket can never fit; only wait for a full bucket
+            amount = min(amount, self.capacity)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def adjust(self, amount):
+        """
+        Corrects a previous reservation once the real usage is known (positive = consume more).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+
+class SharedTokenBucket:
+    """
+    TokenBucket whose level is kept in a SQLite database, so every process using the same file
+    draws from one budget (e.g. the worker processes of batch_cli.py). Uses wall-clock time,
+    which, unlike time.monotonic(), is comparable between processes.
+    """
+    def __init__(self, path, key, per_minute):
+        self.path = path
+        self.key = key
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets ("
+                         " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _take(self, amount, clamp):
+        conn = self._connect()
+        # The write lock serializes the read-modify-write across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (self.key,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            tokens -= min(amount, self.capacity) if clamp else amount
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (self.key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return tokens
+
+    def reserve(self, amount):
+        tokens = self._take(amount, clamp=True)
+        if tokens >= 0:
+            return 0.0
+        return -tokens / self.rate
+
+    def adjust(self, amount):
+        self._take(amount, clamp=False)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets per model or provider.
+    Only delays a call when the budget would otherwise be exceeded.
+    With `shared_path`, the budgets are kept in that SQLite file and shared by all processes using it.
+    """
+    def __init__(self, default_rpm=0, default_tpm=0, overrides=None, shared_path=None):
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.overrides = overrides or {}
+        self.shared_path = shared_path
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _new_bucket(self, key, per_minute):
+        if not per_minute:
+            return None
+        if self.shared_path:
+            return SharedTokenBucket(self.shared_path, key, per_minute)
+        return TokenBucket(per_minute)
+
+    def _limits_for(self, model):
+        # Exact model first, then its provider prefix ("deepseek/..." -> "deepseek")
+        provider = model.split("/", 1)[0]
+        for key in (model, provider):
+            if key in self.overrides:
+                limits = self.overrides[key]
+                return key, limits.get("rpm", self.default_rpm), limits.get("tpm", self.default_tpm)
+        return model, self.default_rpm, self.default_tpm
+
+    def _buckets_for(self, model):
+        key, rpm, tpm = self._limits_for(model)
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = (
+                    self._new_bucket(f"{key}:requests", rpm),
+                    self._new_bucket(f"{key}:tokens", tpm),
+                )
+            return self._buckets[key]
+
+    def reserve(self, model, tokens):
+        """
+        Reserves one request and `tokens` tokens; returns the delay in seconds before the call may proceed.
+        """
+        request_bucket, token_bucket = self._buckets_for(model)
+        delay = 0.0
+        if request_bucket:
+            delay = max(delay, request_bucket.reserve(1))
+        if token_bucket:
+            delay = max(delay, token_bucket.reserve(tokens))
+        return delay
+
+    async def acquire(self, model, tokens):
+        if self.shared_path:
+            # The SQLite write lock may be held by another process; wait for it off the event loop
+            delay = await asyncio.to_thread(self.reserve, model, tokens)
+        else:
+            delay = self.reserve(model, tokens)
+        if delay > 0:
+            logger.info(f"Rate limit reached for {model}, waiting {delay:.2f}s.")
+            await asyncio.sleep(delay)
+        return delay
+
+    def record_usage(self, model, estimated_tokens, actual_tokens):
+        """
+        Charges the difference between the estimated and the reported token usage.
+        """
+        token_bucket = self._buckets_for(model)[1]
+        if token_bucket and actual_tokens is not None:
+            token_bucket.adjust(actual_tokens - estimated_tokens)
+
+    async def arecord_usage(self, model, estimated_tokens, actual_tokens):
+        """
+        record_usage() for callers on the event loop; shared budgets are updated in a worker thread.
+        """
+        if self.shared_path:
+            await asyncio.to_thread(self.record_usage, model, estimated_tokens, actual_tokens)
+        else:
+            self.record_usage(model, estimated_tokens, actual_tokens)
+
+
+def _load_overrides():
+    raw = os.getenv("MAS_RATE_LIMITS", "").strip()
+    if not raw:
+        return {}
+    try:
+        overrides = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Ignoring invalid MAS_RATE_LIMITS: {e}")
+        return {}
+    if not isinstance(overrides, dict):
+        logger.warning("Ignoring MAS_RATE_LIMITS: expected a JSON object.")
+        return {}
+    return overrides
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide limiter configured from the environment:
+      MAS_RPM_LIMIT / MAS_TPM_LIMIT  - default budgets per model (0 = unlimited)
+      MAS_RATE_LIMITS                - JSON overrides keyed by model or provider,
+                                       e.g. {"deepseek": {"rpm": 20, "tpm": 200000}}
+      MAS_RATE_LIMIT_DB              - SQLite file holding the budgets, shared by every process
+                                       that uses it (default: budgets are per process)
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                default_rpm=float(os.getenv("MAS_RPM_LIMIT", 0)),
+                default_tpm=float(os.getenv("MAS_TPM_LIMIT", 0)),
+                overrides=_load_overrides(),
+                shared_path=os.getenv("MAS_RATE_LIMIT_DB") or None,
+            )
+        return _limiter
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override with the matching MAS_CACHE_* environment variables)
+DEFAULT_CACHE_PATH = os.path.join(".mas_cache", "responses.sqlite")
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def make_cache_key(model, temperature, messages, response_format=None, max_tokens=None):
+    """
+    Content address of a chat request: the model, its temperature and the full message list
+    (the rendered system prompt is messages[0]), plus the response_format and max_tokens if set.
+    """
+    request = {"model": model, "temperature": temperature, "messages": messages}
+    if response_format is not None:
+        request["response_format"] = response_format
+    if max_tokens is not None:
+        request["max_tokens"] = max_tokens
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of chat completions with TTL expiry and size-bounded LRU eviction.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        dir_part = os.path.dirname(path)
+        if dir_part:
+            os.makedirs(dir_part, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Returns the cached value (a dict) or None when missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value):
+        """
+        Stores a JSON-serialisable value and evicts least recently used entries over the limits.
+        """
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+
+        count, total_size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and total_size <= self.max_bytes:
+            return
+
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total_size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logger.info(f"Response cache evicted {len(evicted)} entries.")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the process-wide cache configured from the environment, or None when disabled (MAS_CACHE_ENABLED=0).
+    """
+    global _cache
+    if os.getenv("MAS_CACHE_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                path=os.getenv("MAS_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=int(os.getenv("MAS_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                max_bytes=int(os.getenv("MAS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                ttl=float(os.getenv("MAS_CACHE_TTL", DEFAULT_TTL)),
+            )
+            logger.info(f"Response cache enabled at {_cache.path}.")
+        return _cache
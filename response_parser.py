@@ -0,0 +1,162 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+FENCE = "```"
+
+# Fence info strings accepted for a target language
+LANGUAGE_ALIASES = {
+    "python": ("python", "py", "python3"),
+    "javascript": ("javascript", "js", "jsx", "node"),
+    "typescript": ("typescript", "ts", "tsx"),
+    "java": ("java",),
+    "c++": ("c++", "cpp", "cc"),
+    "c#": ("c#", "csharp", "cs"),
+    "go": ("go", "golang"),
+    "ruby": ("ruby", "rb"),
+    "rust": ("rust", "rs"),
+}
+
+# Model prefixes that accept response_format={"type": "json_object"} (override with MAS_JSON_MODE_MODELS)
+DEFAULT_JSON_MODE_PREFIXES = ("openai/", "google/gemini", "mistralai/")
+
+
+class ResponseParseError(ValueError):
+    """
+    Raised when a completion does not contain the expected structure.
+    """
+
+
+def iter_fenced_blocks(text):
+    """
+    Yields (info, body, closed) for every ``` fenced block, scanning the text once.
+    A final block without a closing fence (a truncated completion) is yielded with closed=False.
+    """
+    pos = 0
+    while True:
+        start = text.find(FENCE, pos)
+        if start == -1:
+            return
+        line_end = text.find("\n", start + len(FENCE))
+        if line_end == -1:
+            return
+        info = text[start + len(FENCE):line_end].strip()
+        end = text.find(FENCE, line_end + 1)
+        if end == -1:
+            yield info, text[line_end + 1:], False
+            return
+        yield info, text[line_end + 1:end], True
+        pos = end + len(FENCE)
+
+
+def _matches_language(info, language):
+    if not info:
+        return False
+    tag = info.split()[0].lower()
+    language = language.lower()
+    return tag in LANGUAGE_ALIASES.get(language, (language,))
+
+
+def extract_code_block(text, language):
+    """
+    Returns the code of the first fenced block tagged with `language`, otherwise of the first
+    complete fenced block, otherwise of a truncated block; "" if the text has no fence.
+    """
+    first_closed = None
+    first_open = None
+    for info, body, closed in iter_fenced_blocks(text or ""):
+        if _matches_language(info, language):
+            return body.strip()
+        if closed and first_closed is None:
+            first_closed = body
+        elif not closed:
+            first_open = body
+    if first_closed is not None:
+        return first_closed.strip()
+    if first_open is not None:
+        logger.warning("Code block is missing its closing fence; using the truncated block.")
+        return first_open.strip()
+    return ""
+
+
+def iter_json_objects(text):
+    """
+    Yields every balanced top-level {...} span of the text in a single pass, skipping
+    braces that appear inside JSON strings.
+    """
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            # Quotes in prose around the object do not open strings
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield text[start:index + 1]
+
+
+def _load_object(candidate, required_key):
+    try:
+        # strict=False accepts raw newlines and tabs inside strings, a common model mistake in code values
+        data = json.loads(candidate, strict=False)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or (required_key and required_key not in data):
+        return None
+    return data
+
+
+def parse_json_object(text, required_key=None):
+    """
+    Extracts a JSON object from a completion: the whole text, a ```json fenced block, or the
+    first balanced object embedded in prose, in that order. If `required_key` is given, only
+    objects containing it are accepted. Raises ResponseParseError if nothing matches.
+    """
+    text = (text or "").strip()
+    if not text:
+        raise ResponseParseError("Empty response.")
+
+    data = _load_object(text, required_key)
+    if data is not None:
+        return data
+
+    for info, body, _ in iter_fenced_blocks(text):
+        if not info or info.split()[0].lower() == "json":
+            data = _load_object(body.strip(), required_key)
+            if data is not None:
+                return data
+
+    for candidate in iter_json_objects(text):
+        data = _load_object(candidate, required_key)
+        if data is not None:
+            return data
+
+    expected = f" with key '{required_key}'" if required_key else ""
+    raise ResponseParseError(f"No valid JSON object{expected} found in the response.")
+
+
+def json_response_format(model):
+    """
+    The response_format enabling JSON mode for `model`, or None if it is not known to support it.
+    """
+    raw = os.getenv("MAS_JSON_MODE_MODELS")
+    prefixes = [p.strip() for p in raw.split(",") if p.strip()] if raw is not None else DEFAULT_JSON_MODE_PREFIXES
+    if any(model.startswith(prefix) for prefix in prefixes):
+        return {"type": "json_object"}
+    return None
@@ -0,0 +1,223 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AuthenticationError,
+    PermissionDeniedError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Error classes
+RETRY = "retry"          # transient: retry the same model with backoff
+FALLBACK = "fallback"    # model-specific: skip straight to the next fallback model
+FATAL = "fatal"          # caller error (bad key, no access): give up immediately
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when every candidate model has an open circuit breaker.
+    """
+
+
+def classify_error(error):
+    """
+    Maps an OpenAI SDK error to a retry policy.
+    """
+    if isinstance(error, (AuthenticationError, PermissionDeniedError)):
+        return FATAL
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return RETRY
+    if isinstance(error, APIStatusError):
+        if error.status_code in (408, 409, 429) or error.status_code >= 500:
+            return RETRY
+        # 400/404/422: the model rejected the request or does not exist; another model may accept it
+        return FALLBACK
+    return FATAL
+
+
+def counts_toward_circuit(error):
+    """
+    Whether a failure says the model or provider is unhealthy: rate limits, server errors, timeouts
+    and connection failures. Rejected requests (400, 413 context too long...) are about one prompt,
+    so they must not open the circuit for everyone using the model.
+    """
+    if isinstance(error, APIConnectionError):  # Includes APITimeoutError
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code in (408, 429) or error.status_code >= 500)
+
+
+def retry_after_seconds(error):
+    """
+    Reads the Retry-After (or retry-after-ms) header of a failed response, if present.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff ("full jitter"), capped at max_delay.
+    """
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, error=None):
+        server_delay = retry_after_seconds(error) if error is not None else None
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds, then lets a single trial call through (half-open). Only failures that pass
+    counts_toward_circuit() are recorded.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_ignored(self):
+        """
+        Ends a half-open trial that failed for a reason unrelated to the model's health.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model):
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(
+                failure_threshold=int(os.getenv("MAS_CIRCUIT_FAILURE_THRESHOLD", 5)),
+                reset_timeout=float(os.getenv("MAS_CIRCUIT_RESET_TIMEOUT", 60)),
+            )
+        return _breakers[model]
+
+
+def get_retry_policy():
+    return RetryPolicy(
+        max_attempts=int(os.getenv("MAS_RETRY_ATTEMPTS", 4)),
+        base_delay=float(os.getenv("MAS_RETRY_BASE_DELAY", 1.0)),
+        max_delay=float(os.getenv("MAS_RETRY_MAX_DELAY", 30.0)),
+    )
+
+
+def get_fallback_models(model):
+    """
+    Ordered fallback models from MAS_FALLBACK_MODELS (comma separated), excluding `model` itself.
+    """
+    raw = os.getenv("MAS_FALLBACK_MODELS", "")
+    return [m.strip() for m in raw.split(",") if m.strip() and m.strip() != model]
+
+
+async def call_with_retries(make_call, models, policy=None, stats=None):
+    """
+    Calls `make_call(model)` for each model in order until one succeeds.
+    Transient errors are retried on the same model with backoff; model-specific errors
+    and exhausted retries move on to the next model; fatal errors are raised at once.
+    If `stats` is given, its `retries` and `model` attributes are updated.
+    """
+    policy = policy or get_retry_policy()
+    last_error = None
+
+    for model in models:
+        breaker = get_circuit_breaker(model)
+        for attempt in range(policy.max_attempts):
+            if not breaker.allow():
+                logger.warning(f"Circuit open for {model}, skipping.")
+                break
+            try:
+                response = await make_call(model)
+            except Exception as e:
+                policy_class = classify_error(e)
+                if counts_toward_circuit(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_ignored()
+                if policy_class == FATAL:
+                    raise
+                last_error = e
+                if policy_class == FALLBACK or attempt == policy.max_attempts - 1:
+                    logger.warning(f"{model} failed ({e}); trying the next model.")
+                    break
+                delay = policy.delay(attempt, e)
+                if stats is not None:
+                    stats.retries += 1
+                logger.warning(f"{model} failed ({e}); retry {attempt + 1} in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                continue
+
+            breaker.record_success()
+            if stats is not None:
+                stats.model = model
+            return response
+
+    if last_error is not None:
+        raise last_error
+    raise CircuitOpenError(f"All models unavailable: {', '.join(models)}")
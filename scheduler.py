@@ -0,0 +1,157 @@
+import os
+import queue
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Default number of files generated concurrently (override with MAS_MAX_WORKERS)
+DEFAULT_MAX_WORKERS = 4
+
+# File stems that usually only import from the rest of the project
+ENTRY_POINT_STEMS = {
+    "main", "app", "run", "server", "index", "manage", "wsgi", "asgi", "cli", "__main__",
+}
+# Dependency manifests list what the other files import, so they go last as well
+MANIFEST_FILES = {"requirements.txt", "package.json", "pom.xml", "build.gradle", "setup.py", "pyproject.toml"}
+
+# File stems that other modules usually import from
+FOUNDATION_STEMS = {
+    "__init__", "config", "settings", "constants", "utils", "util", "helpers", "helper",
+    "models", "model", "schema", "schemas", "database", "db", "exceptions", "errors", "logger",
+}
+
+
+def get_max_workers(max_workers=None):
+    """
+    Resolves the worker count from the argument or the MAS_MAX_WORKERS environment variable.
+    """
+    if max_workers is None:
+        try:
+            max_workers = int(os.getenv("MAS_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+        except ValueError:
+            logger.warning("Invalid MAS_MAX_WORKERS value, falling back to the default.")
+            max_workers = DEFAULT_MAX_WORKERS
+    return max(1, max_workers)
+
+
+def file_level(rel_path):
+    """
+    Assigns a file to a generation level:
+      0 - foundation modules (config, models, utilities, package markers)
+      1 - regular modules
+      2 - entry points and dependency manifests
+    Files on a level depend on every file of the levels below it.
+    """
+    base_name = os.path.basename(rel_path).lower()
+    stem = os.path.splitext(base_name)[0]
+    parent_dirs = [part.lower() for part in rel_path.replace("\\", "/").split("/")[:-1]]
+
+    if stem in ENTRY_POINT_STEMS or base_name in MANIFEST_FILES:
+        return 2
+    if stem in FOUNDATION_STEMS or any(part in ("config", "utils", "models") for part in parent_dirs):
+        return 0
+    return 1
+
+
+class DependencyScheduler:
+    """
+    Runs a worker for every node of a dependency graph on a thread pool.
+    A node is started as soon as all of its dependencies have finished (successfully or not).
+
+    The worker is called as worker(path, emit); everything passed to emit() is
+    yielded by run() in the order it was emitted, so callers can stream progress
+    while several files are being generated.
+
+    With `open_ended`, nodes can also be added with add() while run() is in progress (e.g. as a
+    streamed folder structure is parsed), and run() only returns after close() has been called
+    and every node has finished.
+    """
+    def __init__(self, graph, max_workers=None, open_ended=False):
+        self.graph = {path: set(deps) for path, deps in graph.items()}
+        self.max_workers = get_max_workers(max_workers)
+        self.open_ended = open_ended
+        self._events = queue.Queue()
+
+    def add(self, path, deps=()):
+        """
+        Adds a node to a running open-ended scheduler. Dependencies that are not part of the graph
+        are ignored; nodes already in the graph are not added twice.
+        """
+        self._events.put(("add", (path, set(deps))))
+
+    def close(self):
+        """
+        Marks an open-ended scheduler as complete: no more nodes will be added.
+        """
+        self._events.put(("close", None))
+
+    def emit(self, event):
+        """
+        Yields `event` from run(), for progress that does not come from a worker.
+        """
+        self._events.put(("event", event))
+
+    def run(self, worker):
+        remaining = {path: set(deps) for path, deps in self.graph.items()}
+        dependents = {path: [] for path in self.graph}
+        for path, deps in self.graph.items():
+            for dep in deps:
+                dependents[dep].append(path)
+
+        # Keep the original order for files that become ready at the same time
+        order = {path: index for index, path in enumerate(self.graph)}
+        running = set()
+        closed = not self.open_ended
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="file-worker") as pool:
+            def submit_ready():
+                ready = sorted((p for p, deps in remaining.items() if not deps), key=order.get)
+                for path in ready:
+                    del remaining[path]
+                    # Workers inherit the caller's context (the run ID attached to log records)
+                    pool.submit(contextvars.copy_context().run, self._run_node, worker, path)
+                    running.add(path)
+
+            submit_ready()
+            while running or not closed:
+                kind, payload = self._events.get()
+                if kind == "event":
+                    yield payload
+                    continue
+                if kind == "close":
+                    closed = True
+                    continue
+                if kind == "add":
+                    path, deps = payload
+                    if path in self.graph:
+                        continue
+                    # Only wait for dependencies that are known and still running or pending
+                    deps = {dep for dep in deps if dep in self.graph}
+                    self.graph[path] = deps
+                    order[path] = len(order)
+                    dependents[path] = []
+                    remaining[path] = {dep for dep in deps if dep in remaining or dep in running}
+                    for dep in remaining[path]:
+                        dependents[dep].append(path)
+                    submit_ready()
+                    continue
+
+                # kind == "done"
+                running.discard(payload)
+                for dependent in dependents[payload]:
+                    if dependent in remaining:
+                        remaining[dependent].discard(payload)
+                submit_ready()
+
+        if remaining:
+            logger.error(f"Dependency cycle detected, files not generated: {sorted(remaining)}")
+
+    def _run_node(self, worker, path):
+        try:
+            worker(path, lambda event: self._events.put(("event", event)))
+        except Exception as e:
+            logger.error(f"Worker failed for {path}: {e}")
+        finally:
+            self._events.put(("done", path))
@@ -0,0 +1,54 @@
+"""
+Production entry point for the Flask app.
+
+Serves app.py with gevent's WSGI server, where every request is a greenlet, so hundreds of
+open SSE connections share one OS thread instead of holding a thread each. The standard library is
+monkey-patched before anything else is imported.
+
+Sockets, DNS, SSL and sleep are patched. Threads, queues, select, os, subprocess and
+signals keep their blocking originals: the job manager's workers (MAS_JOB_WORKERS), the LLM event
+loop and the linter pool stay real OS threads, because asyncio keeps one running loop per OS thread
+and gevent's select, subprocess and child watchers only work on the main thread's hub. Generation,
+including its SQLite stores (response cache, budgets, rate limits), therefore never stalls the
+server. SSE subscribers poll for events with gevent.sleep instead of waiting on a thread condition;
+their job store reads are short queries on a database only this process writes.
+
+Requires gevent (pip install gevent). Usage: python serve.py [--host 0.0.0.0] [--port 5001]
+"""
+from gevent import monkey
+
+# Must run before any other import, or modules keep references to the blocking originals
+monkey.patch_all(thread=False, queue=False, select=False, os=False, subprocess=False, signal=False)
+
+import os
+import argparse
+import logging
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from app import app
+from jobs import get_job_manager
+
+logger = logging.getLogger("serve")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the multi-agent interface.")
+    parser.add_argument("--host", default=os.getenv("MAS_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MAS_PORT", 5001)))
+    args = parser.parse_args()
+
+    app.debug = False
+    os.makedirs("generated_project", exist_ok=True)
+    # Start the job workers (and resume interrupted jobs) before accepting requests
+    manager = get_job_manager()
+    # Subscribers are greenlets on the server thread: they must not block it on a thread condition
+    manager.sleep = gevent.sleep
+
+    logger.info(f"Serving on http://{args.host}:{args.port} with gevent.")
+    WSGIServer((args.host, args.port), app, log=None).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import posixpath
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override with the matching MAS_SIMILAR_* environment variables)
+DEFAULT_INDEX_PATH = os.path.join(".mas_cache", "similar_files.sqlite")
+DEFAULT_MAX_ENTRIES = 5000
+# Estimated similarity from which a prior file is reused as is (after local checks) ...
+DEFAULT_REUSE_THRESHOLD = 0.9
+# ... or passed to DevBot as a reference
+DEFAULT_REFERENCE_THRESHOLD = 0.3
+DEFAULT_REFERENCE_TOKENS = 600
+
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 3
+# Only the start of the architecture overview goes into the key; it names the stack and components
+ARCHITECTURE_SNIPPET_CHARS = 2000
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(1103)
+PERMUTATIONS = [(_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+                for _ in range(NUM_PERMUTATIONS)]
+
+# Boilerplate roles, matched against the file name in this order
+FILE_ROLES = (
+    ("dependencies", re.compile(r"^(requirements.*\.txt|package\.json|pom\.xml|build\.gradle|pyproject\.toml"
+                                r"|setup\.py|go\.mod|cargo\.toml|gemfile)$")),
+    ("entry_point", re.compile(r"^(main|app|run|server|index|manage|wsgi|asgi|cli|__main__)\.")),
+    ("config", re.compile(r"(config|settings|constants|env)")),
+    ("logging", re.compile(r"(^log(s|ger)?[._]|logging)")),
+    ("api_client", re.compile(r"(api|client|http|request)")),
+    ("database", re.compile(r"(database|db|repositor|dao)")),
+    ("models", re.compile(r"(model|schema|entit)")),
+    ("utils", re.compile(r"(util|helper|common)")),
+)
+
+
+def file_role(rel_path):
+    """
+    The kind of file, e.g. "config.py" or "dependencies.txt"; only files of the same role are compared.
+    """
+    base_name = posixpath.basename(rel_path).lower()
+    extension = posixpath.splitext(base_name)[1]
+    for role, pattern in FILE_ROLES:
+        if pattern.search(base_name):
+            return f"{role}{extension}"
+    return f"module{extension}"
+
+
+def is_boilerplate(rel_path):
+    """
+    Whether the file has one of the FILE_ROLES; only these may be reused as is in another project.
+    """
+    return not file_role(rel_path).startswith("module")
+
+
+def path_key(rel_path):
+    """
+    The path inside the project folder, which is named differently in every project.
+    """
+    parts = rel_path.replace("\\", "/").split("/")
+    return "/".join(parts[1:]) if len(parts) > 1 else rel_path
+
+
+def minhash(text):
+    """
+    MinHash signature of the word shingles of `text`.
+    """
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[index:index + SHINGLE_SIZE])
+                for index in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+              for shingle in shingles]
+    return [min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in PERMUTATIONS]
+
+
+def similarity(signature, other):
+    """
+    Estimated Jaccard similarity of the texts behind two signatures.
+    """
+    return sum(1 for left, right in zip(signature, other) if left == right) / NUM_PERMUTATIONS
+
+
+def index_key(rel_path, architecture_overview):
+    return f"{path_key(rel_path)}\n{(architecture_overview or '')[:ARCHITECTURE_SNIPPET_CHARS]}"
+
+
+class SimilarFile:
+    """
+    A previously generated file that matches a query.
+    """
+    def __init__(self, path, project_name, code, score):
+        self.path = path
+        self.project_name = project_name
+        self.code = code
+        self.score = score
+
+    def reference(self, max_tokens=DEFAULT_REFERENCE_TOKENS):
+        """
+        The code shortened to about `max_tokens` tokens, for use as a few-shot example.
+        """
+        limit = max_tokens * 4
+        if len(self.code) <= limit:
+            return self.code
+        return self.code[:limit].rsplit("\n", 1)[0] + "\n# ... (truncated)"
+
+
+class SimilarityIndex:
+    """
+    SQLite-backed index of generated files that passed their review, keyed by file role, path
+    and architecture snippet. Lookups compare MinHash signatures of the keys, so near-identical
+    files (config modules, logging setup, dependency lists) from earlier projects can be found offline.
+
+    Every file records the `owner` (user) of the run that generated it, and lookups only return the
+    owner's own files unless `shared` is set, so one user's code never ends up in another's project.
+    """
+    def __init__(self, path=DEFAULT_INDEX_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        dir_part = os.path.dirname(path)
+        if dir_part:
+            os.makedirs(dir_part, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " key TEXT PRIMARY KEY,"
+            " role TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " project_name TEXT NOT NULL,"
+            " signature TEXT NOT NULL,"
+            " code TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " owner TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "owner" not in columns:
+            # Files indexed before owners were recorded belong to nobody: only shared lookups see them
+            self._conn.execute("ALTER TABLE files ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_role ON files (role, language)")
+        self._conn.commit()
+
+    def add(self, rel_path, architecture_overview, language, code, owner=""):
+        signature = minhash(index_key(rel_path, architecture_overview))
+        owner = owner or ""
+        key = hashlib.sha256(f"{owner}\n{file_role(rel_path)}\n{path_key(rel_path)}\n{code}".encode("utf-8")).hexdigest()
+        project_name = rel_path.replace("\\", "/").split("/")[0]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files"
+                " (key, role, language, path, project_name, signature, code, last_used, owner)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, file_role(rel_path), language.lower(), path_key(rel_path), project_name,
+                 json.dumps(signature), code, time.time(), owner),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def find(self, rel_path, architecture_overview, language, owner="", shared=False):
+        """
+        Returns the most similar indexed file of the same role and language generated for `owner`
+        (or for anyone, with `shared`), or None.
+        """
+        signature = minhash(index_key(rel_path, architecture_overview))
+        query = "SELECT key, path, project_name, signature, code FROM files WHERE role = ? AND language = ?"
+        params = (file_role(rel_path), language.lower())
+        if not shared:
+            query += " AND owner = ?"
+            params += (owner or "",)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        best, best_key = None, None
+        for key, path, project_name, stored, code in rows:
+            score = similarity(signature, json.loads(stored))
+            if best is None or score > best.score:
+                best, best_key = SimilarFile(path, project_name, code, score), key
+        if best is not None:
+            with self._lock:
+                self._conn.execute("UPDATE files SET last_used = ? WHERE key = ?", (time.time(), best_key))
+                self._conn.commit()
+        return best
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("DELETE FROM files WHERE key IN (SELECT key FROM files ORDER BY last_used ASC LIMIT ?)",
+                               (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.commit()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def get_reuse_threshold():
+    return _env_float("MAS_SIMILAR_REUSE_THRESHOLD", DEFAULT_REUSE_THRESHOLD)
+
+
+def get_reference_threshold():
+    return _env_float("MAS_SIMILAR_REFERENCE_THRESHOLD", DEFAULT_REFERENCE_THRESHOLD)
+
+
+def get_reference_tokens():
+    return int(_env_float("MAS_SIMILAR_REFERENCE_TOKENS", DEFAULT_REFERENCE_TOKENS))
+
+
+def shared_index_enabled():
+    """
+    Whether lookups may return files generated for other users (MAS_SIMILAR_SHARED=1; default off).
+    """
+    return os.getenv("MAS_SIMILAR_SHARED", "0").lower() in ("1", "true", "yes")
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index():
+    """
+    Returns the process-wide index configured from the environment, or None when disabled (MAS_SIMILAR_INDEX=0).
+    """
+    global _index
+    if os.getenv("MAS_SIMILAR_INDEX", "1").lower() in ("0", "false", "no"):
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex(
+                path=os.getenv("MAS_SIMILAR_PATH", DEFAULT_INDEX_PATH),
+                max_entries=int(os.getenv("MAS_SIMILAR_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+            logger.info(f"Similar file index enabled at {_index.path}.")
+        return _index
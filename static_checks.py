@@ -0,0 +1,241 @@
+import os
+import ast
+import sys
+import shutil
+import logging
+import builtins
+import threading
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Optional linter run on generated Python files (MAS_LINTER: auto, ruff, pyflakes or off)
+DEFAULT_LINTER = "auto"
+DEFAULT_LINT_WORKERS = 2
+LINT_TIMEOUT = 20
+# Style-only findings that do not make a file wrong
+IGNORED_LINT_CODES = ("F401", "F541", "F841")
+IGNORED_PYFLAKES_MESSAGES = ("imported but unused", "is assigned to but never used",
+                             "f-string is missing placeholders")
+
+# Names a project file inside the project folder must not claim (sys.stdlib_module_names is 3.10+)
+STDLIB_MODULES = frozenset(getattr(sys, "stdlib_module_names", ()))
+
+MODULE_GLOBALS = {"__file__", "__builtins__", "__spec__", "__loader__", "__path__", "__package__",
+                  "__annotations__", "__cached__"}
+
+_lint_pool = None
+_lint_pool_lock = threading.Lock()
+
+
+def is_python(file_path):
+    return file_path.endswith(".py")
+
+
+def check_syntax(file_path, code):
+    """
+    Returns a list of issues (empty if the code compiles). Only Python is checked.
+    """
+    if not is_python(file_path):
+        return []
+    try:
+        compile(code, file_path, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return [f"SyntaxError at line {e.lineno}: {e.msg}"]
+    except ValueError as e:  # e.g. null bytes in the source
+        return [f"Invalid source: {e}"]
+    return []
+
+
+def _module_names(rel_path):
+    """
+    The dotted names a project file can be imported as: from the project root and from inside
+    the top-level project folder (generated code uses both styles). Deeper suffixes are not
+    importable, so a nested "utils/email.py" does not claim the standard library's "email".
+    """
+    parts = rel_path[:-len(".py")].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return {".".join(parts[index:]) for index in (0, 1) if parts[index:]}
+
+
+def _resolve_relative(file_path, module, level):
+    # Relative imports start at the file's package, named from the project root
+    base = os.path.dirname(file_path).split("/") if os.path.dirname(file_path) else []
+    if level > 1:
+        base = base[:-(level - 1)] if level - 1 <= len(base) else []
+    parts = base + (module.split(".") if module else [])
+    return ".".join(part for part in parts if part)
+
+
+def check_imports(file_path, code, known_paths, tree=None):
+    """
+    Reports imports of project modules that do not resolve to any file in `known_paths`
+    (the files of the flow structure). Third-party and standard library imports are ignored:
+    an import counts as a project import when it is relative, starts with the project folder, or
+    starts with a module or folder inside it whose name is not a standard library module (a
+    project "email.py" does not make "from email.mime.text import MIMEText" a project import).
+    """
+    if not is_python(file_path):
+        return []
+    if tree is None:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return []
+
+    module_names = set()
+    for path in known_paths:
+        if is_python(path):
+            module_names |= _module_names(path)
+    packages = {name.rsplit(".", 1)[0] for name in module_names if "." in name}
+    importable = module_names | packages
+    project_folders = {path.split("/")[0] for path in known_paths}
+    top_level = {name.split(".")[0] for name in importable}
+    top_level = {name for name in top_level if name in project_folders or name not in STDLIB_MODULES}
+
+    issues = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name.split(".")[0] in top_level and alias.name not in importable:
+                    issues.append(f"Line {node.lineno}: import {alias.name} does not match any project file")
+        elif isinstance(node, ast.ImportFrom):
+            module = _resolve_relative(file_path, node.module, node.level) if node.level else node.module
+            if not module or module.split(".")[0] not in top_level or module in importable:
+                continue
+            issues.append(f"Line {node.lineno}: from {module} import ... does not match any project file")
+    return issues
+
+
+def _bound_names(tree):
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.alias):
+            names.add(node.asname or node.name.split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+        elif getattr(node, "name", None) and type(node).__name__ in ("TypeVar", "ParamSpec", "TypeVarTuple"):
+            names.add(node.name)
+    return names
+
+
+def check_undefined_names(file_path, code, tree=None):
+    """
+    Reports names that are read but never bound anywhere in the file and are not builtins.
+    Scopes are not modelled, so only names that cannot resolve at all are reported.
+    """
+    if not is_python(file_path):
+        return []
+    if tree is None:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return []
+    if any(isinstance(node, ast.ImportFrom) and any(a.name == "*" for a in node.names) for node in ast.walk(tree)):
+        # A star import can bind anything
+        return []
+
+    known = _bound_names(tree) | set(dir(builtins)) | MODULE_GLOBALS
+    issues = []
+    reported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in known:
+            if node.id not in reported:
+                reported.add(node.id)
+                issues.append(f"Line {node.lineno}: undefined name '{node.id}'")
+    return issues
+
+
+def get_linter():
+    """
+    The linter command prefix to use, or None. ruff is preferred over pyflakes in auto mode.
+    """
+    choice = os.getenv("MAS_LINTER", DEFAULT_LINTER).strip().lower()
+    if choice in ("auto", "ruff") and shutil.which("ruff"):
+        return ["ruff", "check", "--quiet", "--no-cache", "--output-format", "concise", "--select", "F",
+                "--ignore", ",".join(IGNORED_LINT_CODES)]
+    if choice in ("auto", "pyflakes") and importlib.util.find_spec("pyflakes") is not None:
+        return [sys.executable, "-m", "pyflakes"]
+    if choice not in ("auto", "off", "none", ""):
+        logger.warning(f"Linter {choice!r} is not installed; skipping lint checks.")
+    return None
+
+
+def _get_lint_pool():
+    # Bounds the number of linter subprocesses running at once across concurrently generated files
+    global _lint_pool
+    with _lint_pool_lock:
+        if _lint_pool is None:
+            try:
+                workers = int(os.getenv("MAS_LINT_WORKERS", DEFAULT_LINT_WORKERS))
+            except ValueError:
+                workers = DEFAULT_LINT_WORKERS
+            _lint_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="lint")
+        return _lint_pool
+
+
+def _run_linter(command, file_path, code):
+    if command[0] == "ruff":
+        command = command + ["--stdin-filename", file_path, "-"]
+    try:
+        result = subprocess.run(command, input=code, capture_output=True, text=True, timeout=LINT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Linter failed on {file_path}: {e}")
+        return []
+    issues = []
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if not line or any(message in line for message in IGNORED_PYFLAKES_MESSAGES):
+            continue
+        # "<path or <stdin>>:line:col: message" -> "Line N: message"
+        parts = line.split(":", 3)
+        if len(parts) == 4 and parts[1].isdigit():
+            issues.append(f"Line {parts[1]}: {parts[3].strip()}")
+        elif not line.startswith("Found "):
+            issues.append(line)
+    return issues
+
+
+def lint(file_path, code):
+    """
+    Runs the optional linter (ruff or pyflakes) in the subprocess pool. Returns [] if none is available.
+    """
+    if not is_python(file_path):
+        return []
+    command = get_linter()
+    if command is None:
+        return []
+    return _get_lint_pool().submit(_run_linter, command, file_path, code).result()
+
+
+def run_local_checks(file_path, code, known_paths):
+    """
+    Fast, model-free checks of a generated file. Returns a list of issue strings.
+    Project imports are not checked when `known_paths` is None (the project's files are not all known yet).
+    """
+    issues = check_syntax(file_path, code)
+    if issues or not is_python(file_path):
+        return issues
+    tree = ast.parse(code)
+    issues = check_imports(file_path, code, known_paths, tree) if known_paths is not None else []
+    issues += check_undefined_names(file_path, code, tree)
+    # The linter repeats undefined names with the same wording; keep one of each
+    for issue in lint(file_path, code):
+        if issue not in issues:
+            issues.append(issue)
+    return issues